@@ -0,0 +1,62 @@
+"""
+JSON responses for list endpoints.
+
+Handlers that build every item as a plain dict of JSON-ready values return
+them through json_list_response() instead of a Pydantic model per row. That
+skips model construction and the second validation and encoding pass
+FastAPI runs for `response_model`. Items are encoded with orjson when it is
+installed.
+
+Pass a generator over the query result: up to JSON_STREAM_THRESHOLD items
+are sent as one body; longer lists are sent as a chunked stream, pulling,
+building and encoding JSON_STREAM_CHUNK_ROWS items at a time, so neither
+the list of dicts nor the full body is held in memory. The rows themselves
+are still fetched in full by the (buffered) database result.
+
+Keep `response_model` on such routes for the OpenAPI schema; FastAPI does
+not apply it to a returned Response.
+"""
+import json
+import os
+from itertools import chain, islice
+from typing import Iterable, Iterator, Optional
+
+from fastapi.responses import Response, StreamingResponse
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+JSON_STREAM_THRESHOLD = int(os.getenv("JSON_STREAM_THRESHOLD", "2000"))
+JSON_STREAM_CHUNK_ROWS = int(os.getenv("JSON_STREAM_CHUNK_ROWS", "1000"))
+
+
+if orjson is not None:
+    def dumps(value) -> bytes:
+        return orjson.dumps(value)
+else:
+    def dumps(value) -> bytes:
+        return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def _chunks(items: Iterator[dict], chunk_rows: int) -> Iterator[bytes]:
+    yield b"["
+    separator = b""
+    while True:
+        chunk = list(islice(items, chunk_rows))
+        if not chunk:
+            break
+        # Encode a slice as one array and drop its brackets
+        yield separator + dumps(chunk)[1:-1]
+        separator = b","
+    yield b"]"
+
+
+def json_list_response(items: Iterable[dict], headers: Optional[dict] = None) -> Response:
+    items = iter(items)
+    head = list(islice(items, JSON_STREAM_THRESHOLD + 1))
+    if len(head) <= JSON_STREAM_THRESHOLD:
+        return Response(content=dumps(head), media_type="application/json", headers=headers)
+    return StreamingResponse(_chunks(chain(head, items), JSON_STREAM_CHUNK_ROWS), media_type="application/json",
+                             headers=headers)
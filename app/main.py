@@ -1,36 +1,56 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, status
-from fastapi.security import HTTPBearer
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response, status
+from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime, timedelta
-from database import engine, Base, get_db
-from models import User
+from database import engine, get_db, get_read_db, AsyncSessionLocal, warm_up_pool, replica_engine, replica_monitor
+from migrations import ensure_schema
+from logging_config import setup_logging
+from metrics import registry, register_pool_gauges, MetricsMiddleware
+from fast_json import json_list_response
+from models import User, Subscription, VpnUsage, Plan
+from services.site_config import site_config_cache, load_site_config
+from services.passwords import password_hasher, PasswordHasherBusy
+from services.token_cache import token_cache
+from services.principals import principal_cache, Principal
+from services.stats import stats_rollup
+from services.profiles import get_profile
+from services.admin_users import fetch_users_page, InvalidCursor, ADMIN_USERS_PAGE_SIZE, ADMIN_USERS_MAX_PAGE_SIZE
+from services.marzban import marzban
+from services.provisioning import provisioning_queue
+from services.purchases import purchase_plan, run_idempotency_key_purger, PurchaseError, IdempotencyConflict
+from services.plans import plan_catalog, PLANS_MAX_AGE
+from services.admission import (
+    AdmissionMiddleware, RateLimited, check_identity, telegram_auth_is_fresh, telegram_replay_cache, too_many_requests,
+)
+from services.usage import usage_sync, USAGE_SYNC_ENABLED
+from services.telegram_login import upsert_telegram_user
+from services.refresh_tokens import (
+    RefreshTokenInvalid, issue_refresh_token, revoke_user_refresh_tokens, rotate_refresh_token, run_refresh_token_purger,
+)
+from services.subscription_export import subscription_feed_cache, parse_subscription_token, subscription_url, RENDERERS
 from contextlib import asynccontextmanager
+import asyncio
+import logging
 import os
 import hashlib
 import hmac
 from urllib.parse import parse_qs
 from sqlalchemy import select
-from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+setup_logging()
+auth_logger = logging.getLogger("tssvpn.auth")
 
 # JWT configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -43,12 +63,44 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Create tables on startup
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    # Only reads the schema version unless migrations are pending
+    await ensure_schema(engine)
+    await warm_up_pool(engine)
+    # Loads the /admin/stats counters, then keeps correcting their drift
+    reconciler = asyncio.create_task(stats_rollup.run_reconciler())
+    async with AsyncSessionLocal() as db:
+        await plan_catalog.load(db)
+    plan_refresher = asyncio.create_task(plan_catalog.run_refresher())
+    refresh_token_purger = asyncio.create_task(run_refresh_token_purger())
+    idempotency_key_purger = asyncio.create_task(run_idempotency_key_purger())
+    replica_checker = None
+    if replica_engine is not None:
+        await replica_monitor.check()
+        replica_checker = asyncio.create_task(replica_monitor.run())
+    provisioning_queue.start()
+    # Nothing to copy in mock mode (no MARZBAN_URL)
+    usage_syncer = None
+    if USAGE_SYNC_ENABLED and marzban.base_url:
+        usage_syncer = asyncio.create_task(usage_sync.run())
     yield
+    reconciler.cancel()
+    plan_refresher.cancel()
+    refresh_token_purger.cancel()
+    idempotency_key_purger.cancel()
+    if replica_checker:
+        replica_checker.cancel()
+        await replica_engine.dispose()
+    if usage_syncer:
+        usage_syncer.cancel()
+    await provisioning_queue.stop()
+    password_hasher.shutdown()
+    await marzban.close()
 
 app = FastAPI(title="TssVPN API", lifespan=lifespan)
+# Per-IP limit on the auth routes; inside MetricsMiddleware so rejections are counted
+app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+register_pool_gauges(engine)
 
 # CORS Configuration
 origins = ["*"]  # For development; restrict in production
@@ -59,12 +111,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
 
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    # Shed load instead of queueing more bcrypt work behind a full pool
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Authentication service is busy, please retry"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.exception_handler(RateLimited)
+async def rate_limited_handler(request: Request, exc: RateLimited):
+    return too_many_requests(exc.retry_after)
+
 # Pydantic Models
 class UserRegister(BaseModel):
     username: str
     password: str
+    email: Optional[str] = None
 
 class UserLogin(BaseModel):
     username: str
@@ -73,6 +140,10 @@ class UserLogin(BaseModel):
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class UserProfile(BaseModel):
     id: int
@@ -93,6 +164,18 @@ class VPNPlan(BaseModel):
     price: float
     description: str
 
+class PlanUpdate(BaseModel):
+    name: str
+    duration_days: int
+    price: float
+    description: str = ""
+    is_active: bool = True
+    is_public: bool = True
+    sort_order: int = 0
+
+class PlanAdmin(PlanUpdate):
+    id: str
+
 class PurchaseRequest(BaseModel):
     plan_id: str
 
@@ -102,6 +185,15 @@ class VPNKey(BaseModel):
     status: str
     expires_at: str
 
+class KeyUsage(BaseModel):
+    id: str
+    name: str
+    status: str  # Marzban status, "pending" until the first sync after provisioning
+    used_traffic: int
+    data_limit: Optional[int] = None
+    online: bool
+    updated_at: Optional[str] = None  # last time the sync saw a change
+
 class SiteConfigUpdate(BaseModel):
     bot_welcome_message: Optional[str] = None
     site_title: Optional[str] = None
@@ -122,11 +214,20 @@ class UserUpdate(BaseModel):
 async def root():
     return {"message": "TssVPN Backend is running", "style": "Soviet"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(await registry.expose(), media_type="text/plain; version=0.0.4")
+
 # --- AUTH IMPLEMENTATION ---
 @app.post("/auth/register", response_model=Token)
 async def register_new(user: UserRegister, db: AsyncSession = Depends(get_db)):
+    check_identity("register", user.username)
     # Check if user already exists
-    stmt = select(User).where((User.username == user.username) | (User.email == user.email))
+    condition = User.username == user.username
+    if user.email:
+        condition = condition | (User.email == user.email)
+    stmt = select(User).where(condition)
     result = await db.execute(stmt)
     existing_user = result.scalar_one_or_none()
     
@@ -134,7 +235,7 @@ async def register_new(user: UserRegister, db: AsyncSession = Depends(get_db)):
         raise HTTPException(status_code=400, detail="User with this username or email already exists")
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     db_user = User(
         tg_id=None,  # Will be filled when user connects Telegram account
         username=user.username,
@@ -146,6 +247,8 @@ async def register_new(user: UserRegister, db: AsyncSession = Depends(get_db)):
     db.add(db_user)
     await db.commit()
     await db.refresh(db_user)
+    principal_cache.invalidate(tg_id=db_user.tg_id, username=db_user.username)
+    stats_rollup.record_user_created()
     
     # Generate JWT token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -153,22 +256,36 @@ async def register_new(user: UserRegister, db: AsyncSession = Depends(get_db)):
         data={"sub": str(db_user.username), "type": "web"},
         expires_delta=access_token_expires
     )
+    refresh_token = issue_refresh_token(db, db_user.tg_id, str(db_user.username), "web")
+    await db.commit()
     
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
 
 @app.post("/auth/login", response_model=Token)
 async def login_new(user: UserLogin, db: AsyncSession = Depends(get_db)):
+    # Caps password guessing against one account, whatever the source IPs
+    check_identity("login", user.username)
     # Find user by username
     stmt = select(User).where(User.username == user.username)
     result = await db.execute(stmt)
     db_user = result.scalar_one_or_none()
     
-    if not db_user or not verify_password(user.password, db_user.password_hash):
+    if not db_user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    valid, new_hash = await password_hasher.verify_and_update(user.password, db_user.password_hash)
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Rehash transparently when BCRYPT_ROUNDS has changed
+    if new_hash:
+        db_user.password_hash = new_hash
+
     # Update last login
     db_user.last_login = datetime.utcnow()
+    refresh_token = issue_refresh_token(db, db_user.tg_id, str(db_user.username), "web")
     await db.commit()
+    principal_cache.invalidate(tg_id=db_user.tg_id, username=db_user.username)
     
     # Generate JWT token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -177,24 +294,48 @@ async def login_new(user: UserLogin, db: AsyncSession = Depends(get_db)):
         expires_delta=access_token_expires
     )
     
-    return {"access_token": access_token, "token_type": "bearer"}
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": refresh_token}
+
+@app.post("/auth/refresh", response_model=Token)
+async def refresh_access_token(body: RefreshRequest, db: AsyncSession = Depends(get_db)):
+    """
+    Exchange a refresh token for a new access token and a new refresh token.
+    The presented refresh token stops working; presenting it again revokes
+    the whole login session.
+    """
+    try:
+        grant = await rotate_refresh_token(db, body.refresh_token)
+    except RefreshTokenInvalid:
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    access_token = create_access_token(
+        data={"sub": grant.subject, "type": grant.token_type},
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    )
+    return {"access_token": access_token, "token_type": "bearer", "refresh_token": grant.refresh_token}
 
 # --- USER STUBS ---
 oauth2_scheme = HTTPBearer()
 
-def get_current_user_from_token(token: str = Depends(oauth2_scheme)):
+async def get_current_user_from_token(credentials: HTTPAuthorizationCredentials = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
+    token = credentials.credentials
+
+    # Tokens seen before skip the HS256 verification and JSON parsing
+    user_id = token_cache.get(token)
+    if user_id is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            user_id: str = payload.get("sub")
+            if user_id is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+        token_cache.put(token, user_id, payload.get("exp"))
     
     try:
         user_id_int = int(user_id)
@@ -205,83 +346,152 @@ def get_current_user_from_token(token: str = Depends(oauth2_scheme)):
     
     return user_id_int
 
+optional_oauth2_scheme = HTTPBearer(auto_error=False)
+
+async def get_optional_user_from_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_oauth2_scheme)):
+    """Like get_current_user_from_token, but None when no token is sent."""
+    if credentials is None:
+        return None
+    return await get_current_user_from_token(credentials)
+
+# Shared with the bot, sent as X-Bot-Secret: lets it read the site config and
+# buy on behalf of a tg_id without a user token
+BOT_API_SECRET = os.getenv("BOT_API_SECRET", "")
+
+def is_bot_request(bot_secret: Optional[str]) -> bool:
+    return bool(BOT_API_SECRET and bot_secret) and hmac.compare_digest(bot_secret.encode(), BOT_API_SECRET.encode())
+
 async def get_current_admin(current_user_id = Depends(get_current_user_from_token), db: AsyncSession = Depends(get_db)):
-    if isinstance(current_user_id, int):
-        stmt = select(User).where(User.tg_id == current_user_id)
-    else:
-        stmt = select(User).where(User.username == current_user_id)
-        
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
+    # Parallel admin requests share one cached snapshot instead of one query each
+    user = await principal_cache.get(db, current_user_id)
     if not user or not user.is_admin:
         raise HTTPException(status_code=403, detail="Admin access required")
     return user
 
+async def get_current_principal(current_user_id = Depends(get_current_user_from_token), db: AsyncSession = Depends(get_db)) -> Principal:
+    """
+    The caller's snapshot, resolved by tg_id or username (web logins carry the username).
+    Always read through the primary: principal_cache is process-wide, and a user
+    missing from a lagging replica would stay cached as missing for every handler.
+    """
+    principal = await principal_cache.get(db, current_user_id)
+    if principal is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return principal
+
 # --- ADMIN ENDPOINTS ---
 from sqlalchemy import func
 
 @app.get("/admin/stats", response_model=AdminStats)
-async def get_admin_stats(admin: User = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
-    user_count_stmt = select(func.count(User.tg_id))
-    user_count = (await db.execute(user_count_stmt)).scalar()
-    
-    active_subs_stmt = select(func.count(Subscription.id)).where(Subscription.expiry_date > datetime.utcnow())
-    active_subs = (await db.execute(active_subs_stmt)).scalar()
-    
-    revenue_stmt = select(func.sum(Transaction.amount)).where(Transaction.status == "Completed")
-    revenue = (await db.execute(revenue_stmt)).scalar() or 0.0
-    
+async def get_admin_stats(admin: Principal = Depends(get_current_admin), db: AsyncSession = Depends(get_read_db)):
+    # Served from counters maintained by the write paths (services/stats.py)
+    await stats_rollup.ensure_loaded(db)
     return AdminStats(
-        total_users=user_count,
-        active_subscriptions=active_subs,
-        total_revenue=revenue
+        total_users=stats_rollup.total_users,
+        active_subscriptions=stats_rollup.active_subscriptions,
+        total_revenue=stats_rollup.total_revenue
     )
 
 @app.get("/admin/users", response_model=List[UserProfile])
-async def get_admin_users(admin: User = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
-    stmt = select(User).order_by(User.created_at.desc())
+async def get_admin_users(
+    limit: int = Query(ADMIN_USERS_PAGE_SIZE, ge=1, le=ADMIN_USERS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    admin: Principal = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Users newest first, one page at a time.
+    Pass the X-Next-Cursor response header back as `cursor` to get the next
+    page; the header is absent on the last page.
+    """
+    try:
+        rows, next_cursor = await fetch_users_page(db, limit, cursor)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+
+    # Plain dicts in the UserProfile shape, built and encoded a chunk at a time (see fast_json.py)
+    return json_list_response((
+        {
+            "id": row.tg_id or 0,
+            "username": row.username or f"user_{row.tg_id}",
+            "balance": row.balance or 0.0,
+            "status": "Active" if row.active_keys else "Inactive",
+            "keys_count": row.active_keys or 0,
+            "is_admin": bool(row.is_admin),
+            "first_name": row.first_name,
+            "last_name": row.last_name,
+            "avatar_url": row.avatar_url,
+            "created_at": row.created_at.isoformat() if row.created_at else None,
+        }
+        for row in rows
+    ), headers=headers)
+
+@app.patch("/admin/users/{user_id}")
+async def update_admin_user(user_id: int, update: UserUpdate, admin: Principal = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
+    stmt = select(User).where(User.tg_id == user_id)
     result = await db.execute(stmt)
-    users = result.scalars().all()
-    
-    profiles = []
-    for user in users:
-        profiles.append(UserProfile(
-            id=user.tg_id or 0,
-            username=user.username or f"user_{user.tg_id}",
-            balance=user.balance,
-            status="Active" if user.tg_id else "Inactive", # Simplified
-            keys_count=0, # Simplified for list
-            is_admin=user.is_admin,
-            first_name=user.first_name,
-            last_name=user.last_name,
-            avatar_url=user.avatar_url,
-            created_at=user.created_at.isoformat() if user.created_at else None
-        ))
-    return profiles
+    user = result.scalar_one_or_none()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    if update.balance is not None:
+        user.balance = update.balance
+    if update.is_admin is not None:
+        user.is_admin = update.is_admin
+    if update.is_banned is not None:
+        user.is_banned = update.is_banned
+        if update.is_banned:
+            await revoke_user_refresh_tokens(db, user.tg_id)
+
+    await db.commit()
+    principal_cache.invalidate(tg_id=user.tg_id, username=user.username)
+    subscription_feed_cache.invalidate(user.tg_id)
+    return {"message": "User updated"}
+
+@app.get("/admin/plans", response_model=List[PlanAdmin])
+async def get_admin_plans(admin: Principal = Depends(get_current_admin)):
+    return [plan._asdict() for plan in plan_catalog.plans.values()]
+
+@app.put("/admin/plans/{plan_id}")
+async def upsert_plan(plan_id: str, update: PlanUpdate, admin: Principal = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
+    plan = await db.get(Plan, plan_id)
+    if plan is None:
+        plan = Plan(id=plan_id)
+        db.add(plan)
+    for field, value in update.model_dump().items():
+        setattr(plan, field, value)
+
+    await db.commit()
+    await plan_catalog.load(db)
+    return {"message": "Plan saved"}
 
 @app.get("/admin/config")
-async def get_site_config(admin: User = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
-    stmt = select(SiteConfig).limit(1)
-    result = await db.execute(stmt)
-    config = result.scalar_one_or_none()
-    
-    if not config:
-        config = SiteConfig()
-        db.add(config)
-        await db.commit()
-        await db.refresh(config)
-    
-    return config
+async def get_site_config(
+    request: Request,
+    bot_secret: Optional[str] = Header(None, alias="X-Bot-Secret"),
+    current_user_id = Depends(get_optional_user_from_token),
+    db: AsyncSession = Depends(get_db),
+):
+    """Read by admins (bearer token) and by the bot (X-Bot-Secret), which polls it with If-None-Match."""
+    if not is_bot_request(bot_secret):
+        if current_user_id is None:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        user = await principal_cache.get(db, current_user_id)
+        if not user or not user.is_admin:
+            raise HTTPException(status_code=403, detail="Admin access required")
+
+    config = await site_config_cache.get(db)
+    headers = {"ETag": config.etag, "Cache-Control": "no-cache"}
+
+    if request.headers.get("if-none-match") == config.etag:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=config.body, media_type="application/json", headers=headers)
 
 @app.post("/admin/config")
-async def update_site_config(update: SiteConfigUpdate, admin: User = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
-    stmt = select(SiteConfig).limit(1)
-    result = await db.execute(stmt)
-    config = result.scalar_one_or_none()
-    
-    if not config:
-        config = SiteConfig()
-        db.add(config)
+async def update_site_config(update: SiteConfigUpdate, admin: Principal = Depends(get_current_admin), db: AsyncSession = Depends(get_db)):
+    config = await load_site_config(db)
     
     if update.bot_welcome_message is not None:
         config.bot_welcome_message = update.bot_welcome_message
@@ -293,82 +503,148 @@ async def update_site_config(update: SiteConfigUpdate, admin: User = Depends(get
         config.support_link = update.support_link
         
     await db.commit()
+    site_config_cache.invalidate()
     return {"message": "Config updated"}
 
 @app.get("/users/me", response_model=UserProfile)
-async def get_current_user(current_user_id: int = Depends(get_current_user_from_token), db: AsyncSession = Depends(get_db)):
-    stmt = select(User).where(User.tg_id == current_user_id)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
+async def get_current_user(current_user_id: int = Depends(get_current_user_from_token), db: AsyncSession = Depends(get_read_db)):
+    profile = await get_profile(db, current_user_id)
     
-    if not user:
+    if not profile:
         raise HTTPException(status_code=404, detail="User not found")
     
-    # Calculate subscription status and count
-    import datetime
-    now = datetime.datetime.now()
-    sub_stmt = select(Subscription).where(Subscription.user_id == user.tg_id).order_by(Subscription.expiry_date.desc())
-    sub_result = await db.execute(sub_stmt)
-    latest_subscription = sub_result.scalar_one_or_none()
-    
-    status = "Inactive"
-    keys_count = 0
-    if latest_subscription and latest_subscription.expiry_date > now:
-        keys_count = 1  # Assume 1 key per active subscription
-        status = "Active"
-    
     return UserProfile(
-        id=user.tg_id,
-        username=user.username or f"user_{user.tg_id}",
-        balance=user.balance,
-        status=status,
-        keys_count=keys_count,
-        is_admin=user.is_admin,
-        first_name=user.first_name,
-        last_name=user.last_name,
-        avatar_url=user.avatar_url,
-        created_at=user.created_at.isoformat() if user.created_at else None
+        id=profile.tg_id,
+        username=profile.username or f"user_{profile.tg_id}",
+        balance=profile.balance,
+        status=profile.status,
+        keys_count=profile.keys_count,
+        is_admin=profile.is_admin,
+        first_name=profile.first_name,
+        last_name=profile.last_name,
+        avatar_url=profile.avatar_url,
+        created_at=profile.created_at.isoformat() if profile.created_at else None
     )
 
 @app.get("/users/keys", response_model=List[VPNKey])
-async def get_my_keys(current_user_id: int = Depends(get_current_user_from_token), db: AsyncSession = Depends(get_db)):
-    # Fetch real subscriptions
-    stmt = select(Subscription).where(Subscription.user_id == current_user_id).order_by(Subscription.expiry_date.desc())
+async def get_my_keys(principal: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_read_db)):
+    stmt = (
+        select(Subscription.id, Subscription.tariff_name, Subscription.expiry_date)
+        .where(Subscription.user_id == principal.tg_id)
+        .order_by(Subscription.expiry_date.desc())
+    )
     result = await db.execute(stmt)
-    subscriptions = result.scalars().all()
-    
-    keys = []
     now = datetime.now()
-    
-    for sub in subscriptions:
-        status_str = "Expired"
-        if sub.expiry_date > now:
-            status_str = "Active"
-            
-        keys.append(VPNKey(
-            id=str(sub.id),
-            name=sub.tariff_name,
-            status=status_str,
-            expires_at=sub.expiry_date.strftime("%Y-%m-%d")
-        ))
-        
-    return keys
 
-# --- SHOP STUBS ---
-@app.get("/shop/plans", response_model=List[VPNPlan])
-async def get_plans():
+    return json_list_response((
+        {
+            "id": str(sub_id),
+            "name": tariff_name,
+            "status": "Active" if expiry_date > now else "Expired",
+            "expires_at": expiry_date.strftime("%Y-%m-%d"),
+        }
+        for sub_id, tariff_name, expiry_date in result
+    ))
+
+@app.get("/users/subscription")
+async def get_my_subscription_urls(principal: Principal = Depends(get_current_principal)):
+    """Feed URLs to paste into a VPN client, one per supported format."""
+    url = subscription_url(principal.tg_id)
+    return {fmt: f"{url}?format={fmt}" for fmt in RENDERERS}
+
+@app.get("/sub/{token}")
+async def get_subscription_feed(token: str, request: Request, fmt: Literal["base64", "clash", "singbox"] = Query("base64", alias="format")):
+    """Public feed polled by VPN clients; answered from cache without DB access when unchanged."""
+    tg_id = parse_subscription_token(token)
+    if tg_id is None:
+        raise HTTPException(status_code=404, detail="Subscription not found")
+
+    feed = await subscription_feed_cache.get(tg_id, fmt)
+    headers = {"ETag": feed.etag, "Last-Modified": feed.last_modified, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match == feed.etag:
+            return Response(status_code=304, headers=headers)
+    elif request.headers.get("if-modified-since") == feed.last_modified:
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=feed.body, media_type=feed.media_type, headers=headers)
+
+# Seen by Marzban within this window counts as online
+ONLINE_WINDOW = timedelta(minutes=3)
+
+@app.get("/users/usage", response_model=List[KeyUsage])
+async def get_my_usage(principal: Principal = Depends(get_current_principal), db: AsyncSession = Depends(get_read_db)):
+    """Traffic per key, as of the last usage sync (never calls Marzban)."""
+    stmt = (
+        select(Subscription.id, Subscription.tariff_name, VpnUsage.status, VpnUsage.used_traffic,
+               VpnUsage.data_limit, VpnUsage.online_at, VpnUsage.updated_at)
+        .outerjoin(VpnUsage, VpnUsage.subscription_id == Subscription.id)
+        .where(Subscription.user_id == principal.tg_id)
+        .order_by(Subscription.expiry_date.desc())
+    )
+    result = await db.execute(stmt)
+    online_since = datetime.utcnow() - ONLINE_WINDOW
+
     return [
-        VPNPlan(id="plan_1m", name="1 Month Pass", duration_days=30, price=100.0, description="Basic access for 30 days."),
-        VPNPlan(id="plan_3m", name="3 Months Pass", duration_days=90, price=250.0, description="Standard access for 90 days. Save 16%."),
-        VPNPlan(id="plan_1y", name="1 Year Pass", duration_days=365, price=900.0, description="Premium access for 365 days. Best value.")
+        KeyUsage(
+            id=str(row.id),
+            name=row.tariff_name,
+            status=row.status or "pending",
+            used_traffic=row.used_traffic or 0,
+            data_limit=row.data_limit,
+            online=bool(row.online_at and row.online_at > online_since),
+            updated_at=row.updated_at.isoformat() if row.updated_at else None
+        )
+        for row in result
     ]
 
+# --- SHOP STUBS ---
+@app.get("/shop/plans", response_model=List[VPNPlan])
+async def get_plans(request: Request):
+    # Pre-serialized by the catalog; nothing is built per request
+    headers = {"ETag": plan_catalog.etag, "Cache-Control": f"public, max-age={PLANS_MAX_AGE}"}
+    if request.headers.get("if-none-match") == plan_catalog.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=plan_catalog.body, media_type="application/json", headers=headers)
+
 @app.post("/shop/buy")
-async def buy_plan(purchase: PurchaseRequest):
-    # Mock purchase
-    if purchase.plan_id == "error":
-        raise HTTPException(status_code=400, detail="Purchase failed. Insufficient funds.")
-    return {"message": f"Successfully purchased plan {purchase.plan_id}. Key issued."}
+async def buy_plan(
+    purchase: Optional[PurchaseRequest] = None,
+    tg_id: Optional[int] = None,
+    plan_id: Optional[str] = None,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    bot_secret: Optional[str] = Header(None, alias="X-Bot-Secret"),
+    current_user_id = Depends(get_optional_user_from_token),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Buy or renew a plan. The site sends {"plan_id"} as JSON with a bearer
+    token; the bot sends tg_id and plan_id as query parameters with the
+    X-Bot-Secret header.
+    """
+    plan_id = purchase.plan_id if purchase else plan_id
+    if not plan_id:
+        raise HTTPException(status_code=422, detail="plan_id is required")
+
+    if current_user_id is not None:
+        principal = await principal_cache.get(db, current_user_id)
+        if principal is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        tg_id = principal.tg_id
+    elif tg_id is None or not is_bot_request(bot_secret):
+        raise HTTPException(status_code=401, detail="Not authenticated")
+
+    try:
+        result = await purchase_plan(db, tg_id, plan_id, idempotency_key)
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except PurchaseError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    headers = {"Idempotent-Replayed": "true"} if result.replayed else None
+    return JSONResponse(content=result.response, headers=headers)
 
 
 # --- TELEGRAM LOGIN ---
@@ -377,7 +653,12 @@ import hmac
 import time
 from urllib.parse import parse_qs
 
-def verify_telegram_login(auth_data: dict, bot_token: str) -> bool:
+BOT_TOKEN = os.getenv("BOT_TOKEN")
+# Login Widget HMAC key, derived once: SHA256 of the bot token
+TELEGRAM_LOGIN_SECRET = hashlib.sha256(BOT_TOKEN.encode()).digest() if BOT_TOKEN else None
+
+
+def verify_telegram_login(auth_data: dict, secret_key: bytes) -> bool:
     """
     Verifies the authenticity of the Telegram Login data.
     See: https://core.telegram.org/widgets/login#checking-authorization
@@ -386,7 +667,7 @@ def verify_telegram_login(auth_data: dict, bot_token: str) -> bool:
     """
     received_hash = auth_data.get('hash', '')
     if not received_hash:
-        print("No hash in auth_data")
+        auth_logger.debug("Telegram auth data without hash")
         return False
 
     # Create a copy to avoid modifying original
@@ -394,10 +675,6 @@ def verify_telegram_login(auth_data: dict, bot_token: str) -> bool:
     # Remove hash from the copy for verification
     auth_data_copy.pop('hash', None)
     
-    # Print for debugging
-    print(f"Received auth_data: {auth_data}")
-    print(f"Received hash: {received_hash}")
-    
     # Sort the parameters alphabetically by key
     sorted_items = sorted(auth_data_copy.items())
     # Remove photo_url from data if it's an empty string. Telegram omits fields with empty values in the signature string.
@@ -409,22 +686,20 @@ def verify_telegram_login(auth_data: dict, bot_token: str) -> bool:
     # Join them with newline character as per Telegram Login specification
     # NOT with & as commonly mistaken
     data_check_string = '\n'.join([f'{k}={v}' for k, v in sorted_items])
-    
-    print(f"Data check string: {data_check_string}")
-
-    # For Telegram Login Widget, create secret key using SHA256 of the bot token
-    # according to original Telegram Login specification
-    secret_key = hashlib.sha256(bot_token.encode()).digest()
 
     # Create HMAC-SHA256 signature of the data_check_string using the secret_key
     calculated_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
-    
-    print(f"Calculated hash: {calculated_hash}")
-    print(f"Received hash: {received_hash}")
 
     # Compare the received hash with the calculated hash
     result = hmac.compare_digest(calculated_hash, received_hash)
-    print(f"Verification result: {result}")
+    if auth_logger.isEnabledFor(logging.DEBUG):
+        auth_logger.debug("Telegram auth verification", extra={"fields": {
+            "tg_id": auth_data.get('id'),
+            "data_check_string": data_check_string,
+            "calculated_hash": calculated_hash,
+            "received_hash": received_hash,
+            "valid": result,
+        }})
     
     return result
 
@@ -438,22 +713,27 @@ async def telegram_auth_callback(request: Request, db: AsyncSession = Depends(ge
     # Get raw body to parse manually, as FastAPI's Request.form() might consume it once
     body_bytes = await request.body()
     body_str = body_bytes.decode()
-    print(f"Raw request body: {body_str}")
     # Parse with keep_blank_values=True to preserve empty parameters like photo_url=
     parsed_data = parse_qs(body_str, keep_blank_values=True)
-    print(f"Parsed data: {parsed_data}")
 
     # parse_qs returns values as lists, get the first item
     auth_data = {k: v[0] for k, v in parsed_data.items()}
-    print(f"Final auth_data: {auth_data}")
+    auth_logger.debug("Telegram auth callback", extra={"fields": {"auth_data": auth_data}})
+
+    if not telegram_auth_is_fresh(auth_data.get('auth_date')):
+        raise HTTPException(status_code=400, detail="Telegram login data has expired.")
 
     # Verify the login data
-    bot_token = os.getenv("BOT_TOKEN") # Use the BOT_TOKEN from env
-    if not bot_token:
+    if TELEGRAM_LOGIN_SECRET is None:
         raise HTTPException(status_code=500, detail="Bot token not configured on server side.")
 
-    if not verify_telegram_login(auth_data.copy(), bot_token): # Pass a copy to avoid modifying original
+    if not verify_telegram_login(auth_data.copy(), TELEGRAM_LOGIN_SECRET): # Pass a copy to avoid modifying original
         raise HTTPException(status_code=400, detail="Invalid Telegram login data.")
+    # Only signed payloads count against the id, so forged ones cannot lock its owner out
+    check_identity("telegram", auth_data['id'])
+    # Each signed payload is accepted once (no await since the check above, so no race)
+    if not telegram_replay_cache.add(auth_data['hash']):
+        raise HTTPException(status_code=409, detail="Telegram login data was already used.")
 
     # Extract user info
     user_id = int(auth_data['id'])
@@ -462,43 +742,20 @@ async def telegram_auth_callback(request: Request, db: AsyncSession = Depends(ge
     username = auth_data.get('username', '')
     photo_url = auth_data.get('photo_url', '')
 
-    # Check if user exists in DB
-    stmt = select(User).where(User.tg_id == user_id)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
-
-    if not user:
-        # Create user if doesn't exist
-        user = User(
-            tg_id=user_id,
-            username=username,
-            first_name=first_name,
-            last_name=last_name,
-            avatar_url=photo_url,
-            created_at=datetime.utcnow()
-        )
-        db.add(user)
-        await db.commit()
-        await db.refresh(user)
-    else:
-        # Update user data if changed
-        updated = False
-        if user.first_name != first_name:
-            user.first_name = first_name
-            updated = True
-        if user.last_name != last_name:
-            user.last_name = last_name
-            updated = True
-        if user.username != username:
-            user.username = username
-            updated = True
-        if user.avatar_url != photo_url:
-            user.avatar_url = photo_url
-            updated = True
-        
-        if updated:
-            await db.commit()
-            await db.refresh(user)
+    login = await upsert_telegram_user(db, user_id, {
+        "username": username,
+        "first_name": first_name,
+        "last_name": last_name,
+        "avatar_url": photo_url,
+    })
+    user = login.user
+    refresh_token = issue_refresh_token(db, user.tg_id, str(user.tg_id), "telegram")
+    # One commit for the profile upsert and the refresh token
+    await db.commit()
+    if login.written:
+        principal_cache.invalidate(tg_id=user.tg_id, username=user.username)
+    if login.created:
+        stats_rollup.record_user_created()
 
     # Generate JWT token
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -511,6 +768,7 @@ async def telegram_auth_callback(request: Request, db: AsyncSession = Depends(ge
         "ok": True,
         "access_token": access_token,
         "token_type": "bearer",
+        "refresh_token": refresh_token,
         "user": {
             "id": user.tg_id,
             "username": user.username,
@@ -527,7 +785,7 @@ async def telegram_auth_callback(request: Request, db: AsyncSession = Depends(ge
 from sqlalchemy import select
 
 @app.get("/users/check/{user_id}")
-async def check_user_compatibility(user_id: int, db: AsyncSession = Depends(get_db)):
+async def check_user_compatibility(user_id: int, db: AsyncSession = Depends(get_read_db)):
     """Check if user exists in DB."""
     stmt = select(User).where(User.tg_id == user_id)
     result = await db.execute(stmt)
@@ -541,82 +799,17 @@ async def check_user_compatibility(user_id: int, db: AsyncSession = Depends(get_
 
 
 @app.get("/users/profile/{user_id}")
-async def get_profile_compatibility(user_id: int, db: AsyncSession = Depends(get_db)):
+async def get_profile_compatibility(user_id: int, db: AsyncSession = Depends(get_read_db)):
     """Get user profile for old bot."""
-    stmt = select(User).where(User.tg_id == user_id)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
-    if not user:
+    profile = await get_profile(db, user_id)
+    if not profile:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # Calculate subscription expiry from Subscriptions table if exists
-    # For now, mock values or get from related Subscription
-    expiry_date = "No subscription"
-    keys_count = 0
-    status = "Inactive" # or Active if subscription is active
-
-    # Get active subscription if any
-    # Assuming latest non-expired sub is the active one
-    import datetime
-    now = datetime.datetime.now()
-    sub_stmt = select(Subscription).where(Subscription.user_id == user_id).order_by(Subscription.expiry_date.desc())
-    sub_result = await db.execute(sub_stmt)
-    latest_subscription = sub_result.scalar_one_or_none()
-    if latest_subscription and latest_subscription.expiry_date > now:
-        expiry_date = latest_subscription.expiry_date.isoformat()
-        keys_count = 1 # Assume 1 key per active sub for old bot logic
-        status = "Active"
-
     profile_data = {
-        "balance": user.balance,
-        "status": status,
-        "subscription_expiry": expiry_date,
-        "keys_count": keys_count
+        "balance": profile.balance,
+        "status": profile.status,
+        "subscription_expiry": profile.subscription_expiry.isoformat() if profile.subscription_expiry else "No subscription",
+        "keys_count": profile.keys_count
     }
     return profile_data
 
-
-@app.post("/shop/buy")
-async def buy_plan_compatibility(tg_id: int, plan_id: str, db: AsyncSession = Depends(get_db)):
-    """Handle purchase from old bot. Creates a subscription entry."""
-    # Find the plan (this is mock, we can fetch from a static list or DB)
-    # For compatibility, map plan_id to duration and price
-    plan_mapping = {
-        "plan_1m": {"duration_days": 30, "price": 100.0},
-        "plan_3m": {"duration_days": 90, "price": 250.0},
-        "plan_1y": {"duration_days": 365, "price": 900.0},
-        "plan_12m": {"duration_days": 365, "price": 2490.0}, # Added for compatibility with tssvpn_bot
-        # Add others if needed
-    }
-    plan_details = plan_mapping.get(plan_id)
-    if not plan_details:
-        raise HTTPException(status_code=400, detail="Plan not found")
-
-    # Check if user exists, if not, create
-    stmt = select(User).where(User.tg_id == tg_id)
-    result = await db.execute(stmt)
-    user = result.scalar_one_or_none()
-    if not user:
-        # Create user if doesn't exist
-        user = User(tg_id=tg_id, username=f"user_{tg_id}")
-        db.add(user)
-        await db.commit()
-        await db.refresh(user)
-
-    # Calculate expiry date
-    import datetime
-    expiry_date = datetime.datetime.now() + datetime.timedelta(days=plan_details["duration_days"])
-
-    # Create a subscription record
-    subscription = Subscription(
-        user_id=user.tg_id,
-        tariff_name=plan_id,
-        expiry_date=expiry_date,
-        config_link="" # Will be generated by Marzban integration later
-    )
-    db.add(subscription)
-    await db.commit()
-
-    # TODO: Integrate with Marzban here to create the actual key/service
-    # For now, just return a success message and a mock payment URL
-    return {"message": f"Plan {plan_id} purchased successfully for user {tg_id}.", "url": f"http://mock-payment-success.com/{tg_id}/{plan_id}"}
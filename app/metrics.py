@@ -0,0 +1,222 @@
+"""
+Minimal Prometheus metrics for the backend.
+
+Metrics are updated from the event loop only, so recording is a dict lookup
+and an addition with no locking. A scrape copies the current values on the
+loop (cheap) and renders the text exposition format in a worker thread.
+"""
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, labels: LabelValues = (), amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def snapshot(self):
+        return dict(self._values)
+
+    def render(self, values) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in values.items()
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 callback: Optional[Callable[[], Dict[LabelValues, float]]] = None):
+        super().__init__(name, documentation, labelnames)
+        # Optional function returning {labels: value}, evaluated at scrape time
+        self.callback = callback
+
+    def set(self, labels: LabelValues, value: float):
+        self._values[labels] = value
+
+    def dec(self, labels: LabelValues = (), amount: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) - amount
+
+    def snapshot(self):
+        if self.callback is not None:
+            return dict(self.callback())
+        return dict(self._values)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        # labels -> [per-bucket counts (non-cumulative)..., sum]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, labels: LabelValues, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * len(self.buckets) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self):
+        return {labels: list(series) for labels, series in self._series.items()}
+
+    def render(self, values) -> List[str]:
+        lines = []
+        for labels, series in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                le = 'le="%s"' % _format_value(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def _render(self, snapshots) -> str:
+        lines = []
+        for metric, values in snapshots:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render(values))
+        return "\n".join(lines) + "\n"
+
+    async def expose(self) -> str:
+        # Copy on the loop, where the values are written; format off it
+        snapshots = [(metric, metric.snapshot()) for metric in self.metrics]
+        return await run_in_threadpool(self._render, snapshots)
+
+
+registry = Registry()
+
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status code", ("method", "route", "status"),
+))
+http_request_duration_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template and status code",
+    ("method", "route", "status"),
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served",
+))
+marzban_request_duration_seconds = registry.register(Histogram(
+    "marzban_request_duration_seconds", "Latency of Marzban API calls by client method", ("method",),
+))
+marzban_errors_total = registry.register(Counter(
+    "marzban_errors_total", "Failed Marzban API calls by client method", ("method",),
+))
+db_pool_checkout_seconds = registry.register(Histogram(
+    "db_pool_checkout_seconds", "Time spent waiting for a pooled DB connection (including connecting)",
+))
+provisioning_queue_depth = registry.register(Gauge(
+    "provisioning_queue_depth", "Provisioning jobs waiting to be processed, as of the last poll",
+))
+provisioning_jobs_total = registry.register(Counter(
+    "provisioning_jobs_total", "Provisioning attempts by outcome (done, retry, stale, failed)", ("result",),
+))
+provisioning_job_latency_seconds = registry.register(Histogram(
+    "provisioning_job_latency_seconds", "Time from purchase to a provisioned VPN user",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0),
+))
+auth_refresh_total = registry.register(Counter(
+    "auth_refresh_total", "Refresh token exchanges by outcome (ok, invalid, expired, reused, banned)", ("result",),
+))
+
+
+def register_pool_gauges(engine):
+    """Expose SQLAlchemy pool occupancy for an AsyncEngine."""
+    pool = engine.sync_engine.pool
+
+    def read(attribute):
+        def callback():
+            method = getattr(pool, attribute, None)
+            return {(): method()} if method else {}
+        return callback
+
+    registry.register(Gauge("db_pool_size", "Configured size of the DB connection pool", callback=read("size")))
+    registry.register(Gauge("db_pool_checked_out", "DB connections currently checked out", callback=read("checkedout")))
+    registry.register(Gauge("db_pool_overflow", "DB connections opened beyond the pool size (negative until the pool is full)", callback=read("overflow")))
+    registry.register(Gauge("db_pool_checked_in", "Idle DB connections in the pool", callback=read("checkedin")))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording count, latency and in-flight requests.
+    Requests are labelled with the matched route template (e.g.
+    /users/profile/{user_id}) so label cardinality stays bounded.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            labels = (scope["method"], getattr(route, "path", "<unmatched>"), str(status_code))
+            http_requests_total.inc(labels)
+            http_request_duration_seconds.observe(labels, elapsed)
@@ -0,0 +1,343 @@
+"""
+Versioned schema migrations.
+
+Each migration is an async function run against a connection; the highest
+applied version is recorded in the `schema_version` table. At boot the app
+only reads that number (one query) and applies whatever is pending.
+
+Migrations describe the schema as it was at that version, using their own
+Table objects, so they keep working after models.py moves on.
+
+Apply manually (e.g. before rolling out several workers):
+    python migrations.py
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Awaitable, Callable, List, NamedTuple
+
+from sqlalchemy import (
+    BigInteger, Boolean, Column, DateTime, Float, ForeignKey, Index, Integer,
+    MetaData, String, Table, Text, text,
+)
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+logger = logging.getLogger(__name__)
+
+# Set to "false" to refuse to boot on an outdated schema instead of migrating
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() == "true"
+
+# Arbitrary key for the Postgres advisory lock that serializes migrators
+MIGRATION_LOCK_ID = 7_260_001
+
+
+class Migration(NamedTuple):
+    version: int
+    description: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+
+
+class SchemaOutdated(RuntimeError):
+    pass
+
+
+# --- 1: baseline ---
+
+def _baseline_metadata() -> MetaData:
+    """Tables exactly as the app created them before migrations existed."""
+    metadata = MetaData()
+    Table(
+        "users", metadata,
+        Column("tg_id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True),
+        Column("username", String, unique=True, nullable=True),
+        Column("first_name", String, nullable=True),
+        Column("last_name", String, nullable=True),
+        Column("avatar_url", String, nullable=True),
+        Column("balance", Float),
+        Column("created_at", DateTime),
+        Column("is_banned", Boolean),
+        Column("email", String, unique=True, nullable=True),
+        Column("password_hash", String, nullable=True),
+        Column("is_verified", Boolean),
+        Column("last_login", DateTime, nullable=True),
+        Column("is_admin", Boolean),
+    )
+    Table(
+        "subscriptions", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("user_id", BigInteger, ForeignKey("users.tg_id")),
+        Column("tariff_name", String),
+        Column("expiry_date", DateTime),
+        Column("config_link", String),
+    )
+    Table(
+        "site_configs", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("bot_welcome_message", String),
+        Column("site_title", String),
+        Column("site_announcement", String, nullable=True),
+        Column("support_link", String),
+    )
+    Table(
+        "servers", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("location_name", String),
+        Column("ip_address", String),
+        Column("status", String),
+        Column("load_percentage", Float),
+    )
+    Table(
+        "transactions", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("user_id", BigInteger, ForeignKey("users.tg_id")),
+        Column("amount", Float),
+        Column("payment_method", String),
+        Column("status", String),
+        Column("created_at", DateTime),
+    )
+    return metadata
+
+
+async def _baseline(conn: AsyncConnection):
+    # checkfirst: databases created by the old create_all already have these
+    await conn.run_sync(_baseline_metadata().create_all, checkfirst=True)
+
+
+# --- 2: indexes for the hot queries ---
+
+async def _hot_path_indexes(conn: AsyncConnection):
+    metadata = _baseline_metadata()
+    users = metadata.tables["users"]
+    subscriptions = metadata.tables["subscriptions"]
+    transactions = metadata.tables["transactions"]
+    indexes = [
+        # /users/me, /users/keys, /users/profile: a user's subscriptions by expiry
+        Index("ix_subscriptions_user_id_expiry_date", subscriptions.c.user_id, subscriptions.c.expiry_date),
+        # /admin/stats: active subscriptions (expiry_date > now)
+        Index("ix_subscriptions_expiry_date", subscriptions.c.expiry_date),
+        # /admin/stats: completed revenue, answered from the index alone
+        Index("ix_transactions_status", transactions.c.status, transactions.c.amount),
+        # a user's transactions, newest first
+        Index("ix_transactions_user_id_created_at", transactions.c.user_id, transactions.c.created_at),
+        # /admin/users: keyset pagination on (created_at, tg_id)
+        Index("ix_users_created_at_tg_id", users.c.created_at, users.c.tg_id),
+    ]
+    for index in indexes:
+        await conn.run_sync(lambda sync_conn, index=index: index.create(sync_conn, checkfirst=True))
+
+
+# --- 3: provisioning outbox ---
+
+async def _provisioning_jobs(conn: AsyncConnection):
+    metadata = MetaData()
+    # Referenced table only, for the foreign key
+    Table("subscriptions", metadata, Column("id", Integer, primary_key=True))
+    jobs = Table(
+        "provisioning_jobs", metadata,
+        Column("id", Integer, primary_key=True, index=True),
+        Column("subscription_id", Integer, ForeignKey("subscriptions.id"), nullable=False),
+        Column("status", String, nullable=False),
+        Column("attempts", Integer, nullable=False),
+        Column("next_attempt_at", DateTime, nullable=False),
+        Column("last_error", String, nullable=True),
+        Column("created_at", DateTime),
+        Column("completed_at", DateTime, nullable=True),
+        Index("ix_provisioning_jobs_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+    await conn.run_sync(lambda sync_conn: metadata.create_all(sync_conn, tables=[jobs], checkfirst=True))
+
+
+# --- 4: usage copied from Marzban ---
+
+async def _vpn_usage(conn: AsyncConnection):
+    metadata = MetaData()
+    usage = Table(
+        "vpn_usage", metadata,
+        Column("username", String, primary_key=True),
+        Column("subscription_id", Integer, nullable=True, index=True),
+        Column("status", String),
+        Column("used_traffic", BigInteger),
+        Column("data_limit", BigInteger, nullable=True),
+        Column("expire_at", DateTime, nullable=True),
+        Column("online_at", DateTime, nullable=True),
+        Column("updated_at", DateTime),
+    )
+    await conn.run_sync(lambda sync_conn: metadata.create_all(sync_conn, tables=[usage], checkfirst=True))
+
+
+# --- 5: idempotent purchases ---
+
+async def _idempotency_keys(conn: AsyncConnection):
+    metadata = MetaData()
+    keys = Table(
+        "idempotency_keys", metadata,
+        Column("user_id", BigInteger, primary_key=True),
+        Column("key", String, primary_key=True),
+        Column("request_fingerprint", String, nullable=False),
+        Column("response_body", Text, nullable=True),
+        Column("created_at", DateTime, index=True),
+    )
+    await conn.run_sync(lambda sync_conn: metadata.create_all(sync_conn, tables=[keys], checkfirst=True))
+
+
+# --- 6: plan catalog ---
+
+async def _plans(conn: AsyncConnection):
+    metadata = MetaData()
+    plans = Table(
+        "plans", metadata,
+        Column("id", String, primary_key=True),
+        Column("name", String, nullable=False),
+        Column("duration_days", Integer, nullable=False),
+        Column("price", Float, nullable=False),
+        Column("description", String),
+        Column("is_active", Boolean),
+        Column("is_public", Boolean),
+        Column("sort_order", Integer),
+    )
+    await conn.run_sync(lambda sync_conn: metadata.create_all(sync_conn, tables=[plans], checkfirst=True))
+    # The plans previously hardcoded in get_plans and buy_plan_compatibility
+    await conn.execute(plans.insert(), [
+        {"id": "plan_1m", "name": "1 Month Pass", "duration_days": 30, "price": 100.0,
+         "description": "Basic access for 30 days.", "is_active": True, "is_public": True, "sort_order": 10},
+        {"id": "plan_3m", "name": "3 Months Pass", "duration_days": 90, "price": 250.0,
+         "description": "Standard access for 90 days. Save 16%.", "is_active": True, "is_public": True, "sort_order": 20},
+        {"id": "plan_1y", "name": "1 Year Pass", "duration_days": 365, "price": 900.0,
+         "description": "Premium access for 365 days. Best value.", "is_active": True, "is_public": True, "sort_order": 30},
+        # Sold only through tssvpn_bot, not listed in the shop
+        {"id": "plan_12m", "name": "12 Months", "duration_days": 365, "price": 2490.0,
+         "description": "", "is_active": True, "is_public": False, "sort_order": 40},
+    ])
+
+
+# --- 7: refresh tokens ---
+
+async def _refresh_tokens(conn: AsyncConnection):
+    metadata = MetaData()
+    tokens = Table(
+        "refresh_tokens", metadata,
+        Column("id", Integer, primary_key=True),
+        Column("token_hash", String, unique=True, nullable=False),
+        Column("family_id", String, nullable=False, index=True),
+        Column("user_id", BigInteger, nullable=False, index=True),
+        Column("subject", String, nullable=False),
+        Column("token_type", String, nullable=False),
+        Column("created_at", DateTime),
+        Column("expires_at", DateTime, nullable=False, index=True),
+        Column("revoked_at", DateTime, nullable=True),
+    )
+    await conn.run_sync(lambda sync_conn: metadata.create_all(sync_conn, tables=[tokens], checkfirst=True))
+
+
+# --- 8: share links for the subscription feeds ---
+
+async def _subscription_proxy_links(conn: AsyncConnection):
+    await conn.execute(text("ALTER TABLE subscriptions ADD COLUMN proxy_links TEXT"))
+    # Re-provision active subscriptions: Marzban answers 409, the user is
+    # updated and its share links are stored
+    now = datetime.utcnow()
+    await conn.execute(
+        text(
+            "INSERT INTO provisioning_jobs (subscription_id, status, attempts, next_attempt_at, created_at) "
+            "SELECT id, 'pending', 0, :now, :now FROM subscriptions WHERE expiry_date > :now"
+        ),
+        {"now": now},
+    )
+
+
+# --- 9: users.created_at NOT NULL ---
+
+async def _users_created_at_not_null(conn: AsyncConnection):
+    # Rows from before created_at was set get the oldest known date, so they
+    # still come last in /admin/users and the keyset needs no NULL branch
+    await conn.execute(
+        text(
+            "UPDATE users SET created_at = COALESCE((SELECT MIN(created_at) FROM users), :now) "
+            "WHERE created_at IS NULL"
+        ),
+        {"now": datetime.utcnow()},
+    )
+    # SQLite cannot alter a column; every insert sets created_at there too
+    if conn.dialect.name == "postgresql":
+        await conn.execute(text("ALTER TABLE users ALTER COLUMN created_at SET NOT NULL"))
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "baseline schema", _baseline),
+    Migration(2, "indexes for hot queries", _hot_path_indexes),
+    Migration(3, "provisioning outbox", _provisioning_jobs),
+    Migration(4, "usage table synced from Marzban", _vpn_usage),
+    Migration(5, "idempotency keys", _idempotency_keys),
+    Migration(6, "plan catalog", _plans),
+    Migration(7, "refresh tokens", _refresh_tokens),
+    Migration(8, "share links on subscriptions", _subscription_proxy_links),
+    Migration(9, "users.created_at not null", _users_created_at_not_null),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+# --- runner ---
+
+async def _ensure_version_table(conn: AsyncConnection):
+    await conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description VARCHAR, applied_at TIMESTAMP)"
+    ))
+
+
+async def get_schema_version(engine: AsyncEngine) -> int:
+    """Highest applied migration, or 0 for a database that has never been migrated."""
+    try:
+        async with engine.connect() as conn:
+            result = await conn.execute(text("SELECT MAX(version) FROM schema_version"))
+            return result.scalar() or 0
+    except DBAPIError:
+        return 0
+
+
+async def migrate(engine: AsyncEngine) -> int:
+    """
+    Apply every pending migration in one transaction (all or nothing on
+    Postgres, where DDL is transactional) and return the resulting version.
+    """
+    async with engine.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Held until this transaction ends; other workers wait here
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+        await _ensure_version_table(conn)
+        current = (await conn.execute(text("SELECT MAX(version) FROM schema_version"))).scalar() or 0
+
+        for migration in MIGRATIONS:
+            if migration.version <= current:
+                continue
+            logger.info("Applying migration %s: %s", migration.version, migration.description)
+            await migration.apply(conn)
+            await conn.execute(
+                text("INSERT INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                {"v": migration.version, "d": migration.description, "t": datetime.utcnow()},
+            )
+            current = migration.version
+    return current
+
+
+async def ensure_schema(engine: AsyncEngine):
+    """Boot-time check: a single version read when the schema is current."""
+    version = await get_schema_version(engine)
+    if version >= LATEST_VERSION:
+        return
+    if not AUTO_MIGRATE:
+        raise SchemaOutdated(
+            f"Database schema is at version {version}, expected {LATEST_VERSION}; run `python migrations.py`"
+        )
+    version = await migrate(engine)
+    logger.info("Database schema migrated to version %s", version)
+
+
+if __name__ == "__main__":
+    from database import engine
+
+    logging.basicConfig(level=logging.INFO)
+    print(f"Schema version: {asyncio.run(migrate(engine))}")
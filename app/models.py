@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, BigInteger
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, BigInteger, Index, Text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -6,13 +6,14 @@ from database import Base
 class User(Base):
     __tablename__ = "users"
 
-    tg_id = Column(BigInteger, primary_key=True, index=True)
+    # Plain INTEGER on SQLite so web registrations (no tg_id) get a rowid
+    tg_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True, index=True)
     username = Column(String, unique=True, nullable=True)  # Username for both web and Telegram
     first_name = Column(String, nullable=True)  # From Telegram
     last_name = Column(String, nullable=True)   # From Telegram
     avatar_url = Column(String, nullable=True)  # From Telegram
     balance = Column(Float, default=0.0)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     is_banned = Column(Boolean, default=False)
     email = Column(String, unique=True, nullable=True)  # For web registration
     password_hash = Column(String, nullable=True)  # For web authentication
@@ -23,6 +24,11 @@ class User(Base):
     subscriptions = relationship("Subscription", back_populates="user")
     transactions = relationship("Transaction", back_populates="user")
 
+    # Indexes are created by migrations.py; declared here to document them
+    __table_args__ = (
+        Index("ix_users_created_at_tg_id", "created_at", "tg_id"),
+    )
+
 class Subscription(Base):
     __tablename__ = "subscriptions"
 
@@ -30,10 +36,16 @@ class Subscription(Base):
     user_id = Column(BigInteger, ForeignKey("users.tg_id"))
     tariff_name = Column(String)
     expiry_date = Column(DateTime)
-    config_link = Column(String)
+    config_link = Column(String)  # Marzban subscription URL
+    proxy_links = Column(Text, nullable=True)  # Marzban share links, one per line; rendered by the feeds
 
     user = relationship("User", back_populates="subscriptions")
 
+    __table_args__ = (
+        Index("ix_subscriptions_user_id_expiry_date", "user_id", "expiry_date"),
+        Index("ix_subscriptions_expiry_date", "expiry_date"),
+    )
+
 class SiteConfig(Base):
     __tablename__ = "site_configs"
 
@@ -63,3 +75,78 @@ class Transaction(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
     user = relationship("User", back_populates="transactions")
+
+    __table_args__ = (
+        Index("ix_transactions_status", "status", "amount"),
+        Index("ix_transactions_user_id_created_at", "user_id", "created_at"),
+    )
+
+class ProvisioningJob(Base):
+    """Outbox row asking the provisioning worker to create a subscription's Marzban user."""
+    __tablename__ = "provisioning_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    subscription_id = Column(Integer, ForeignKey("subscriptions.id"), nullable=False)
+    status = Column(String, default="pending", nullable=False)  # pending, done or failed
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True)
+
+    subscription = relationship("Subscription")
+
+    __table_args__ = (
+        Index("ix_provisioning_jobs_status_next_attempt_at", "status", "next_attempt_at"),
+    )
+
+class VpnUsage(Base):
+    """Traffic and status of a Marzban user, copied in bulk by services/usage.py."""
+    __tablename__ = "vpn_usage"
+
+    username = Column(String, primary_key=True)  # Marzban username
+    # Parsed from the username; no foreign key, Marzban may hold users we have not kept
+    subscription_id = Column(Integer, nullable=True, index=True)
+    status = Column(String)
+    used_traffic = Column(BigInteger, default=0)  # bytes
+    data_limit = Column(BigInteger, nullable=True)  # bytes, None for unlimited
+    expire_at = Column(DateTime, nullable=True)
+    online_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)  # when the sync last wrote a change
+
+class IdempotencyKey(Base):
+    """Result of a request made with an Idempotency-Key, replayed on retries."""
+    __tablename__ = "idempotency_keys"
+
+    user_id = Column(BigInteger, primary_key=True)
+    key = Column(String, primary_key=True)
+    request_fingerprint = Column(String, nullable=False)  # a reused key must carry the same request
+    response_body = Column(Text, nullable=True)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class Plan(Base):
+    """Sellable plan; served by /shop/plans and priced by purchases via services/plans.py."""
+    __tablename__ = "plans"
+
+    id = Column(String, primary_key=True)  # e.g. "plan_1m"
+    name = Column(String, nullable=False)
+    duration_days = Column(Integer, nullable=False)
+    price = Column(Float, nullable=False)
+    description = Column(String, default="")
+    is_active = Column(Boolean, default=True)  # can be bought
+    is_public = Column(Boolean, default=True)  # listed in the shop
+    sort_order = Column(Integer, default=0)
+
+class RefreshToken(Base):
+    """Opaque refresh token kept as its SHA-256; rotated on every use by services/refresh_tokens.py."""
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True)
+    token_hash = Column(String, unique=True, nullable=False)  # hex SHA-256 of the token
+    family_id = Column(String, nullable=False, index=True)  # shared by every rotation of one login
+    user_id = Column(BigInteger, nullable=False, index=True)  # users.tg_id
+    subject = Column(String, nullable=False)  # `sub` of the access tokens it mints
+    token_type = Column(String, nullable=False)  # "web" or "telegram"
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    revoked_at = Column(DateTime, nullable=True)  # set on rotation, on reuse and on ban
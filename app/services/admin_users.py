@@ -0,0 +1,68 @@
+import base64
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User, Subscription
+
+ADMIN_USERS_PAGE_SIZE = 50
+ADMIN_USERS_MAX_PAGE_SIZE = 200
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at: datetime, tg_id: int) -> str:
+    raw = f"{created_at.isoformat()}|{tg_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, _, tg_id = base64.urlsafe_b64decode(padded).decode().partition("|")
+        return datetime.fromisoformat(created_at), int(tg_id)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor(cursor)
+
+
+async def fetch_users_page(db: AsyncSession, limit: int, cursor: Optional[str] = None) -> Tuple[List[tuple], Optional[str]]:
+    """
+    One page of users, newest first, keyset-paginated on (created_at, tg_id):
+    a backward range scan of ix_users_created_at_tg_id.
+    Each row is (User columns..., active_keys); the active subscription counts
+    come from a single grouped join against just the users on this page.
+    Returns the rows and the cursor for the next page (None on the last page).
+    """
+    order = (User.created_at.desc(), User.tg_id.desc())
+    page_stmt = select(
+        User.tg_id, User.username, User.balance, User.is_admin,
+        User.first_name, User.last_name, User.avatar_url, User.created_at,
+    ).order_by(*order).limit(limit + 1)
+
+    if cursor:
+        created_at, tg_id = decode_cursor(cursor)
+        page_stmt = page_stmt.where(tuple_(User.created_at, User.tg_id) < tuple_(created_at, tg_id))
+
+    page = page_stmt.subquery()
+    active_keys = func.count(Subscription.id).label("active_keys")
+    stmt = (
+        select(page, active_keys)
+        .outerjoin(Subscription, and_(
+            Subscription.user_id == page.c.tg_id,
+            Subscription.expiry_date > datetime.now(),
+        ))
+        .group_by(*page.c)
+        .order_by(page.c.created_at.desc(), page.c.tg_id.desc())
+    )
+    rows = (await db.execute(stmt)).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.tg_id)
+    return rows, next_cursor
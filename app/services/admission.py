@@ -0,0 +1,165 @@
+"""
+Admission checks for the authentication endpoints.
+
+Everything here runs before the handlers touch the database or bcrypt:
+
+- AdmissionMiddleware applies a per-IP token bucket to the auth routes
+  before the request body is even read;
+- check_identity() applies a second bucket per login name / Telegram id;
+- telegram_auth_is_fresh() rejects Telegram payloads older than
+  TELEGRAM_AUTH_MAX_AGE;
+- telegram_replay_cache remembers the hashes of accepted Telegram payloads
+  for that same window, so a captured payload works only once.
+
+All state is per process, in memory, bounded by ADMISSION_MAX_KEYS and
+evicting the least recently used key. Set ADMISSION_ENABLED=false to turn
+the rate limits off (e.g. for load tests).
+"""
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from starlette.responses import JSONResponse
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Per client IP, over all auth routes: sustained requests/second and burst
+AUTH_IP_RATE = float(os.getenv("AUTH_IP_RATE", "2"))
+AUTH_IP_BURST = float(os.getenv("AUTH_IP_BURST", "20"))
+# Per login name or Telegram id
+AUTH_IDENTITY_RATE = float(os.getenv("AUTH_IDENTITY_RATE", "0.1"))
+AUTH_IDENTITY_BURST = float(os.getenv("AUTH_IDENTITY_BURST", "5"))
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", "100000"))
+# Use nginx's X-Real-IP; only safe while the backend is reachable through nginx alone
+TRUST_X_REAL_IP = os.getenv("TRUST_X_REAL_IP", "true").lower() == "true"
+
+TELEGRAM_AUTH_MAX_AGE = int(os.getenv("TELEGRAM_AUTH_MAX_AGE", "3600"))
+# Tolerated clock difference for auth_date values from the future
+TELEGRAM_AUTH_CLOCK_SKEW = 60
+
+# Routes behind the per-IP limit
+AUTH_PATHS = frozenset({"/auth/login", "/auth/register", "/auth/telegram/callback"})
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after: float):
+        super().__init__("Too many requests")
+        self.retry_after = retry_after
+
+
+class TokenBucketLimiter:
+    """Token buckets keyed by string, at most `max_keys` of them (LRU eviction)."""
+
+    def __init__(self, rate: float, burst: float, max_keys: int = ADMISSION_MAX_KEYS):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, last refill, monotonic)
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def acquire(self, key: str) -> Optional[float]:
+        """Take a token; None when allowed, else seconds until one is available."""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            tokens = self.burst
+            if len(self._buckets) >= self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            tokens, last = bucket
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            self._buckets.move_to_end(key)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            return None
+        self._buckets[key] = (tokens, now)
+        return (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class ReplayCache:
+    """Remembers keys for `ttl` seconds; at most `max_size` of them."""
+
+    def __init__(self, ttl: float, max_size: int = ADMISSION_MAX_KEYS):
+        self.ttl = ttl
+        self.max_size = max_size
+        # key -> expiry; same TTL for all, so insertion order is expiry order
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+
+    def add(self, key: str) -> bool:
+        """Record `key`; False if it was already seen within the TTL."""
+        now = time.monotonic()
+        while self._seen:
+            oldest_key, expires_at = next(iter(self._seen.items()))
+            if expires_at > now and len(self._seen) < self.max_size:
+                break
+            del self._seen[oldest_key]
+        if key in self._seen:
+            return False
+        self._seen[key] = now + self.ttl
+        return True
+
+    def __len__(self):
+        return len(self._seen)
+
+
+ip_limiter = TokenBucketLimiter(AUTH_IP_RATE, AUTH_IP_BURST)
+identity_limiter = TokenBucketLimiter(AUTH_IDENTITY_RATE, AUTH_IDENTITY_BURST)
+telegram_replay_cache = ReplayCache(TELEGRAM_AUTH_MAX_AGE + TELEGRAM_AUTH_CLOCK_SKEW)
+
+
+def client_ip(scope) -> str:
+    if TRUST_X_REAL_IP:
+        for name, value in scope.get("headers", ()):
+            if name == b"x-real-ip":
+                return value.decode("latin-1")
+    client = scope.get("client")
+    return client[0] if client else "unknown"
+
+
+def check_identity(scope: str, identity) -> None:
+    """Per-identity limit for `scope` ("login", "register", "telegram"); raises RateLimited."""
+    if not ADMISSION_ENABLED or identity in (None, ""):
+        return
+    retry_after = identity_limiter.acquire(f"{scope}:{str(identity).lower()}")
+    if retry_after is not None:
+        raise RateLimited(retry_after)
+
+
+def telegram_auth_is_fresh(auth_date, now: Optional[float] = None) -> bool:
+    try:
+        auth_date = int(auth_date)
+    except (TypeError, ValueError):
+        return False
+    now = time.time() if now is None else now
+    return now - TELEGRAM_AUTH_MAX_AGE <= auth_date <= now + TELEGRAM_AUTH_CLOCK_SKEW
+
+
+def too_many_requests(retry_after: float) -> JSONResponse:
+    # A bucket that never refills (rate 0) has no time to suggest
+    headers = {"Retry-After": str(max(1, math.ceil(retry_after)))} if math.isfinite(retry_after) else None
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many requests, please retry later"},
+        headers=headers,
+    )
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware applying the per-IP limit to AUTH_PATHS before the body is read."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (ADMISSION_ENABLED and scope["type"] == "http" and scope["method"] == "POST"
+                and scope["path"] in AUTH_PATHS):
+            retry_after = ip_limiter.acquire(client_ip(scope))
+            if retry_after is not None:
+                await too_many_requests(retry_after)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
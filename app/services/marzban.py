@@ -1,6 +1,53 @@
+import asyncio
+import base64
 import httpx
+import json
+import logging
 import os
-from typing import Optional, Dict, Any
+import time
+from typing import Optional, Dict, Any, List, NamedTuple, Tuple
+
+from database import AsyncSessionLocal
+from metrics import marzban_request_duration_seconds, marzban_errors_total
+from models import VpnUsage
+
+logger = logging.getLogger(__name__)
+
+# Connection pool and timeouts for the shared client
+MARZBAN_MAX_CONNECTIONS = int(os.getenv("MARZBAN_MAX_CONNECTIONS", "20"))
+MARZBAN_MAX_KEEPALIVE = int(os.getenv("MARZBAN_MAX_KEEPALIVE", "10"))
+MARZBAN_KEEPALIVE_EXPIRY = float(os.getenv("MARZBAN_KEEPALIVE_EXPIRY", "30"))
+MARZBAN_TIMEOUT = float(os.getenv("MARZBAN_TIMEOUT", "10"))
+MARZBAN_CONNECT_TIMEOUT = float(os.getenv("MARZBAN_CONNECT_TIMEOUT", "5"))
+MARZBAN_POOL_TIMEOUT = float(os.getenv("MARZBAN_POOL_TIMEOUT", "5"))
+
+# Used when the access token carries no readable `exp` (Marzban's default is 24h)
+MARZBAN_TOKEN_TTL = int(os.getenv("MARZBAN_TOKEN_TTL", "86400"))
+# Log in again this many seconds before the token expires
+MARZBAN_TOKEN_REFRESH_MARGIN = int(os.getenv("MARZBAN_TOKEN_REFRESH_MARGIN", "300"))
+
+
+def _token_expiry(token: str) -> Optional[float]:
+    """Read `exp` from a JWT without verifying it; None if it is not a JWT."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        exp = json.loads(base64.urlsafe_b64decode(payload)).get("exp")
+        return float(exp) if exp is not None else None
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return None
+
+
+class MarzbanUserLinks(NamedTuple):
+    # Marzban's own subscription page (an https URL on a real panel)
+    subscription_url: str
+    # Per-protocol share links (vless://...), what VPN clients import
+    links: List[str]
+
+    @classmethod
+    def from_response(cls, user_data: Dict[str, Any]) -> "MarzbanUserLinks":
+        return cls(subscription_url=user_data.get("subscription_url") or "", links=list(user_data.get("links") or []))
+
 
 class MarzbanAPI:
     def __init__(self):
@@ -8,37 +55,118 @@ class MarzbanAPI:
         self.username = os.getenv("MARZBAN_USERNAME")
         self.password = os.getenv("MARZBAN_PASSWORD")
         self.token = None
-        self.client = httpx.AsyncClient(base_url=self.base_url, verify=False)  # verify=False for self-signed certs
+        self.token_expires_at = 0.0
+        self._client: Optional[httpx.AsyncClient] = None
+        self._login_lock: Optional[asyncio.Lock] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created on first use so it binds to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url or "",
+                verify=False,  # verify=False for self-signed certs
+                limits=httpx.Limits(
+                    max_connections=MARZBAN_MAX_CONNECTIONS,
+                    max_keepalive_connections=MARZBAN_MAX_KEEPALIVE,
+                    keepalive_expiry=MARZBAN_KEEPALIVE_EXPIRY,
+                ),
+                timeout=httpx.Timeout(
+                    MARZBAN_TIMEOUT, connect=MARZBAN_CONNECT_TIMEOUT, pool=MARZBAN_POOL_TIMEOUT,
+                ),
+            )
+        return self._client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _request(self, name: str, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request on behalf of client method `name`, recording its latency and failures."""
+        labels = (name,)
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            response.raise_for_status()
+            return response
+        except Exception:
+            marzban_errors_total.inc(labels)
+            raise
+        finally:
+            marzban_request_duration_seconds.observe(labels, time.perf_counter() - start)
+
+    def _token_fresh(self) -> bool:
+        return bool(self.token) and time.time() < self.token_expires_at - MARZBAN_TOKEN_REFRESH_MARGIN
+
+    async def ensure_token(self) -> bool:
+        """
+        Make sure a usable token is held, logging in if it is missing or about
+        to expire. Concurrent callers share a single login.
+        """
+        if self._token_fresh():
+            return True
+        if self._login_lock is None:
+            self._login_lock = asyncio.Lock()
+        async with self._login_lock:
+            # Whoever held the lock before us may have logged in already
+            if self._token_fresh():
+                return True
+            return await self.login()
 
     async def login(self) -> bool:
         if not self.base_url:
-            print("Marzban URL not set, skipping login (Mock Mode)")
+            logger.info("Marzban URL not set, skipping login (Mock Mode)")
             return False
-            
+
         try:
-            response = await self.client.post(
-                "/api/admin/token",
+            response = await self._request(
+                "login", "POST", "/api/admin/token",
                 data={"username": self.username, "password": self.password},
                 headers={"Content-Type": "application/x-www-form-urlencoded"}
             )
-            response.raise_for_status()
             data = response.json()
             self.token = data.get("access_token")
-            return True
+            self.token_expires_at = _token_expiry(self.token) or time.time() + MARZBAN_TOKEN_TTL
+            return bool(self.token)
         except Exception as e:
-            print(f"Marzban Login Failed: {e}")
+            logger.warning(f"Marzban Login Failed: {e}")
             return False
 
-    async def create_user(self, username: str, expire: int = 0, data_limit: int = 0) -> Optional[str]:
+    async def _authorized_request(self, name: str, method: str, url: str, **kwargs) -> httpx.Response:
         """
-        Creates a user in Marzban and returns the subscription URL (VLESS).
+        `_request` with the bearer token attached. A 401 (token revoked or
+        expired early) triggers one re-login and one retry.
+        """
+        token = self.token
+        headers = {**kwargs.pop("headers", {}), "Authorization": f"Bearer {token}"}
+        try:
+            return await self._request(name, method, url, headers=headers, **kwargs)
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 401:
+                raise
+        # Only drop the token we used; another request may have refreshed it already
+        if self.token == token:
+            self.token = None
+            self.token_expires_at = 0.0
+        if not await self.ensure_token():
+            raise httpx.HTTPError("Marzban re-login failed")
+        headers["Authorization"] = f"Bearer {self.token}"
+        return await self._request(name, method, url, headers=headers, **kwargs)
+
+    async def create_user(self, username: str, expire: int = 0, data_limit: int = 0) -> Optional[MarzbanUserLinks]:
+        """
+        Creates a user in Marzban and returns its subscription URL and share links.
+        If the user already exists its expiry and limit are updated instead.
         expire: timestamp
         """
-        if not self.token:
-            if not await self.login():
-                return f"vless://mock-uuid@{self.base_url}:443?security=reality&sni=google.com&fp=chrome&pbk=mock-key&sid=mock-sid&type=grpc&serviceName=grpc#TssVPN_{username}"
+        if not self.base_url:
+            link = f"vless://mock-uuid@{self.base_url}:443?security=reality&sni=google.com&fp=chrome&pbk=mock-key&sid=mock-sid&type=grpc&serviceName=grpc#TssVPN_{username}"
+            return MarzbanUserLinks(subscription_url=link, links=[link])
+        if not await self.ensure_token():
+            # Marzban is configured but unreachable: fail so the caller retries
+            return None
 
-        headers = {"Authorization": f"Bearer {self.token}"}
         payload = {
             "username": username,
             "proxies": {"vless": {}},
@@ -46,23 +174,59 @@ class MarzbanAPI:
             "data_limit": data_limit,
             "status": "active"
         }
-        
+
         try:
             # Note: Endpoint might vary based on Marzban version, using standard /api/user
-            response = await self.client.post("/api/user", json=payload, headers=headers)
-            response.raise_for_status()
-            user_data = response.json()
-            # Construct subscription link or extract from response
-            return user_data.get("subscription_url", "")
+            response = await self._authorized_request("create_user", "POST", "/api/user", json=payload)
+            return MarzbanUserLinks.from_response(response.json())
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code == 409:
+                # Created earlier: a retried job, or a renewal extending the expiry
+                return await self.update_user(username, expire=expire, data_limit=data_limit)
+            logger.warning(f"Failed to create user in Marzban: {e}")
+            return None
+        except Exception as e:
+            logger.warning(f"Failed to create user in Marzban: {e}")
+            return None
+
+    async def update_user(self, username: str, expire: int = 0, data_limit: int = 0) -> Optional[MarzbanUserLinks]:
+        """Set an existing user's expiry and limit; returns its subscription URL and share links."""
+        if not await self.ensure_token():
+            return None
+        payload = {"expire": expire, "data_limit": data_limit, "status": "active"}
+        try:
+            response = await self._authorized_request("update_user", "PUT", f"/api/user/{username}", json=payload)
+            return MarzbanUserLinks.from_response(response.json())
         except Exception as e:
-            print(f"Failed to create user in Marzban: {e}")
+            logger.warning(f"Failed to update user in Marzban: {e}")
             return None
 
+    async def list_users(self, offset: int, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+        """One page of Marzban users and the total count; raises on failure."""
+        if not await self.ensure_token():
+            raise httpx.HTTPError("Marzban login failed")
+        response = await self._authorized_request(
+            "list_users", "GET", "/api/users", params={"offset": offset, "limit": limit}
+        )
+        data = response.json()
+        return data.get("users", []), data.get("total", 0)
+
     async def get_user_stats(self, username: str) -> Dict[str, Any]:
-        if not self.token:
-            await self.login()
-            
-        # Implementation for stats
-        return {}
+        """
+        Usage as of the last bulk sync (services/usage.py). Read from the local
+        table so dashboards never wait on Marzban.
+        """
+        async with AsyncSessionLocal() as db:
+            usage = await db.get(VpnUsage, username)
+        if usage is None:
+            return {}
+        return {
+            "username": usage.username,
+            "status": usage.status,
+            "used_traffic": usage.used_traffic,
+            "data_limit": usage.data_limit,
+            "expire": usage.expire_at,
+            "online_at": usage.online_at,
+        }
 
 marzban = MarzbanAPI()
@@ -0,0 +1,105 @@
+"""
+In-memory plan catalog.
+
+The `plans` table is read once at startup into a dict (O(1) lookup for
+purchases) and into the final /shop/plans response body, so listing plans
+costs no queries, no model building and no serialization. Changes made
+through the admin API reload the catalog at once; other workers pick them
+up within PLAN_CATALOG_REFRESH_INTERVAL.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from typing import Dict, NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import Plan
+
+logger = logging.getLogger(__name__)
+
+PLAN_CATALOG_REFRESH_INTERVAL = float(os.getenv("PLAN_CATALOG_REFRESH_INTERVAL", "60"))
+# Browser/proxy cache lifetime of /shop/plans; revalidation is a cheap 304
+PLANS_MAX_AGE = int(os.getenv("PLANS_MAX_AGE", "300"))
+
+
+class CatalogPlan(NamedTuple):
+    id: str
+    name: str
+    duration_days: int
+    price: float
+    description: str
+    is_active: bool
+    is_public: bool
+    sort_order: int
+
+    def public_dict(self) -> dict:
+        # Shape of the VPNPlan model the frontends already read
+        return {
+            "id": self.id,
+            "name": self.name,
+            "duration_days": self.duration_days,
+            "price": self.price,
+            "description": self.description,
+        }
+
+
+class PlanCatalog:
+    def __init__(self):
+        self.plans: Dict[str, CatalogPlan] = {}
+        self.body = b"[]"
+        self.etag = '"empty"'
+        self.loaded = False
+        self._lock: Optional[asyncio.Lock] = None
+
+    def get(self, plan_id: str) -> Optional[CatalogPlan]:
+        return self.plans.get(plan_id)
+
+    async def load(self, db: AsyncSession):
+        """Rebuild the catalog and the pre-serialized shop listing from the table."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            result = await db.execute(select(Plan).order_by(Plan.sort_order, Plan.id))
+            plans = {
+                row.id: CatalogPlan(
+                    id=row.id,
+                    name=row.name,
+                    duration_days=row.duration_days,
+                    price=row.price,
+                    description=row.description or "",
+                    is_active=bool(row.is_active),
+                    is_public=bool(row.is_public),
+                    sort_order=row.sort_order or 0,
+                )
+                for row in result.scalars()
+            }
+            listed = [plan.public_dict() for plan in plans.values() if plan.is_active and plan.is_public]
+            body = json.dumps(listed, ensure_ascii=False, separators=(",", ":")).encode()
+
+            # Swap all three together; readers never see a half-built catalog
+            self.plans, self.body, self.etag = plans, body, '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+            self.loaded = True
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if not self.loaded:
+            await self.load(db)
+
+    async def run_refresher(self, interval: float = PLAN_CATALOG_REFRESH_INTERVAL):
+        """Background loop started from the app lifespan."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self.load(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Plan catalog refresh failed")
+
+
+plan_catalog = PlanCatalog()
@@ -0,0 +1,149 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, NamedTuple, Optional, Tuple, Union
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User
+
+# Seconds a snapshot may be served without re-reading the row. Writes made by
+# this process invalidate explicitly; the TTL bounds staleness across workers.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "15"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+# A token subject: tg_id for Telegram logins, username for web logins
+PrincipalKey = Union[int, str]
+
+
+class Principal(NamedTuple):
+    """Immutable snapshot of the User fields needed by auth and profile views."""
+    tg_id: int
+    username: Optional[str]
+    is_admin: bool
+    is_banned: bool
+    balance: float
+    first_name: Optional[str]
+    last_name: Optional[str]
+    avatar_url: Optional[str]
+    created_at: Optional[datetime]
+
+    @classmethod
+    def from_user(cls, user: User) -> "Principal":
+        return cls(
+            tg_id=user.tg_id,
+            username=user.username,
+            is_admin=bool(user.is_admin),
+            is_banned=bool(user.is_banned),
+            balance=user.balance or 0.0,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            avatar_url=user.avatar_url,
+            created_at=user.created_at,
+        )
+
+
+class PrincipalCache:
+    """
+    Short-TTL cache of Principal snapshots, addressable by tg_id or username.
+    Concurrent misses for the same key share one database query.
+    Load through primary sessions only: a user not yet on a lagging replica
+    would be cached as missing for the whole TTL.
+    """
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, capacity: int = PRINCIPAL_CACHE_SIZE):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[PrincipalKey, Tuple[float, Optional[Principal]]]" = OrderedDict()
+        self._inflight: Dict[PrincipalKey, asyncio.Future] = {}
+        # Bumped on every invalidation so a load racing with a write is not stored
+        self._generation = 0
+
+    def _lookup(self, key: PrincipalKey):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        expires_at, principal = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, principal
+
+    def _store(self, key: PrincipalKey, principal: Optional[Principal]):
+        expires_at = time.monotonic() + self.ttl
+        keys = [key]
+        if principal is not None:
+            keys = [principal.tg_id]
+            if principal.username:
+                keys.append(principal.username)
+        for k in keys:
+            self._entries[k] = (expires_at, principal)
+            self._entries.move_to_end(k)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    async def _load(self, db: AsyncSession, key: PrincipalKey) -> Optional[Principal]:
+        if isinstance(key, int):
+            stmt = select(User).where(User.tg_id == key)
+        else:
+            stmt = select(User).where(User.username == key)
+        user = (await db.execute(stmt)).scalar_one_or_none()
+        return Principal.from_user(user) if user else None
+
+    async def get(self, db: AsyncSession, key: PrincipalKey) -> Optional[Principal]:
+        """Return the snapshot for a tg_id or username, or None if no such user."""
+        found, principal = self._lookup(key)
+        if found:
+            self.hits += 1
+            return principal
+        self.misses += 1
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        generation = self._generation
+        try:
+            principal = await self._load(db, key)
+        except Exception as e:
+            future.set_exception(e)
+            # Waiters re-raise it; mark it retrieved so it is not logged as unhandled
+            future.exception()
+            raise
+        else:
+            future.set_result(principal)
+            if generation == self._generation:
+                self._store(key, principal)
+            return principal
+        finally:
+            del self._inflight[key]
+            if not future.done():
+                future.cancel()
+
+    def invalidate(self, tg_id: Optional[int] = None, username: Optional[str] = None):
+        """Drop a user's snapshot; pass every identifier the caller knows."""
+        self._generation += 1
+        for key in (tg_id, username):
+            if key is None:
+                continue
+            entry = self._entries.pop(key, None)
+            # The same snapshot is also stored under its other identifier
+            if entry and entry[1] is not None:
+                self._entries.pop(entry[1].tg_id, None)
+                if entry[1].username:
+                    self._entries.pop(entry[1].username, None)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+
+principal_cache = PrincipalCache()
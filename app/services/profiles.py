@@ -0,0 +1,76 @@
+from datetime import datetime
+from typing import NamedTuple, Optional, Union
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import User, Subscription
+
+
+class Profile(NamedTuple):
+    tg_id: int
+    username: Optional[str]
+    balance: float
+    is_admin: bool
+    first_name: Optional[str]
+    last_name: Optional[str]
+    avatar_url: Optional[str]
+    created_at: Optional[datetime]
+    # Expiry of the latest active subscription, None when there is none
+    subscription_expiry: Optional[datetime]
+    keys_count: int
+
+    @property
+    def status(self) -> str:
+        return "Active" if self.subscription_expiry else "Inactive"
+
+
+async def get_profile(db: AsyncSession, key: Union[int, str]) -> Optional[Profile]:
+    """
+    Load a user (by tg_id, or by username for web logins) together with the
+    latest active subscription and the number of active keys, in one query.
+    """
+    now = datetime.now()
+    active = and_(Subscription.user_id == User.tg_id, Subscription.expiry_date > now)
+
+    latest_expiry = (
+        select(Subscription.expiry_date)
+        .where(active)
+        .order_by(Subscription.expiry_date.desc())
+        .limit(1)
+        .correlate(User)
+        .scalar_subquery()
+    )
+    keys_count = (
+        select(func.count(Subscription.id))
+        .where(active)
+        .correlate(User)
+        .scalar_subquery()
+    )
+
+    stmt = select(
+        User.tg_id, User.username, User.balance, User.is_admin,
+        User.first_name, User.last_name, User.avatar_url, User.created_at,
+        latest_expiry.label("subscription_expiry"),
+        keys_count.label("keys_count"),
+    )
+    if isinstance(key, int):
+        stmt = stmt.where(User.tg_id == key)
+    else:
+        stmt = stmt.where(User.username == key)
+
+    row = (await db.execute(stmt)).one_or_none()
+    if row is None:
+        return None
+    return Profile(
+        tg_id=row.tg_id,
+        username=row.username,
+        balance=row.balance or 0.0,
+        is_admin=bool(row.is_admin),
+        first_name=row.first_name,
+        last_name=row.last_name,
+        avatar_url=row.avatar_url,
+        created_at=row.created_at,
+        subscription_expiry=row.subscription_expiry,
+        keys_count=row.keys_count or 0,
+    )
@@ -0,0 +1,203 @@
+"""
+Outbox-based VPN provisioning.
+
+A purchase inserts a `ProvisioningJob` next to its `Subscription` in the same
+transaction and returns without talking to Marzban. A fixed pool of worker
+coroutines claims due jobs, creates the Marzban user and stores its
+subscription URL and share links; failures are retried with exponential
+backoff.
+
+A claimed job is leased by pushing its `next_attempt_at` forward, so a job
+held by a worker that died is picked up again once the lease runs out.
+Marzban answers 409 for a user created by such an earlier attempt, and
+`MarzbanAPI.create_user` then updates that user instead. Renewals use the
+same path: the purchase extends the subscription and enqueues another job
+for it, which pushes the new expiry to Marzban.
+
+The expiry is read right before the Marzban call, and the job only
+completes if it is still the subscription's expiry afterwards. Otherwise a
+renewal raced with the call (and an older job may have just overwritten
+the newer expiry), so the job is requeued to push the current value.
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal, engine
+from metrics import provisioning_queue_depth, provisioning_jobs_total, provisioning_job_latency_seconds
+from models import ProvisioningJob, Subscription
+from services.marzban import marzban
+from services.subscription_export import subscription_feed_cache
+
+logger = logging.getLogger(__name__)
+
+# Worker coroutines per process, i.e. concurrent Marzban calls
+PROVISION_CONCURRENCY = int(os.getenv("PROVISION_CONCURRENCY", "4"))
+# Idle workers re-check the table this often (new purchases in this process wake them sooner)
+PROVISION_POLL_INTERVAL = float(os.getenv("PROVISION_POLL_INTERVAL", "2"))
+PROVISION_MAX_ATTEMPTS = int(os.getenv("PROVISION_MAX_ATTEMPTS", "10"))
+PROVISION_BACKOFF_BASE = float(os.getenv("PROVISION_BACKOFF_BASE", "5"))
+PROVISION_BACKOFF_MAX = float(os.getenv("PROVISION_BACKOFF_MAX", "600"))
+# How long a claimed job is hidden from other workers
+PROVISION_LEASE_SECONDS = float(os.getenv("PROVISION_LEASE_SECONDS", "120"))
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    attempts: int
+    created_at: Optional[datetime]
+    subscription_id: int
+    user_id: int
+
+
+def enqueue_provisioning(db: AsyncSession, subscription: Subscription) -> ProvisioningJob:
+    """Add a job for `subscription` to the session; it is committed with the caller's transaction."""
+    job = ProvisioningJob(subscription=subscription, status="pending", attempts=0,
+                          next_attempt_at=datetime.utcnow())
+    db.add(job)
+    return job
+
+
+def marzban_username(user_id: int, subscription_id: int) -> str:
+    # Deterministic, so retries and renewals find the user created earlier
+    return f"tss{user_id}_{subscription_id}"
+
+
+def _backoff(attempts: int) -> float:
+    delay = min(PROVISION_BACKOFF_MAX, PROVISION_BACKOFF_BASE * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class ProvisioningQueue:
+    def __init__(self, concurrency: int = PROVISION_CONCURRENCY):
+        self.concurrency = concurrency
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    def notify(self):
+        """Wake idle workers after committing new jobs."""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _claim(self) -> Optional[ClaimedJob]:
+        now = datetime.utcnow()
+        stmt = (
+            select(
+                ProvisioningJob.id, ProvisioningJob.attempts, ProvisioningJob.created_at,
+                ProvisioningJob.next_attempt_at,
+                Subscription.id.label("subscription_id"), Subscription.user_id,
+            )
+            .join(Subscription, Subscription.id == ProvisioningJob.subscription_id)
+            .where(ProvisioningJob.status == "pending", ProvisioningJob.next_attempt_at <= now)
+            .order_by(ProvisioningJob.next_attempt_at)
+            .limit(1)
+        )
+        if engine.dialect.name == "postgresql":
+            stmt = stmt.with_for_update(skip_locked=True, of=ProvisioningJob)
+
+        async with AsyncSessionLocal() as db:
+            row = (await db.execute(stmt)).one_or_none()
+            if row is not None:
+                # Compare-and-set on the lease: without SKIP LOCKED (SQLite) two
+                # workers can select the same row, and only one may take it
+                claimed = await db.execute(
+                    update(ProvisioningJob)
+                    .where(ProvisioningJob.id == row.id,
+                           ProvisioningJob.next_attempt_at == row.next_attempt_at)
+                    .values(attempts=ProvisioningJob.attempts + 1,
+                            next_attempt_at=now + timedelta(seconds=PROVISION_LEASE_SECONDS))
+                )
+                if claimed.rowcount != 1:
+                    row = None
+            depth = await db.scalar(
+                select(func.count(ProvisioningJob.id)).where(ProvisioningJob.status == "pending")
+            )
+            await db.commit()
+        provisioning_queue_depth.set((), depth or 0)
+        if row is None:
+            return None
+        return ClaimedJob(row.id, row.attempts + 1, row.created_at, row.subscription_id, row.user_id)
+
+    async def _process(self, job: ClaimedJob):
+        # Read now, not at claim time: a renewal may have committed since
+        async with AsyncSessionLocal() as db:
+            expiry_date = await db.scalar(
+                select(Subscription.expiry_date).where(Subscription.id == job.subscription_id)
+            )
+        expire = int(expiry_date.timestamp()) if expiry_date else 0
+        links = await marzban.create_user(marzban_username(job.user_id, job.subscription_id), expire=expire)
+
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            stored = None
+            if links is not None:
+                # Compare-and-set on the expiry that was pushed
+                stored = await db.execute(
+                    update(Subscription)
+                    .where(Subscription.id == job.subscription_id, Subscription.expiry_date == expiry_date)
+                    .values(config_link=links.subscription_url, proxy_links="\n".join(links.links))
+                )
+            if stored is not None and stored.rowcount == 1:
+                values = {"status": "done", "completed_at": now, "last_error": None}
+                result = "done"
+            elif stored is not None:
+                # Renewed during the call: push the new expiry right away, without using up an attempt
+                values = {"next_attempt_at": now, "attempts": job.attempts - 1}
+                result = "stale"
+            elif job.attempts >= PROVISION_MAX_ATTEMPTS:
+                values = {"status": "failed", "last_error": "Marzban create_user failed"}
+                result = "failed"
+            else:
+                values = {"next_attempt_at": now + timedelta(seconds=_backoff(job.attempts)),
+                          "last_error": "Marzban create_user failed"}
+                result = "retry"
+            await db.execute(update(ProvisioningJob).where(ProvisioningJob.id == job.id).values(**values))
+            await db.commit()
+
+        provisioning_jobs_total.inc((result,))
+        if result == "done":
+            # The feed now has a link to show
+            subscription_feed_cache.invalidate(job.user_id)
+        if result == "done" and job.created_at:
+            provisioning_job_latency_seconds.observe((), (now - job.created_at).total_seconds())
+        elif result == "failed":
+            logger.error("Provisioning job %s gave up after %s attempts", job.id, job.attempts)
+
+    async def _worker(self):
+        while True:
+            try:
+                # Clear before looking, so a notify() that races the claim is not lost
+                self._wakeup.clear()
+                job = await self._claim()
+                if job is not None:
+                    await self._process(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Provisioning worker failed")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), PROVISION_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        """Start the workers; called from the app lifespan."""
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def stop(self):
+        # An interrupted job keeps its lease and is retried after it expires
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+provisioning_queue = ProvisioningQueue()
@@ -0,0 +1,166 @@
+"""
+The purchase path behind POST /shop/buy.
+
+Everything a purchase writes (user row for first-time bot buyers,
+subscription, provisioning job, transaction, idempotency record) commits in
+one transaction. The user row is locked for the duration, so purchases for
+the same user run one after another.
+
+With an Idempotency-Key the record is inserted first. A concurrent retry
+with the same key blocks on it (or fails on the primary key) and then
+replays the stored response, so the work is never done twice. Records are
+kept for IDEMPOTENCY_KEY_TTL_HOURS; a retry after that buys again.
+"""
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import User, Subscription, Transaction, IdempotencyKey
+from services.plans import plan_catalog
+from services.provisioning import enqueue_provisioning, provisioning_queue
+from services.principals import principal_cache
+from services.stats import stats_rollup
+from services.subscription_export import subscription_feed_cache
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_KEY_TTL_HOURS", "24"))
+IDEMPOTENCY_KEY_PURGE_INTERVAL = float(os.getenv("IDEMPOTENCY_KEY_PURGE_INTERVAL", "3600"))
+
+
+class PurchaseError(ValueError):
+    """Rejected purchase; the message is safe to show to the client."""
+
+
+class IdempotencyConflict(PurchaseError):
+    pass
+
+
+class PurchaseResult(NamedTuple):
+    response: dict
+    replayed: bool
+
+
+async def _replay(db: AsyncSession, tg_id: int, key: str, fingerprint: str) -> Optional[dict]:
+    record = await db.get(IdempotencyKey, (tg_id, key))
+    if record is None:
+        return None
+    if record.request_fingerprint != fingerprint:
+        raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+    return json.loads(record.response_body)
+
+
+async def _purchase(db: AsyncSession, tg_id: int, plan_id: str, idempotency_key: Optional[str]) -> PurchaseResult:
+    plan = plan_catalog.get(plan_id)
+    if plan is None or not plan.is_active:
+        raise PurchaseError("Plan not found")
+    fingerprint = f"buy:{plan_id}"
+
+    # Serializes purchases per user (a no-op on SQLite, which locks the whole database on write)
+    user = (await db.execute(select(User).where(User.tg_id == tg_id).with_for_update())).scalar_one_or_none()
+    user_created = user is None
+    if user_created:
+        # Purchases from the old bot may come before the user ever logged in
+        user = User(tg_id=tg_id, username=f"user_{tg_id}")
+        db.add(user)
+        await db.flush()
+
+    if idempotency_key:
+        stored = await _replay(db, tg_id, idempotency_key, fingerprint)
+        if stored is not None:
+            await db.rollback()
+            return PurchaseResult(stored, replayed=True)
+        record = IdempotencyKey(user_id=tg_id, key=idempotency_key, request_fingerprint=fingerprint)
+        db.add(record)
+        # Claims the key; a concurrent twin fails here and replays our result
+        await db.flush()
+
+    now = datetime.now()
+    duration = timedelta(days=plan.duration_days)
+    active = (await db.execute(
+        select(Subscription)
+        .where(Subscription.user_id == tg_id, Subscription.expiry_date > now)
+        .order_by(Subscription.expiry_date.desc())
+        .limit(1)
+    )).scalar_one_or_none()
+
+    previous_expiry = None
+    if active is not None:
+        # Renewal: push the current subscription out rather than stacking another one
+        previous_expiry = active.expiry_date
+        active.expiry_date = active.expiry_date + duration
+        active.tariff_name = plan_id
+        subscription = active
+    else:
+        subscription = Subscription(user_id=tg_id, tariff_name=plan_id, expiry_date=now + duration, config_link="")
+        db.add(subscription)
+    # Creates the Marzban user, or updates its expiry for a renewal
+    enqueue_provisioning(db, subscription)
+
+    db.add(Transaction(user_id=tg_id, amount=plan.price, payment_method="mock", status="Completed"))
+    await db.flush()
+
+    response = {
+        "message": f"Plan {plan_id} purchased successfully for user {tg_id}.",
+        "subscription_id": subscription.id,
+        "expires_at": subscription.expiry_date.isoformat(),
+        "url": f"http://mock-payment-success.com/{tg_id}/{plan_id}",
+    }
+    if idempotency_key:
+        record.response_body = json.dumps(response)
+    # Read before the commit expires the instances
+    username, expiry_date = user.username, subscription.expiry_date
+    await db.commit()
+
+    provisioning_queue.notify()
+    principal_cache.invalidate(tg_id=tg_id, username=username)
+    subscription_feed_cache.invalidate(tg_id)
+    if user_created:
+        stats_rollup.record_user_created()
+    stats_rollup.record_subscription(expiry_date, previous_expiry)
+    stats_rollup.record_transaction_completed(plan.price)
+    return PurchaseResult(response, replayed=False)
+
+
+async def purchase_plan(db: AsyncSession, tg_id: int, plan_id: str, idempotency_key: Optional[str] = None) -> PurchaseResult:
+    try:
+        return await _purchase(db, tg_id, plan_id, idempotency_key)
+    except IntegrityError:
+        # Lost a race: a concurrent request created the same user or claimed
+        # the same idempotency key. Its transaction has committed by now.
+        await db.rollback()
+        if idempotency_key:
+            stored = await _replay(db, tg_id, idempotency_key, f"buy:{plan_id}")
+            if stored is not None:
+                return PurchaseResult(stored, replayed=True)
+        return await _purchase(db, tg_id, plan_id, idempotency_key)
+
+
+async def purge_idempotency_keys(db: AsyncSession) -> int:
+    cutoff = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS)
+    result = await db.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < cutoff))
+    await db.commit()
+    return result.rowcount
+
+
+async def run_idempotency_key_purger(interval: float = IDEMPOTENCY_KEY_PURGE_INTERVAL):
+    """Background loop started from the app lifespan; deletes records older than the TTL."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as db:
+                purged = await purge_idempotency_keys(db)
+            if purged:
+                logger.info("Purged idempotency keys", extra={"fields": {"count": purged}})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Idempotency key purge failed")
@@ -0,0 +1,146 @@
+"""
+Refresh tokens.
+
+Every login also issues a long-lived opaque refresh token. Only its SHA-256
+is stored (the token has 256 random bits, so no slow hash is needed), and
+/auth/refresh exchanges it for a new access token with one indexed lookup
+instead of a bcrypt login or another Telegram widget round.
+
+Tokens rotate: each exchange revokes the presented token and issues a new
+one in the same family (one family per login). A revoked token that comes
+back means it was copied, so the whole family is revoked and the user has
+to log in again. Banning a user revokes all of their tokens, and a banned
+user's token is refused even if it escaped revocation.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+from datetime import datetime, timedelta
+from typing import NamedTuple, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from metrics import auth_refresh_total
+from models import RefreshToken, User
+
+logger = logging.getLogger(__name__)
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REFRESH_TOKEN_PURGE_INTERVAL = float(os.getenv("REFRESH_TOKEN_PURGE_INTERVAL", "3600"))
+
+
+class RefreshTokenInvalid(Exception):
+    pass
+
+
+class RefreshGrant(NamedTuple):
+    subject: str
+    token_type: str
+    refresh_token: str
+
+
+def _hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_refresh_token(db: AsyncSession, user_id: int, subject: str, token_type: str,
+                        family_id: Optional[str] = None) -> str:
+    """Add a new token to the session and return it; the caller commits."""
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    db.add(RefreshToken(
+        token_hash=_hash(token),
+        family_id=family_id or secrets.token_hex(16),
+        user_id=user_id,
+        subject=subject,
+        token_type=token_type,
+        created_at=now,
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    ))
+    return token
+
+
+async def _revoke(db: AsyncSession, condition, now: datetime):
+    await db.execute(
+        update(RefreshToken)
+        .where(condition, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+    )
+
+
+async def revoke_user_refresh_tokens(db: AsyncSession, user_id: int):
+    """Revoke every live token of a user; the caller commits."""
+    await _revoke(db, RefreshToken.user_id == user_id, datetime.utcnow())
+
+
+async def _reject(db: AsyncSession, result: str, family_id: Optional[str] = None):
+    if family_id is not None:
+        await _revoke(db, RefreshToken.family_id == family_id, datetime.utcnow())
+        await db.commit()
+    auth_refresh_total.inc((result,))
+    raise RefreshTokenInvalid(result)
+
+
+async def rotate_refresh_token(db: AsyncSession, token: str) -> RefreshGrant:
+    """Revoke `token` and issue its successor; raises RefreshTokenInvalid."""
+    now = datetime.utcnow()
+    # The ban flag comes with the token row, so a refresh is one indexed lookup
+    row = (await db.execute(
+        select(
+            RefreshToken.id, RefreshToken.family_id, RefreshToken.user_id, RefreshToken.subject,
+            RefreshToken.token_type, RefreshToken.expires_at, RefreshToken.revoked_at, User.is_banned,
+        )
+        .outerjoin(User, User.tg_id == RefreshToken.user_id)
+        .where(RefreshToken.token_hash == _hash(token))
+    )).first()
+
+    if row is None:
+        await _reject(db, "invalid")
+    # Before the reuse check: tokens revoked by a ban are not a sign of theft
+    if row.is_banned:
+        await _reject(db, "banned", row.family_id)
+    if row.revoked_at is not None:
+        logger.warning("Refresh token reused, revoking its family",
+                       extra={"fields": {"user_id": row.user_id, "family_id": row.family_id}})
+        await _reject(db, "reused", row.family_id)
+    if row.expires_at <= now:
+        await _reject(db, "expired")
+
+    rotated = await db.execute(
+        update(RefreshToken)
+        .where(RefreshToken.id == row.id, RefreshToken.revoked_at.is_(None))
+        .values(revoked_at=now)
+    )
+    if rotated.rowcount != 1:
+        # A concurrent exchange of the same token won; same as a reuse
+        await _reject(db, "reused", row.family_id)
+
+    new_token = issue_refresh_token(db, row.user_id, row.subject, row.token_type, row.family_id)
+    await db.commit()
+    auth_refresh_total.inc(("ok",))
+    return RefreshGrant(subject=row.subject, token_type=row.token_type, refresh_token=new_token)
+
+
+async def purge_expired_refresh_tokens(db: AsyncSession) -> int:
+    result = await db.execute(delete(RefreshToken).where(RefreshToken.expires_at <= datetime.utcnow()))
+    await db.commit()
+    return result.rowcount
+
+
+async def run_refresh_token_purger(interval: float = REFRESH_TOKEN_PURGE_INTERVAL):
+    """Background loop started from the app lifespan; expired rows only grow the table."""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as db:
+                purged = await purge_expired_refresh_tokens(db)
+            if purged:
+                logger.info("Purged expired refresh tokens", extra={"fields": {"count": purged}})
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Refresh token purge failed")
@@ -0,0 +1,97 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from typing import NamedTuple, Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import SiteConfig
+
+# Upper bound on how long a worker may serve a cached row. Updates made through
+# this process invalidate immediately; the TTL only matters when several
+# workers share the database.
+CONFIG_CACHE_TTL = int(os.getenv("CONFIG_CACHE_TTL", "300"))
+
+
+class CachedSiteConfig(NamedTuple):
+    version: int
+    data: dict
+    body: bytes
+    etag: str
+
+
+def serialize_site_config(config: SiteConfig) -> dict:
+    return {
+        "id": config.id,
+        "bot_welcome_message": config.bot_welcome_message,
+        "site_title": config.site_title,
+        "site_announcement": config.site_announcement,
+        "support_link": config.support_link,
+    }
+
+
+async def load_site_config(db: AsyncSession) -> SiteConfig:
+    """Fetch the SiteConfig row, creating it with defaults on first use."""
+    result = await db.execute(select(SiteConfig).limit(1))
+    config = result.scalar_one_or_none()
+    if not config:
+        config = SiteConfig()
+        db.add(config)
+        await db.commit()
+        await db.refresh(config)
+    return config
+
+
+class SiteConfigCache:
+    """
+    In-process copy of the SiteConfig row.
+    Every invalidation bumps `version`; a load that raced with an invalidation
+    is served to its caller but never stored.
+    """
+
+    def __init__(self, ttl: int = CONFIG_CACHE_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self._entry: Optional[CachedSiteConfig] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+    def _current(self) -> Optional[CachedSiteConfig]:
+        entry = self._entry
+        if entry is None:
+            return None
+        if self.ttl > 0 and time.monotonic() - self._loaded_at >= self.ttl:
+            return None
+        return entry
+
+    async def get(self, db: AsyncSession) -> CachedSiteConfig:
+        entry = self._current()
+        if entry is not None:
+            return entry
+
+        async with self._lock:
+            entry = self._current()
+            if entry is not None:
+                return entry
+
+            version = self.version
+            data = serialize_site_config(await load_site_config(db))
+            body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+            # Content-derived so that every worker hands out the same tag
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()[:20]
+            entry = CachedSiteConfig(version, data, body, etag)
+
+            if version == self.version:
+                self._entry = entry
+                self._loaded_at = time.monotonic()
+            return entry
+
+    def invalidate(self):
+        self.version += 1
+        self._entry = None
+
+
+site_config_cache = SiteConfigCache()
@@ -0,0 +1,131 @@
+import asyncio
+import heapq
+import logging
+import os
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import AsyncSessionLocal
+from models import User, Subscription, Transaction
+
+logger = logging.getLogger(__name__)
+
+# How often the counters are recomputed from the database to correct drift
+STATS_RECONCILE_INTERVAL = float(os.getenv("STATS_RECONCILE_INTERVAL", "300"))
+# Width of an expiry bucket; the active count may lag real expiries by this much
+EXPIRY_BUCKET_SECONDS = 60
+
+
+def _bucket(expiry_date: datetime) -> int:
+    return int(expiry_date.timestamp()) // EXPIRY_BUCKET_SECONDS
+
+
+class StatsRollup:
+    """
+    Incrementally maintained numbers behind /admin/stats.
+
+    User and revenue totals are plain counters bumped by the write paths.
+    Active subscriptions are kept as counts per expiry bucket plus a min-heap
+    of bucket ids; reading pops the buckets that have fully expired, so a read
+    costs O(1) amortized. Each worker only sees its own writes, so
+    reconcile() periodically reloads everything from the database.
+    """
+
+    def __init__(self):
+        self.loaded = False
+        self.total_users = 0
+        self.total_revenue = 0.0
+        self._active = 0
+        self._buckets: Counter = Counter()
+        self._heap = []
+        self._lock = asyncio.Lock()
+
+    # --- write-path hooks ---
+
+    def record_user_created(self):
+        self.total_users += 1
+
+    def record_transaction_completed(self, amount: float):
+        self.total_revenue += amount or 0.0
+
+    def record_subscription(self, expiry_date: datetime, previous_expiry: Optional[datetime] = None):
+        """Count a new subscription, or move an extended one to its new bucket."""
+        if previous_expiry is not None:
+            self._remove_expiry(previous_expiry)
+        self._add_expiry(expiry_date)
+
+    def _add_expiry(self, expiry_date: datetime):
+        if expiry_date is None or expiry_date <= datetime.now():
+            return
+        bucket = _bucket(expiry_date)
+        if not self._buckets[bucket]:
+            heapq.heappush(self._heap, bucket)
+        self._buckets[bucket] += 1
+        self._active += 1
+
+    def _remove_expiry(self, expiry_date: datetime):
+        bucket = _bucket(expiry_date)
+        if self._buckets.get(bucket, 0) > 0:
+            self._buckets[bucket] -= 1
+            self._active -= 1
+            # Empty buckets stay in the heap and are skipped when they expire
+
+    # --- reads ---
+
+    @property
+    def active_subscriptions(self) -> int:
+        current = int(datetime.now().timestamp()) // EXPIRY_BUCKET_SECONDS
+        while self._heap and self._heap[0] < current:
+            bucket = heapq.heappop(self._heap)
+            self._active -= self._buckets.pop(bucket, 0)
+        return self._active
+
+    async def ensure_loaded(self, db: AsyncSession):
+        if not self.loaded:
+            await self.reconcile(db)
+
+    # --- reconciliation ---
+
+    async def reconcile(self, db: AsyncSession):
+        """Recompute every counter from the database."""
+        async with self._lock:
+            now = datetime.now()
+            total_users = (await db.execute(select(func.count(User.tg_id)))).scalar() or 0
+            revenue_stmt = select(func.sum(Transaction.amount)).where(Transaction.status == "Completed")
+            total_revenue = (await db.execute(revenue_stmt)).scalar() or 0.0
+            expiry_stmt = select(Subscription.expiry_date).where(Subscription.expiry_date > now)
+            expiries = (await db.execute(expiry_stmt)).scalars().all()
+
+            buckets = Counter(_bucket(expiry) for expiry in expiries)
+            if self.loaded and (total_users != self.total_users or len(expiries) != self.active_subscriptions):
+                logger.info(
+                    "Stats drift corrected: users %s -> %s, active subscriptions %s -> %s",
+                    self.total_users, total_users, self._active, len(expiries),
+                )
+
+            self.total_users = total_users
+            self.total_revenue = float(total_revenue)
+            self._buckets = buckets
+            self._heap = list(buckets)
+            heapq.heapify(self._heap)
+            self._active = len(expiries)
+            self.loaded = True
+
+    async def run_reconciler(self, interval: float = STATS_RECONCILE_INTERVAL):
+        """Background loop started from the app lifespan."""
+        while True:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self.reconcile(db)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Stats reconciliation failed")
+            await asyncio.sleep(interval)
+
+
+stats_rollup = StatsRollup()
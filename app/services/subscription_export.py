@@ -0,0 +1,280 @@
+"""
+Public subscription feeds polled by VPN clients (v2rayNG, Clash, sing-box).
+
+A feed is addressed by a signed token (`<tg_id>.<hmac>`), so it is checked
+without a database lookup. Rendered bodies are cached per user and format
+until the user's subscriptions change (invalidate()), the earliest rendered
+subscription expires, or SUBSCRIPTION_CACHE_TTL passes. A poll that hits
+the cache, which is the common case, never touches the database.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from email.utils import formatdate
+from typing import Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from sqlalchemy import select
+
+from database import AsyncSessionLocal
+from models import User, Subscription
+
+SUBSCRIPTION_TOKEN_SECRET = os.getenv("SUBSCRIPTION_TOKEN_SECRET") or os.getenv(
+    "SECRET_KEY", "your-secret-key-change-in-production"
+)
+# Public prefix the feed URLs are handed out under (nginx serves the API at /api)
+SUBSCRIPTION_BASE_URL = os.getenv("SUBSCRIPTION_BASE_URL", "https://tssvpn.com/api")
+# Bounds staleness when another worker changed the subscriptions
+SUBSCRIPTION_CACHE_TTL = int(os.getenv("SUBSCRIPTION_CACHE_TTL", "300"))
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "10000"))
+
+GROUP_NAME = "TssVPN"
+
+
+# --- tokens ---
+
+def _signature(tg_id: int) -> str:
+    digest = hmac.new(SUBSCRIPTION_TOKEN_SECRET.encode(), f"sub:{tg_id}".encode(), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(digest[:18]).decode()
+
+
+def subscription_token(tg_id: int) -> str:
+    return f"{tg_id}.{_signature(tg_id)}"
+
+
+def subscription_url(tg_id: int) -> str:
+    return f"{SUBSCRIPTION_BASE_URL}/sub/{subscription_token(tg_id)}"
+
+
+def parse_subscription_token(token: str) -> Optional[int]:
+    """tg_id for a valid token, None otherwise."""
+    tg_id, _, signature = token.partition(".")
+    if not tg_id.isdigit():
+        return None
+    if not hmac.compare_digest(signature, _signature(int(tg_id))):
+        return None
+    return int(tg_id)
+
+
+# --- rendering ---
+
+class VlessLink(NamedTuple):
+    name: str
+    uuid: str
+    server: str
+    port: int
+    params: Dict[str, str]
+
+
+def parse_vless(link: str, default_name: str) -> Optional[VlessLink]:
+    parts = urlsplit(link)
+    if parts.scheme != "vless" or not parts.hostname or not parts.username:
+        return None
+    params = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    return VlessLink(
+        name=unquote(parts.fragment) or default_name,
+        uuid=unquote(parts.username),
+        server=parts.hostname,
+        port=parts.port or 443,
+        params=params,
+    )
+
+
+def render_base64(links: List[str], proxies: List[VlessLink]) -> bytes:
+    return base64.b64encode("\n".join(links).encode())
+
+
+def _clash_proxy(proxy: VlessLink) -> List[str]:
+    q = json.dumps  # JSON strings are valid YAML double-quoted scalars
+    params = proxy.params
+    lines = [
+        f"  - name: {q(proxy.name)}",
+        "    type: vless",
+        f"    server: {q(proxy.server)}",
+        f"    port: {proxy.port}",
+        f"    uuid: {q(proxy.uuid)}",
+        "    udp: true",
+    ]
+    if params.get("flow"):
+        lines.append(f"    flow: {q(params['flow'])}")
+    network = params.get("type", "tcp")
+    lines.append(f"    network: {q(network)}")
+    if params.get("security") in ("tls", "reality"):
+        lines.append("    tls: true")
+        if params.get("sni"):
+            lines.append(f"    servername: {q(params['sni'])}")
+        if params.get("fp"):
+            lines.append(f"    client-fingerprint: {q(params['fp'])}")
+    if params.get("security") == "reality":
+        lines.append("    reality-opts:")
+        lines.append(f"      public-key: {q(params.get('pbk', ''))}")
+        lines.append(f"      short-id: {q(params.get('sid', ''))}")
+    if network == "grpc":
+        lines.append("    grpc-opts:")
+        lines.append(f"      grpc-service-name: {q(params.get('serviceName', ''))}")
+    elif network == "ws":
+        lines.append("    ws-opts:")
+        lines.append(f"      path: {q(params.get('path', '/'))}")
+        if params.get("host"):
+            lines.append(f"      headers: {{Host: {q(params['host'])}}}")
+    return lines
+
+
+def render_clash(links: List[str], proxies: List[VlessLink]) -> bytes:
+    lines = ["proxies:"] if proxies else ["proxies: []"]
+    for proxy in proxies:
+        lines.extend(_clash_proxy(proxy))
+    names = ", ".join(json.dumps(proxy.name) for proxy in proxies)
+    lines += [
+        "proxy-groups:",
+        f"  - name: {json.dumps(GROUP_NAME)}",
+        "    type: select",
+        f"    proxies: [{names or 'DIRECT'}]",
+        "rules:",
+        f"  - MATCH,{GROUP_NAME}",
+    ]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def _singbox_outbound(proxy: VlessLink) -> dict:
+    params = proxy.params
+    outbound = {
+        "type": "vless",
+        "tag": proxy.name,
+        "server": proxy.server,
+        "server_port": proxy.port,
+        "uuid": proxy.uuid,
+    }
+    if params.get("flow"):
+        outbound["flow"] = params["flow"]
+    if params.get("security") in ("tls", "reality"):
+        tls = {"enabled": True}
+        if params.get("sni"):
+            tls["server_name"] = params["sni"]
+        if params.get("fp"):
+            tls["utls"] = {"enabled": True, "fingerprint": params["fp"]}
+        if params.get("security") == "reality":
+            tls["reality"] = {"enabled": True, "public_key": params.get("pbk", ""), "short_id": params.get("sid", "")}
+        outbound["tls"] = tls
+    network = params.get("type", "tcp")
+    if network == "grpc":
+        outbound["transport"] = {"type": "grpc", "service_name": params.get("serviceName", "")}
+    elif network == "ws":
+        outbound["transport"] = {"type": "ws", "path": params.get("path", "/")}
+        if params.get("host"):
+            outbound["transport"]["headers"] = {"Host": params["host"]}
+    return outbound
+
+
+def render_singbox(links: List[str], proxies: List[VlessLink]) -> bytes:
+    outbounds = [_singbox_outbound(proxy) for proxy in proxies]
+    tags = [proxy.name for proxy in proxies] or ["direct"]
+    outbounds.insert(0, {"type": "selector", "tag": GROUP_NAME, "outbounds": tags})
+    outbounds.append({"type": "direct", "tag": "direct"})
+    return json.dumps({"outbounds": outbounds}, ensure_ascii=False, indent=2).encode()
+
+
+RENDERERS = {
+    "base64": (render_base64, "text/plain; charset=utf-8"),
+    "clash": (render_clash, "text/yaml; charset=utf-8"),
+    "singbox": (render_singbox, "application/json"),
+}
+
+
+# --- cache ---
+
+class RenderedFeed(NamedTuple):
+    body: bytes
+    media_type: str
+    etag: str
+    last_modified: str  # HTTP date
+    expires_at: float  # monotonic
+
+
+class SubscriptionFeedCache:
+    def __init__(self, ttl: int = SUBSCRIPTION_CACHE_TTL, maxsize: int = SUBSCRIPTION_CACHE_SIZE):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # tg_id -> {format: RenderedFeed}, least recently used first
+        self._entries: "OrderedDict[int, Dict[str, RenderedFeed]]" = OrderedDict()
+        self._generation = 0
+
+    def peek(self, tg_id: int, fmt: str) -> Optional[RenderedFeed]:
+        feeds = self._entries.get(tg_id)
+        feed = feeds.get(fmt) if feeds else None
+        if feed is None or feed.expires_at <= time.monotonic():
+            return None
+        self._entries.move_to_end(tg_id)
+        return feed
+
+    async def get(self, tg_id: int, fmt: str) -> RenderedFeed:
+        feed = self.peek(tg_id, fmt)
+        if feed is not None:
+            return feed
+
+        generation = self._generation
+        now = datetime.now()
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                select(Subscription.tariff_name, Subscription.expiry_date, Subscription.proxy_links)
+                .join(User, User.tg_id == Subscription.user_id)
+                .where(
+                    Subscription.user_id == tg_id,
+                    Subscription.expiry_date > now,
+                    User.is_banned.isnot(True),
+                )
+                .order_by(Subscription.expiry_date.desc())
+            )
+            rows = result.all()
+
+        links, proxies = [], []
+        for row in rows:
+            # Stored by provisioning from Marzban's per-protocol links
+            for link in (row.proxy_links or "").splitlines():
+                proxy = parse_vless(link, f"{GROUP_NAME} {row.tariff_name}")
+                if proxy is not None:
+                    links.append(link)
+                    proxies.append(proxy)
+
+        render, media_type = RENDERERS[fmt]
+        body = render(links, proxies)
+        # Re-render once the earliest subscription in the feed expires
+        ttl = self.ttl
+        if rows:
+            ttl = min(ttl, max(0.0, (min(row.expiry_date for row in rows) - now).total_seconds()))
+        feed = RenderedFeed(
+            body=body,
+            media_type=media_type,
+            etag='"%s"' % hashlib.sha1(body).hexdigest()[:20],
+            last_modified=formatdate(time.time(), usegmt=True),
+            expires_at=time.monotonic() + ttl,
+        )
+
+        # Don't keep a render that raced an invalidation
+        if generation == self._generation:
+            previous = self._entries.get(tg_id, {}).get(fmt)
+            if previous is not None and previous.etag == feed.etag:
+                # Unchanged content keeps its Last-Modified
+                feed = feed._replace(last_modified=previous.last_modified)
+            self._entries.setdefault(tg_id, {})[fmt] = feed
+            self._entries.move_to_end(tg_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return feed
+
+    def invalidate(self, tg_id: int):
+        """Call after a user's subscriptions (or ban status) change."""
+        self._generation += 1
+        self._entries.pop(tg_id, None)
+
+    def clear(self):
+        self._generation += 1
+        self._entries.clear()
+
+
+subscription_feed_cache = SubscriptionFeedCache()
@@ -0,0 +1,77 @@
+"""
+Persisting Telegram Login users.
+
+upsert_telegram_user() creates the user or refreshes its profile with one
+INSERT ... ON CONFLICT (tg_id) DO UPDATE that only writes when a profile
+field actually differs, so repeated logins leave the row (and its WAL)
+alone and two first logins for the same tg_id cannot collide on the
+primary key.
+
+On PostgreSQL the upsert sits in a CTE whose result falls back to the
+existing row when nothing was written: one round trip in every case.
+SQLite cannot use RETURNING inside a CTE, so there an unchanged login
+reads the row with a second SELECT.
+"""
+from datetime import datetime
+from typing import NamedTuple
+
+from sqlalchemy import false, literal, or_, select, true
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import engine
+from models import User
+
+_PROFILE_FIELDS = ("username", "first_name", "last_name", "avatar_url")
+# Everything the callback returns to the client
+_COLUMNS = (User.tg_id, User.username, User.first_name, User.last_name, User.avatar_url,
+            User.balance, User.created_at)
+
+
+class TelegramLogin(NamedTuple):
+    user: Row
+    created: bool
+    # Row inserted or profile changed
+    written: bool
+
+
+def _upsert_statement(dialect, tg_id: int, created_at: datetime, profile: dict):
+    stmt = dialect.insert(User).values(tg_id=tg_id, created_at=created_at, **profile)
+    changed = or_(*(getattr(User, field).is_distinct_from(stmt.excluded[field]) for field in _PROFILE_FIELDS))
+    return stmt.on_conflict_do_update(
+        index_elements=[User.tg_id],
+        set_={field: stmt.excluded[field] for field in _PROFILE_FIELDS},
+        where=changed,
+    )
+
+
+async def upsert_telegram_user(db: AsyncSession, tg_id: int, profile: dict) -> TelegramLogin:
+    """Insert or update the user from verified login data; the caller commits. `profile` holds _PROFILE_FIELDS."""
+    # A fresh insert returns exactly this value; an update keeps the stored one
+    created_at = datetime.utcnow()
+
+    if engine.dialect.name == "postgresql":
+        upserted = (
+            _upsert_statement(postgresql, tg_id, created_at, profile)
+            .returning(*_COLUMNS, true().label("written"))
+            .cte("upserted")
+        )
+        query = select(upserted).union_all(
+            select(*_COLUMNS, false().label("written"))
+            .where(User.tg_id == tg_id, ~select(upserted.c.tg_id).exists())
+        )
+        row = (await db.execute(query)).first()
+    else:
+        stmt = _upsert_statement(sqlite, tg_id, created_at, profile)
+        row = (await db.execute(stmt.returning(*_COLUMNS, literal(True).label("written")))).first()
+
+    if row is None:
+        # Nothing changed (SQLite), or a concurrent first login committed after
+        # the CTE's snapshot was taken (PostgreSQL)
+        row = (await db.execute(
+            select(*_COLUMNS, literal(False).label("written")).where(User.tg_id == tg_id)
+        )).one()
+
+    return TelegramLogin(user=row, created=bool(row.written) and row.created_at == created_at,
+                         written=bool(row.written))
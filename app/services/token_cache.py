@@ -0,0 +1,67 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+
+
+class TokenCache:
+    """
+    Bounded LRU of access tokens that already passed signature and expiry
+    checks. Entries are keyed by a SHA-256 digest of the token (the raw token
+    is never kept) and hold only the decoded `sub` and `exp`. An entry is
+    dropped at its token's expiry or when it is the least recently used one
+    and the cache is full.
+    """
+
+    def __init__(self, capacity: int = TOKEN_CACHE_SIZE):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[bytes, Tuple[str, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        """Return the cached `sub` for a still-valid token, or None."""
+        key = self._key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            sub, exp = entry
+            if time.time() >= exp:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return sub
+
+    def put(self, token: str, sub: str, exp: Optional[float]):
+        # Tokens without an expiry are never cached, so they are always re-verified
+        if exp is None or self.capacity <= 0:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (sub, float(exp))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+token_cache = TokenCache()
@@ -0,0 +1,133 @@
+"""
+Bulk copy of per-user traffic from Marzban into the `vpn_usage` table.
+
+Every USAGE_SYNC_INTERVAL seconds the whole Marzban user list is read in
+pages of USAGE_SYNC_PAGE_SIZE, so the panel sees ceil(users / page) requests
+per interval whatever the number of dashboard views. The last values written
+for each username are kept in memory (seeded from the table on the first
+run); only rows that differ from them are upserted, one INSERT ... ON
+CONFLICT statement per page.
+
+Run the sync in one process only (USAGE_SYNC_ENABLED=false elsewhere).
+"""
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from database import AsyncSessionLocal, engine
+from models import VpnUsage
+from services.marzban import marzban
+
+logger = logging.getLogger(__name__)
+
+USAGE_SYNC_ENABLED = os.getenv("USAGE_SYNC_ENABLED", "true").lower() == "true"
+USAGE_SYNC_INTERVAL = float(os.getenv("USAGE_SYNC_INTERVAL", "300"))
+USAGE_SYNC_PAGE_SIZE = int(os.getenv("USAGE_SYNC_PAGE_SIZE", "500"))
+
+# Usernames created by services/provisioning.py: tss<user_id>_<subscription_id>
+_PROVISIONED_USERNAME = re.compile(r"^tss\d+_(\d+)$")
+
+_SYNCED_FIELDS = ("status", "used_traffic", "data_limit", "expire_at", "online_at")
+
+
+def _parse_online_at(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _to_row(user: Dict[str, Any]) -> Dict[str, Any]:
+    match = _PROVISIONED_USERNAME.match(user["username"])
+    expire = user.get("expire")
+    return {
+        "username": user["username"],
+        "subscription_id": int(match.group(1)) if match else None,
+        "status": user.get("status"),
+        "used_traffic": user.get("used_traffic") or 0,
+        "data_limit": user.get("data_limit"),
+        "expire_at": datetime.fromtimestamp(expire) if expire else None,
+        "online_at": _parse_online_at(user.get("online_at")),
+    }
+
+
+def _fingerprint(row) -> Tuple:
+    return tuple(row[field] for field in _SYNCED_FIELDS)
+
+
+def _upsert(rows: List[Dict[str, Any]]):
+    dialect = postgresql if engine.dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(VpnUsage).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[VpnUsage.username],
+        set_={
+            "subscription_id": stmt.excluded.subscription_id,
+            **{field: getattr(stmt.excluded, field) for field in _SYNCED_FIELDS},
+            "updated_at": stmt.excluded.updated_at,
+        },
+    )
+
+
+class UsageSync:
+    def __init__(self, page_size: int = USAGE_SYNC_PAGE_SIZE):
+        self.page_size = page_size
+        # username -> values last written; the write-side high-water mark
+        self._written: Optional[Dict[str, Tuple]] = None
+
+    async def _load_written(self):
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(select(VpnUsage.username, *(getattr(VpnUsage, f) for f in _SYNCED_FIELDS)))
+            self._written = {row.username: _fingerprint(row._mapping) for row in result}
+
+    async def sync_once(self) -> int:
+        """Read every Marzban user page by page; returns the number of rows written."""
+        if self._written is None:
+            await self._load_written()
+
+        written = 0
+        offset = 0
+        while True:
+            users, total = await marzban.list_users(offset, self.page_size)
+            if not users:
+                break
+            now = datetime.utcnow()
+            changed = []
+            for user in users:
+                row = _to_row(user)
+                if self._written.get(row["username"]) != _fingerprint(row):
+                    row["updated_at"] = now
+                    changed.append(row)
+            if changed:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(_upsert(changed))
+                    await db.commit()
+                for row in changed:
+                    self._written[row["username"]] = _fingerprint(row)
+                written += len(changed)
+            offset += len(users)
+            if offset >= total:
+                break
+        return written
+
+    async def run(self, interval: float = USAGE_SYNC_INTERVAL):
+        """Background loop started from the app lifespan."""
+        while True:
+            try:
+                written = await self.sync_once()
+                logger.info("Usage sync wrote %s changed rows", written)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Usage sync failed")
+            await asyncio.sleep(interval)
+
+
+usage_sync = UsageSync()
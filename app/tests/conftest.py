@@ -0,0 +1,111 @@
+"""
+Shared fixtures.
+
+The app runs for the whole session against a throwaway SQLite database
+(built by the migrations at startup) with Marzban in mock mode. Tests share
+that database, so each one works on its own users: take ids from `new_id`.
+
+    cd app && python -m pytest
+"""
+import hashlib
+import hmac
+import itertools
+import os
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from urllib.parse import urlencode
+
+_DB_DIR = tempfile.mkdtemp(prefix="tssvpn-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{_DB_DIR}/test.db"
+os.environ.pop("REPLICA_DATABASE_URL", None)
+os.environ.pop("MARZBAN_URL", None)
+os.environ["BOT_TOKEN"] = "123456:test-token"
+os.environ["BOT_API_SECRET"] = "test-bot-secret"
+os.environ["BCRYPT_ROUNDS"] = "4"
+# Admission limits are tested on their own limiters, not through the shared app
+os.environ["AUTH_IP_BURST"] = "100000"
+os.environ["AUTH_IDENTITY_BURST"] = "100000"
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+from fastapi.testclient import TestClient
+
+BOT_SECRET_HEADERS = {"X-Bot-Secret": "test-bot-secret"}
+
+
+def telegram_login_body(tg_id, **fields) -> str:
+    """Login Widget form body for `tg_id`, signed with the test bot token."""
+    data = {"id": str(tg_id), "first_name": "Test", "auth_date": str(int(time.time())), **fields}
+    check_string = "\n".join(f"{k}={v}" for k, v in sorted(data.items()) if k != "photo_url" or v)
+    secret = hashlib.sha256(os.environ["BOT_TOKEN"].encode()).digest()
+    data["hash"] = hmac.new(secret, check_string.encode(), hashlib.sha256).hexdigest()
+    return urlencode(data)
+
+
+# Spaced out so web registrations (SQLite rowid = max + 1) never take a handed-out id
+_ids = itertools.count(1_000_000, 1000)
+
+
+@pytest.fixture(scope="session")
+def app():
+    import main
+    return main.app
+
+
+@pytest.fixture(scope="session")
+def client(app):
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def run(client):
+    """Run a coroutine function on the app's event loop."""
+    return lambda fn, *args: client.portal.call(fn, *args)
+
+
+@pytest.fixture
+def new_id():
+    return lambda: next(_ids)
+
+
+@pytest.fixture
+def add(run):
+    """Insert ORM objects in one committed session."""
+    from database import AsyncSessionLocal
+
+    async def _add(*objs):
+        async with AsyncSessionLocal() as db:
+            db.add_all(objs)
+            await db.commit()
+
+    return lambda *objs: run(_add, *objs)
+
+
+@pytest.fixture
+def make_user(add, new_id):
+    from models import User
+
+    def _make_user(**fields):
+        tg_id = fields.pop("tg_id", None) or new_id()
+        fields.setdefault("username", f"u{tg_id}")
+        add(User(tg_id=tg_id, **fields))
+        return tg_id
+
+    return _make_user
+
+
+@pytest.fixture
+def auth():
+    """Bearer headers for a token subject (tg_id or username)."""
+    import main
+
+    def _auth(sub):
+        token = main.create_access_token({"sub": str(sub)}, timedelta(minutes=5))
+        return {"Authorization": f"Bearer {token}"}
+
+    return _auth
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from services.admin_users import InvalidCursor, decode_cursor, encode_cursor
+
+
+def test_cursor_round_trip():
+    created_at = datetime(2025, 3, 4, 5, 6, 7, 890)
+    assert decode_cursor(encode_cursor(created_at, 42)) == (created_at, 42)
+
+
+@pytest.mark.parametrize("cursor", ["zzz", "", encode_cursor(datetime(2025, 1, 1), 1)[:-3] + "!!!"])
+def test_malformed_cursor_is_rejected(cursor):
+    with pytest.raises(InvalidCursor):
+        decode_cursor(cursor)
+
+
+def all_pages(client, headers, limit):
+    seen, cursor = [], None
+    while True:
+        params = {"limit": limit, **({"cursor": cursor} if cursor else {})}
+        response = client.get("/admin/users", params=params, headers=headers)
+        assert response.status_code == 200
+        seen.extend(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return seen
+
+
+def test_pages_cover_every_user_once_newest_first(client, make_user, auth, add):
+    from models import Subscription
+
+    # Far in the future, so these users make up the first pages; ties go by tg_id
+    newest = make_user(created_at=datetime(2099, 1, 2))
+    tied = [make_user(created_at=datetime(2099, 1, 1)) for _ in range(3)]
+    add(
+        Subscription(user_id=tied[0], tariff_name="a", expiry_date=datetime.now() + timedelta(days=3)),
+        Subscription(user_id=tied[0], tariff_name="b", expiry_date=datetime.now() + timedelta(days=3)),
+        Subscription(user_id=tied[0], tariff_name="c", expiry_date=datetime.now() - timedelta(days=3)),
+    )
+    admin = auth(make_user(is_admin=True))
+
+    users = all_pages(client, admin, limit=2)
+    ids = [u["id"] for u in users]
+    assert len(ids) == len(set(ids))
+    assert ids[:4] == [newest] + sorted(tied, reverse=True)
+    keys = {u["id"]: (u["keys_count"], u["status"]) for u in users}
+    assert keys[tied[0]] == (2, "Active")
+    assert keys[tied[1]] == (0, "Inactive")
+
+    created = [u["created_at"] for u in users]
+    assert created == sorted(created, reverse=True)
+
+
+def test_bad_cursor_answers_400(client, make_user, auth):
+    response = client.get("/admin/users", params={"cursor": "zzz"}, headers=auth(make_user(is_admin=True)))
+    assert response.status_code == 400
@@ -0,0 +1,108 @@
+import time
+
+import pytest
+
+from conftest import telegram_login_body
+from services import admission
+from services.admission import ReplayCache, TokenBucketLimiter, telegram_auth_is_fresh
+
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Drive services.admission's monotonic clock by hand."""
+
+    class Clock:
+        now = 1000.0
+
+    monkeypatch.setattr(admission.time, "monotonic", lambda: Clock.now)
+    return Clock
+
+
+def test_token_bucket_refills_at_its_rate(clock):
+    limiter = TokenBucketLimiter(rate=1, burst=2)
+    assert limiter.acquire("a") is None
+    assert limiter.acquire("a") is None
+    assert limiter.acquire("a") == pytest.approx(1.0)
+    # Other keys have their own bucket
+    assert limiter.acquire("b") is None
+
+    clock.now += 0.5
+    assert limiter.acquire("a") == pytest.approx(0.5)
+    clock.now += 0.5
+    assert limiter.acquire("a") is None
+
+
+def test_token_bucket_evicts_the_least_recently_used_key(clock):
+    limiter = TokenBucketLimiter(rate=0, burst=1, max_keys=2)
+    limiter.acquire("a")
+    limiter.acquire("b")
+    limiter.acquire("c")
+    assert len(limiter) == 2
+    # "a" was evicted, so it starts over with a full bucket
+    assert limiter.acquire("a") is None
+    assert limiter.acquire("c") == float("inf")
+
+
+def test_replay_cache_forgets_keys_after_the_ttl(clock):
+    cache = ReplayCache(ttl=10, max_size=2)
+    assert cache.add("x") is True
+    assert cache.add("x") is False
+    clock.now += 11
+    assert cache.add("x") is True
+    cache.add("y")
+    cache.add("z")
+    assert len(cache) == 2
+
+
+def test_auth_date_freshness():
+    now = time.time()
+    assert telegram_auth_is_fresh(str(int(now)), now)
+    assert not telegram_auth_is_fresh(now - admission.TELEGRAM_AUTH_MAX_AGE - 1, now)
+    assert telegram_auth_is_fresh(now + 30, now)
+    assert not telegram_auth_is_fresh(now + 600, now)
+    assert not telegram_auth_is_fresh("yesterday", now)
+    assert not telegram_auth_is_fresh(None, now)
+
+
+def test_signed_payload_is_accepted_once(client, new_id):
+    body = telegram_login_body(new_id(), username=f"tg{new_id()}")
+    assert client.post("/auth/telegram/callback", content=body, headers=FORM).status_code == 200
+    replay = client.post("/auth/telegram/callback", content=body, headers=FORM)
+    assert replay.status_code == 409
+
+
+def test_stale_payload_is_rejected(client, new_id):
+    body = telegram_login_body(new_id(), auth_date=str(int(time.time()) - admission.TELEGRAM_AUTH_MAX_AGE - 60))
+    response = client.post("/auth/telegram/callback", content=body, headers=FORM)
+    assert response.status_code == 400
+    assert "expired" in response.json()["detail"]
+
+
+def test_forged_payloads_do_not_use_up_the_id_limit(client, new_id, monkeypatch):
+    monkeypatch.setattr(admission, "identity_limiter", TokenBucketLimiter(rate=0, burst=1))
+    tg_id = new_id()
+    forged = telegram_login_body(tg_id).replace("hash=", "hash=0")
+    for _ in range(3):
+        assert client.post("/auth/telegram/callback", content=forged, headers=FORM).status_code == 400
+
+    # The owner still gets in, and only then is their single token spent
+    genuine = telegram_login_body(tg_id, username=f"tg{tg_id}")
+    assert client.post("/auth/telegram/callback", content=genuine, headers=FORM).status_code == 200
+    again = telegram_login_body(tg_id, username=f"tg{tg_id}", last_name="Again")
+    assert client.post("/auth/telegram/callback", content=again, headers=FORM).status_code == 429
+
+
+def test_auth_routes_are_limited_per_ip_before_the_handler(client, monkeypatch):
+    monkeypatch.setattr(admission, "ip_limiter", TokenBucketLimiter(rate=0.5, burst=1))
+    headers = {"X-Real-IP": "203.0.113.9"}
+    login = {"username": "nobody", "password": "wrong"}
+    assert client.post("/auth/login", json=login, headers=headers).status_code == 401
+
+    limited = client.post("/auth/login", json=login, headers=headers)
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "2"
+    # Other clients and other routes are unaffected
+    assert client.post("/auth/login", json=login, headers={"X-Real-IP": "203.0.113.10"}).status_code == 401
+    assert client.get("/shop/plans", headers=headers).status_code == 200
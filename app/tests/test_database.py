@@ -0,0 +1,45 @@
+import asyncio
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import database
+from database import TimedAsyncQueuePool, engine_options, warm_up_pool
+from metrics import db_pool_checkout_seconds
+
+
+def test_postgres_engines_get_the_tuned_pool():
+    options = engine_options("postgresql+asyncpg://u:p@db/app")
+    assert options["poolclass"] is TimedAsyncQueuePool
+    assert (options["pool_size"], options["max_overflow"]) == (database.DB_POOL_SIZE, database.DB_MAX_OVERFLOW)
+    assert options["pool_pre_ping"] is database.DB_POOL_PRE_PING
+    assert options["connect_args"] == {"prepared_statement_cache_size": database.DB_STATEMENT_CACHE_SIZE}
+    # The statement cache is an asyncpg option
+    assert engine_options("postgresql+psycopg://u:p@db/app")["connect_args"] == {}
+
+
+def test_sqlite_keeps_the_defaults():
+    options = engine_options("sqlite+aiosqlite:///./test.db")
+    assert "poolclass" not in options
+    assert options["connect_args"] == {"check_same_thread": False}
+
+
+def test_checkouts_are_timed_and_the_pool_is_warmed_up(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/pool.db", poolclass=TimedAsyncQueuePool,
+                                 pool_size=3, max_overflow=0)
+
+    async def scenario():
+        before = sum(db_pool_checkout_seconds.snapshot().get((), [0])[:-1])
+        await warm_up_pool(engine, count=5)
+        pool = engine.sync_engine.pool
+        idle, checked_out = pool.checkedin(), pool.checkedout()
+        async with engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        after = sum(db_pool_checkout_seconds.snapshot()[()][:-1])
+        await engine.dispose()
+        return idle, checked_out, after - before
+
+    idle, checked_out, timed = asyncio.run(scenario())
+    # Capped at the pool size, and all returned to the pool
+    assert (idle, checked_out) == (3, 0)
+    assert timed == 4
@@ -0,0 +1,59 @@
+import json
+from datetime import datetime, timedelta
+
+import fast_json
+from fast_json import _chunks, json_list_response
+from fastapi.responses import StreamingResponse
+
+ITEMS = [{"id": str(i), "name": f"Тариф {i}", "price": i / 2, "tags": [], "note": None} for i in range(7)]
+
+
+def test_chunked_body_matches_a_single_encode():
+    for chunk_rows in (1, 3, 7, 100):
+        body = b"".join(_chunks(iter(ITEMS), chunk_rows))
+        assert json.loads(body) == ITEMS
+    assert b"".join(_chunks(iter([]), 3)) == b"[]"
+
+
+def test_short_lists_are_sent_as_one_body(monkeypatch):
+    monkeypatch.setattr(fast_json, "JSON_STREAM_THRESHOLD", 7)
+    response = json_list_response(iter(ITEMS), headers={"X-Total": "7"})
+    assert not isinstance(response, StreamingResponse)
+    assert json.loads(response.body) == ITEMS
+    assert response.headers["X-Total"] == "7"
+
+
+def test_long_lists_are_streamed_and_built_lazily(monkeypatch):
+    monkeypatch.setattr(fast_json, "JSON_STREAM_THRESHOLD", 2)
+    monkeypatch.setattr(fast_json, "JSON_STREAM_CHUNK_ROWS", 2)
+    pulled = []
+
+    def items():
+        for item in ITEMS:
+            pulled.append(item["id"])
+            yield item
+
+    response = json_list_response(items())
+    assert isinstance(response, StreamingResponse)
+    # Only threshold + 1 items were looked at to choose streaming
+    assert len(pulled) == 3
+
+
+def test_streamed_endpoint_returns_the_same_json(client, make_user, add, auth, monkeypatch):
+    from models import Subscription
+
+    tg_id = make_user()
+    add(*(Subscription(user_id=tg_id, tariff_name=f"plan-{d}", expiry_date=datetime.now() + timedelta(days=d))
+          for d in (-1, 5, 30)))
+    whole = client.get("/users/keys", headers=auth(tg_id))
+
+    monkeypatch.setattr(fast_json, "JSON_STREAM_THRESHOLD", 1)
+    monkeypatch.setattr(fast_json, "JSON_STREAM_CHUNK_ROWS", 2)
+    streamed = client.get("/users/keys", headers=auth(tg_id))
+
+    assert "content-length" in whole.headers
+    assert "content-length" not in streamed.headers
+    assert streamed.json() == whole.json()
+    assert [(k["name"], k["status"]) for k in whole.json()] == [
+        ("plan-30", "Active"), ("plan-5", "Active"), ("plan--1", "Expired"),
+    ]
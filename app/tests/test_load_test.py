@@ -0,0 +1,52 @@
+import os
+import sys
+import time
+from urllib.parse import urlencode
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+from load_test import Stats, parse_scenarios, percentile, sign_telegram_auth
+
+
+def test_percentile_is_nearest_rank():
+    values = [i / 100 for i in range(1, 101)]
+    assert percentile(values, 50) == 0.50
+    assert percentile(values, 95) == 0.95
+    assert percentile(values, 99) == 0.99
+    assert percentile([0.3], 99) == 0.3
+    assert percentile([], 50) == 0.0
+
+
+def test_summary_counts_http_and_transport_errors():
+    stats = Stats()
+    for latency in (0.01, 0.02, 0.03):
+        stats.record("GET /users/me", latency, status=200)
+    stats.record("GET /users/me", 0.04, status=503)
+    stats.record("POST /shop/buy", 0.05, error="ReadTimeout")
+
+    summary = stats.summary(elapsed=2.0)
+    me = summary["endpoints"]["GET /users/me"]
+    assert (summary["requests"], summary["errors"]) == (5, 2)
+    assert me["status_codes"] == {"200": 3, "503": 1}
+    assert me["error_breakdown"] == {"HTTP 503": 1}
+    assert me["throughput_rps"] == 2.0
+    assert me["latency_ms"]["max"] == pytest.approx(40.0)
+    assert summary["endpoints"]["POST /shop/buy"]["error_rate"] == 1.0
+
+
+def test_parse_scenarios():
+    # A missing weight falls back to the scenario's default
+    assert parse_scenarios("users_me=10,login") == [("users_me", 10), ("login", 2)]
+    with pytest.raises(SystemExit):
+        parse_scenarios("nope=1")
+
+
+def test_signed_payload_is_accepted_by_the_backend(client, new_id):
+    payload = sign_telegram_auth(
+        {"id": new_id(), "first_name": "Load", "username": f"lt{time.time_ns()}", "auth_date": int(time.time())},
+        os.environ["BOT_TOKEN"],
+    )
+    response = client.post("/auth/telegram/callback", content=urlencode(payload),
+                           headers={"Content-Type": "application/x-www-form-urlencoded"})
+    assert response.status_code == 200
@@ -0,0 +1,48 @@
+import json
+import logging
+import queue
+import sys
+
+from logging_config import JsonFormatter, NonBlockingQueueHandler, SamplingFilter, _parse_levels
+
+
+def make_record(msg="hello %s", args=("world",), level=logging.INFO, **extra):
+    record = logging.LogRecord("tssvpn.test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_formatter_renders_one_json_object_with_extra_fields():
+    line = JsonFormatter().format(make_record(fields={"user_id": 7, "ip": "10.0.0.1"}))
+    payload = json.loads(line)
+    assert "\n" not in line
+    assert payload["msg"] == "hello world"
+    assert (payload["level"], payload["logger"]) == ("INFO", "tssvpn.test")
+    assert (payload["user_id"], payload["ip"]) == (7, "10.0.0.1")
+
+
+def test_queue_handler_resolves_the_record_and_drops_when_full():
+    log_queue = queue.Queue(maxsize=1)
+    handler = NonBlockingQueueHandler(log_queue)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        handler.handle(make_record(exc_info=sys.exc_info()))
+    handler.handle(make_record())
+
+    assert handler.dropped == 1
+    queued = log_queue.get_nowait()
+    assert (queued.msg, queued.args, queued.exc_info) == ("hello world", None, None)
+    assert "ValueError: boom" in json.loads(JsonFormatter().format(queued))["exc"]
+
+
+def test_sampling_only_thins_out_debug_records():
+    never = SamplingFilter(0.0)
+    assert never.filter(make_record(level=logging.INFO))
+    assert not never.filter(make_record(level=logging.DEBUG))
+    assert SamplingFilter(1.0).filter(make_record(level=logging.DEBUG))
+
+
+def test_per_logger_levels_are_parsed():
+    spec = "tssvpn.auth=debug, sqlalchemy.engine=INFO,,broken"
+    assert list(_parse_levels(spec)) == [("tssvpn.auth", "DEBUG"), ("sqlalchemy.engine", "INFO")]
@@ -0,0 +1,100 @@
+import asyncio
+import base64
+import json
+import time
+
+import httpx
+
+from services.marzban import MarzbanAPI, MarzbanUserLinks, _token_expiry
+
+
+def jwt(exp):
+    def part(data):
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).rstrip(b"=").decode()
+    return f"{part({'alg': 'HS256'})}.{part({'sub': 'admin', 'exp': exp})}.signature"
+
+
+class FakePanel:
+    """A Marzban panel behind httpx.MockTransport; counts logins and can revoke tokens."""
+
+    def __init__(self, login_delay=0.0):
+        self.login_delay = login_delay
+        self.logins = 0
+        self.valid_tokens = set()
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/api/admin/token":
+            self.logins += 1
+            await asyncio.sleep(self.login_delay)
+            token = jwt(int(time.time()) + 3600) + str(self.logins)
+            self.valid_tokens.add(token)
+            return httpx.Response(200, json={"access_token": token})
+        if request.headers.get("Authorization", "").removeprefix("Bearer ") not in self.valid_tokens:
+            return httpx.Response(401, json={"detail": "Could not validate credentials"})
+        if request.url.path == "/api/user":
+            body = json.loads(request.content)
+            link = f"vless://uuid@host:443#{body['username']}"
+            return httpx.Response(200, json={"subscription_url": "https://panel/sub/x", "links": [link]})
+        return httpx.Response(404)
+
+    def api(self) -> MarzbanAPI:
+        api = MarzbanAPI()
+        api.base_url = "http://panel"
+        api._client = httpx.AsyncClient(base_url=api.base_url, transport=httpx.MockTransport(self.handler))
+        return api
+
+
+def test_token_expiry_is_read_from_the_jwt():
+    assert _token_expiry(jwt(1700000000)) == 1700000000.0
+    assert _token_expiry("opaque-token") is None
+    assert _token_expiry(jwt(None)) is None
+
+
+def test_user_links_from_response():
+    links = MarzbanUserLinks.from_response({"subscription_url": None, "links": None})
+    assert links == MarzbanUserLinks(subscription_url="", links=[])
+
+
+def test_concurrent_callers_share_one_login():
+    panel = FakePanel(login_delay=0.01)
+    api = panel.api()
+
+    async def scenario():
+        results = await asyncio.gather(*(api.ensure_token() for _ in range(10)))
+        await api.close()
+        return results
+
+    assert asyncio.run(scenario()) == [True] * 10
+    assert panel.logins == 1
+    # Expiry comes from the token itself, not the fallback TTL
+    assert api.token_expires_at <= time.time() + 3600
+
+
+def test_token_close_to_expiry_is_renewed():
+    panel = FakePanel()
+    api = panel.api()
+    api.token, api.token_expires_at = "old", time.time() + 10
+
+    async def scenario():
+        await api.ensure_token()
+        await api.close()
+
+    asyncio.run(scenario())
+    assert panel.logins == 1
+    assert api.token != "old"
+
+
+def test_revoked_token_triggers_one_relogin_and_retry():
+    panel = FakePanel()
+    api = panel.api()
+
+    async def scenario():
+        await api.ensure_token()
+        panel.valid_tokens.clear()
+        result = await api.create_user("tg_1", expire=123)
+        await api.close()
+        return result
+
+    result = asyncio.run(scenario())
+    assert result.links == ["vless://uuid@host:443#tg_1"]
+    assert panel.logins == 2
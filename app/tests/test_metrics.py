@@ -0,0 +1,52 @@
+import asyncio
+
+from metrics import Counter, Gauge, Histogram, Registry
+
+
+def render(*metrics):
+    registry = Registry()
+    for metric in metrics:
+        registry.register(metric)
+    return asyncio.run(registry.expose()).splitlines()
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(("/a",), value)
+
+    lines = render(histogram)
+    assert lines[:2] == ["# HELP latency_seconds Latency", "# TYPE latency_seconds histogram"]
+    assert lines[2:] == [
+        'latency_seconds_bucket{route="/a",le="0.1"} 1',
+        'latency_seconds_bucket{route="/a",le="1.0"} 3',
+        'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+        'latency_seconds_sum{route="/a"} 4.25',
+        'latency_seconds_count{route="/a"} 4',
+    ]
+
+
+def test_label_values_are_escaped_and_callback_gauges_read_at_scrape():
+    counter = Counter("hits_total", "Hits", ("path",))
+    counter.inc(('say "hi"\n',))
+    state = {"size": 5}
+    gauge = Gauge("pool_size", "Pool size", callback=lambda: {(): state["size"]})
+    state["size"] = 7
+
+    lines = render(counter, gauge)
+    assert 'hits_total{path="say \\"hi\\"\\n"} 1.0' in lines
+    assert "pool_size 7" in lines
+
+
+def test_requests_are_labelled_by_route_template(client, make_user):
+    tg_id = make_user()
+    client.get(f"/users/profile/{tg_id}")
+    client.get("/no/such/path")
+
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/users/profile/{user_id}",status="200"}' in body
+    assert f"/users/profile/{tg_id}" not in body
+    assert 'route="<unmatched>",status="404"' in body
+    assert "http_request_duration_seconds_bucket{" in body
+    for gauge in ("db_pool_size", "db_pool_checked_out", "db_pool_checked_in"):
+        assert f"# TYPE {gauge} gauge" in body
@@ -0,0 +1,91 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import migrations
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/migrations.db")
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+def migrate_to(engine, version, monkeypatch):
+    monkeypatch.setattr(migrations, "MIGRATIONS", [m for m in migrations.MIGRATIONS if m.version <= version])
+    result = asyncio.run(migrations.migrate(engine))
+    monkeypatch.undo()
+    return result
+
+
+async def fetch(engine, sql, **params):
+    async with engine.connect() as conn:
+        return (await conn.execute(text(sql), params)).all()
+
+
+async def execute(engine, sql, **params):
+    async with engine.begin() as conn:
+        await conn.execute(text(sql), params)
+
+
+def test_fresh_database_reaches_latest_and_matches_the_models(engine):
+    from models import Base
+
+    assert asyncio.run(migrations.migrate(engine)) == migrations.LATEST_VERSION
+    assert asyncio.run(migrations.get_schema_version(engine)) == migrations.LATEST_VERSION
+    # Running again applies nothing
+    assert asyncio.run(migrations.migrate(engine)) == migrations.LATEST_VERSION
+    versions = asyncio.run(fetch(engine, "SELECT version FROM schema_version ORDER BY version"))
+    assert [v for (v,) in versions] == [m.version for m in migrations.MIGRATIONS]
+
+    async def columns():
+        async with engine.connect() as conn:
+            return await conn.run_sync(
+                lambda sync_conn: {t: {c["name"] for c in inspect(sync_conn).get_columns(t)}
+                                   for t in inspect(sync_conn).get_table_names()}
+            )
+
+    tables = asyncio.run(columns())
+    for table in Base.metadata.sorted_tables:
+        assert {c.name for c in table.columns} <= tables[table.name], table.name
+
+
+def test_ensure_schema_refuses_outdated_schema_without_auto_migrate(engine, monkeypatch):
+    monkeypatch.setattr(migrations, "AUTO_MIGRATE", False)
+    with pytest.raises(migrations.SchemaOutdated):
+        asyncio.run(migrations.ensure_schema(engine))
+
+
+def test_upgrade_requeues_active_subscriptions_for_share_links(engine, monkeypatch):
+    assert migrate_to(engine, 7, monkeypatch) == 7
+    now = datetime.utcnow()
+    asyncio.run(execute(engine, "INSERT INTO users (tg_id, created_at) VALUES (1, :now)", now=now))
+    for expiry in (now + timedelta(days=3), now - timedelta(days=3)):
+        asyncio.run(execute(
+            engine,
+            "INSERT INTO subscriptions (user_id, tariff_name, expiry_date, config_link) VALUES (1, 'p', :e, 'https://x')",
+            e=expiry,
+        ))
+
+    asyncio.run(migrations.migrate(engine))
+    jobs = asyncio.run(fetch(engine, "SELECT subscription_id, status FROM provisioning_jobs"))
+    assert jobs == [(1, "pending")]
+
+
+def test_upgrade_backfills_missing_user_creation_dates(engine, monkeypatch):
+    migrate_to(engine, 8, monkeypatch)
+    asyncio.run(execute(
+        engine,
+        "INSERT INTO users (tg_id, created_at) VALUES (1, :d), (2, NULL), (3, :e)",
+        d=datetime(2022, 5, 1), e=datetime(2023, 1, 1),
+    ))
+
+    asyncio.run(migrations.migrate(engine))
+    rows = asyncio.run(fetch(engine, "SELECT tg_id, created_at FROM users ORDER BY tg_id"))
+    assert [created is not None for _, created in rows] == [True, True, True]
+    # Legacy rows get the oldest known date, so they still sort last
+    assert rows[1][1] == rows[0][1]
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+
+import pytest
+from passlib.context import CryptContext
+
+from services.passwords import PasswordHasher, PasswordHasherBusy
+
+
+def test_hash_and_verify_off_the_event_loop():
+    hasher = PasswordHasher(workers=1, queue_limit=4)
+
+    async def scenario():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(ticker())
+        hashed = await hasher.hash("s3cret")
+        good = await hasher.verify_and_update("s3cret", hashed)
+        bad = await hasher.verify_and_update("wrong", hashed)
+        task.cancel()
+        return good, bad, ticks
+
+    try:
+        good, bad, ticks = asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+    assert good == (True, None)
+    assert bad == (False, None)
+    # The loop kept running while bcrypt did
+    assert ticks > 0
+    assert hasher.pending == 0
+
+
+def test_outdated_cost_is_rehashed():
+    old_hash = CryptContext(schemes=["bcrypt"], bcrypt__rounds=5).hash("s3cret")
+    hasher = PasswordHasher(workers=1, queue_limit=0)
+    try:
+        valid, new_hash = asyncio.run(hasher.verify_and_update("s3cret", old_hash))
+    finally:
+        hasher.shutdown()
+    assert valid
+    assert new_hash is not None and new_hash != old_hash
+
+
+def test_missing_hash_is_rejected_without_bcrypt():
+    hasher = PasswordHasher(workers=1, queue_limit=0)
+    try:
+        assert asyncio.run(hasher.verify_and_update("s3cret", None)) == (False, None)
+    finally:
+        hasher.shutdown()
+
+
+def test_full_queue_sheds_load():
+    hasher = PasswordHasher(workers=1, queue_limit=1)
+    release = threading.Event()
+
+    async def scenario():
+        running = [asyncio.create_task(hasher._run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher._run(release.wait)
+        release.set()
+        await asyncio.gather(*running)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        hasher.shutdown()
+    assert hasher.pending == 0
+
+
+def test_busy_login_answers_503(client, monkeypatch):
+    import main
+
+    class Busy:
+        async def verify_and_update(self, password, hashed_password):
+            raise PasswordHasherBusy()
+
+    client.post("/auth/register", json={"username": "busy_login", "email": "busy@example.com", "password": "pw123456"})
+    monkeypatch.setattr(main, "password_hasher", Busy())
+    response = client.post("/auth/login", json={"username": "busy_login", "password": "pw123456"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,47 @@
+from conftest import BOT_SECRET_HEADERS
+
+
+def plan(**fields):
+    # Sorted after the seeded plans, which other tests buy
+    return {"name": "Test plan", "duration_days": 7, "price": 1.5, "sort_order": 1000, **fields}
+
+
+def buy(client, tg_id, plan_id):
+    return client.post("/shop/buy", params={"tg_id": tg_id, "plan_id": plan_id}, headers=BOT_SECRET_HEADERS)
+
+
+def test_listing_is_revalidated_with_its_etag(client):
+    response = client.get("/shop/plans")
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"].startswith("public, max-age=")
+    assert set(response.json()[0]) == {"id", "name", "duration_days", "price", "description"}
+
+    cached = client.get("/shop/plans", headers={"If-None-Match": response.headers["ETag"]})
+    assert cached.status_code == 304
+    assert cached.content == b""
+
+
+def test_admin_changes_reach_the_listing_and_purchases_at_once(client, make_user, auth, new_id):
+    admin = auth(make_user(is_admin=True))
+    etag = client.get("/shop/plans").headers["ETag"]
+
+    assert client.put("/admin/plans/test-week", json=plan(), headers=admin).status_code == 200
+    assert client.put("/admin/plans/test-hidden", json=plan(is_public=False), headers=admin).status_code == 200
+    response = client.get("/shop/plans", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    listed = [p["id"] for p in response.json()]
+    assert "test-week" in listed and "test-hidden" not in listed
+    # Unlisted plans can still be bought by id
+    assert buy(client, new_id(), "test-hidden").status_code == 200
+
+    assert client.put("/admin/plans/test-week", json=plan(is_active=False), headers=admin).status_code == 200
+    assert "test-week" not in [p["id"] for p in client.get("/shop/plans").json()]
+    assert buy(client, new_id(), "test-week").status_code == 400
+    admin_view = {p["id"]: p for p in client.get("/admin/plans", headers=admin).json()}
+    assert admin_view["test-week"]["is_active"] is False
+
+
+def test_unknown_plan_is_rejected(client, new_id):
+    response = buy(client, new_id(), "no-such-plan")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Plan not found"
@@ -0,0 +1,86 @@
+import asyncio
+
+from services.principals import Principal, PrincipalCache
+
+
+class FakeSession:
+    """Stands in for an AsyncSession; PrincipalCache only reaches it through _load."""
+
+
+def make_principal(tg_id, username=None, is_admin=False):
+    return Principal(tg_id, username, is_admin, False, 0.0, None, None, None, None)
+
+
+def cache_with_loader(rows, delay=0.0, **kwargs):
+    cache = PrincipalCache(**kwargs)
+    loads = []
+
+    async def load(db, key):
+        loads.append(key)
+        await asyncio.sleep(delay)
+        return rows.get(key)
+
+    cache._load = load
+    return cache, loads
+
+
+def test_concurrent_misses_share_one_load():
+    cache, loads = cache_with_loader({7: make_principal(7, "alice")}, delay=0.01, ttl=60)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get(FakeSession(), 7) for _ in range(5)))
+
+    results = asyncio.run(scenario())
+    assert loads == [7]
+    assert {r.username for r in results} == {"alice"}
+
+
+def test_snapshot_is_found_by_tg_id_and_username_and_invalidated_by_either():
+    cache, loads = cache_with_loader({"alice": make_principal(7, "alice")}, ttl=60)
+
+    async def scenario():
+        await cache.get(FakeSession(), "alice")
+        by_id = await cache.get(FakeSession(), 7)
+        cache.invalidate(tg_id=7)
+        return by_id, cache._lookup("alice")
+
+    by_id, after = asyncio.run(scenario())
+    assert by_id.username == "alice"
+    assert loads == ["alice"]
+    assert after == (False, None)
+
+
+def test_load_racing_an_invalidation_is_not_stored():
+    cache = PrincipalCache(ttl=60)
+
+    async def load(db, key):
+        # A write commits and invalidates while this read is in flight
+        cache.invalidate(tg_id=key)
+        return make_principal(key, is_admin=False)
+
+    cache._load = load
+    result = asyncio.run(cache.get(FakeSession(), 7))
+    assert result.tg_id == 7
+    assert cache._lookup(7) == (False, None)
+
+
+def test_entries_expire_after_ttl():
+    cache, loads = cache_with_loader({7: make_principal(7)}, ttl=0)
+
+    async def scenario():
+        await cache.get(FakeSession(), 7)
+        await cache.get(FakeSession(), 7)
+
+    asyncio.run(scenario())
+    assert loads == [7, 7]
+
+
+def test_admin_rights_revoked_by_update_take_effect_at_once(client, make_user, auth):
+    admin = auth(make_user(is_admin=True))
+    target = make_user(is_admin=True)
+    target_headers = auth(target)
+    assert client.get("/admin/stats", headers=target_headers).status_code == 200
+
+    response = client.patch(f"/admin/users/{target}", json={"is_admin": False}, headers=admin)
+    assert response.status_code == 200
+    assert client.get("/admin/stats", headers=target_headers).status_code == 403
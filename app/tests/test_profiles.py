@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+
+
+def test_me_and_profile_agree_on_active_subscriptions(client, make_user, auth, add):
+    from models import Subscription
+
+    tg_id = make_user(balance=12.5)
+    latest = datetime.now() + timedelta(days=30)
+    add(
+        Subscription(user_id=tg_id, tariff_name="a", expiry_date=datetime.now() + timedelta(days=3)),
+        Subscription(user_id=tg_id, tariff_name="b", expiry_date=latest),
+        Subscription(user_id=tg_id, tariff_name="c", expiry_date=datetime.now() - timedelta(days=3)),
+    )
+
+    me = client.get("/users/me", headers=auth(tg_id)).json()
+    assert (me["id"], me["balance"], me["status"], me["keys_count"]) == (tg_id, 12.5, "Active", 2)
+
+    profile = client.get(f"/users/profile/{tg_id}").json()
+    assert profile["status"] == "Active"
+    assert profile["keys_count"] == 2
+    assert profile["subscription_expiry"] == latest.isoformat()
+
+
+def test_user_without_active_keys(client, make_user, auth, add):
+    from models import Subscription
+
+    tg_id = make_user()
+    add(Subscription(user_id=tg_id, tariff_name="old", expiry_date=datetime.now() - timedelta(days=1)))
+
+    me = client.get("/users/me", headers=auth(tg_id)).json()
+    assert (me["status"], me["keys_count"]) == ("Inactive", 0)
+    assert client.get(f"/users/profile/{tg_id}").json()["subscription_expiry"] == "No subscription"
+
+
+def test_web_login_profile_is_found_by_username(client):
+    client.post("/auth/register", json={"username": "profile_web", "email": "pw@example.com", "password": "pw123456"})
+    token = client.post("/auth/login", json={"username": "profile_web", "password": "pw123456"}).json()["access_token"]
+
+    me = client.get("/users/me", headers={"Authorization": f"Bearer {token}"}).json()
+    assert me["username"] == "profile_web"
+    assert me["keys_count"] == 0
+
+
+def test_unknown_user(client, new_id, auth):
+    assert client.get("/users/me", headers=auth(new_id())).status_code == 404
+    assert client.get(f"/users/profile/{new_id()}").status_code == 404
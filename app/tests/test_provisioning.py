@@ -0,0 +1,132 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from services import provisioning
+from services.marzban import MarzbanUserLinks
+from services.provisioning import ProvisioningQueue, provisioning_queue
+
+LINKS = MarzbanUserLinks(subscription_url="https://panel/sub/x", links=["vless://uuid@host:443#x"])
+# Older than anything the app enqueues, so these jobs are claimed first
+OVERDUE = datetime(2000, 1, 1)
+
+
+@pytest.fixture
+def queue(run):
+    """A private queue, with the app's own workers stopped so they cannot take the test's jobs."""
+    run(provisioning_queue.stop)
+    yield ProvisioningQueue(concurrency=0)
+
+    async def restart():
+        provisioning_queue.start()
+
+    run(restart)
+
+
+@pytest.fixture
+def make_job(add, make_user):
+    from models import ProvisioningJob, Subscription
+
+    def _make_job(**fields):
+        subscription = Subscription(user_id=make_user(), tariff_name="p",
+                                    expiry_date=datetime.now() + timedelta(days=30))
+        fields.setdefault("next_attempt_at", OVERDUE)
+        job = ProvisioningJob(subscription=subscription, status="pending", **fields)
+        add(subscription, job)
+        return job
+
+    return _make_job
+
+
+@pytest.fixture
+def fetch(run):
+    from database import AsyncSessionLocal
+    from models import ProvisioningJob, Subscription
+
+    async def _fetch(job_id):
+        async with AsyncSessionLocal() as db:
+            job = await db.get(ProvisioningJob, job_id)
+            return job, await db.get(Subscription, job.subscription_id)
+
+    return lambda job_id: run(_fetch, job_id)
+
+
+def test_only_one_of_two_workers_claims_a_job(queue, run, make_job, fetch):
+    job = make_job(attempts=0)
+
+    async def claim_twice():
+        return await asyncio.gather(queue._claim(), queue._claim())
+
+    claims = [c for c in run(claim_twice) if c is not None and c.id == job.id]
+    assert len(claims) == 1
+    assert claims[0].attempts == 1
+
+    stored, _ = fetch(job.id)
+    assert stored.attempts == 1
+    # Leased: hidden from other workers until the lease runs out
+    assert stored.next_attempt_at > datetime.utcnow()
+
+
+def test_job_of_a_dead_worker_is_claimed_again_after_its_lease(queue, run, make_job, add, fetch):
+    job = make_job(attempts=0)
+    assert run(queue._claim).id == job.id
+
+    stored, _ = fetch(job.id)
+    stored.next_attempt_at = OVERDUE
+    add(stored)
+    again = run(queue._claim)
+    assert (again.id, again.attempts) == (job.id, 2)
+
+
+def test_failures_back_off_and_give_up_after_max_attempts(queue, run, make_job, fetch, monkeypatch):
+    async def unreachable(username, expire=0, data_limit=0):
+        return None
+
+    monkeypatch.setattr(provisioning.marzban, "create_user", unreachable)
+    retried = make_job(attempts=0)
+    exhausted = make_job(attempts=provisioning.PROVISION_MAX_ATTEMPTS - 1)
+
+    for job in (retried, exhausted):
+        claimed = run(queue._claim)
+        assert claimed.id == job.id
+        run(queue._process, claimed)
+
+    job, subscription = fetch(retried.id)
+    assert (job.status, job.last_error) == ("pending", "Marzban create_user failed")
+    assert job.next_attempt_at > datetime.utcnow()
+    assert subscription.config_link is None
+    assert fetch(exhausted.id)[0].status == "failed"
+
+
+def test_renewal_during_the_call_requeues_the_job(queue, run, make_job, fetch, monkeypatch):
+    from database import AsyncSessionLocal
+    from models import Subscription
+    from sqlalchemy import update
+
+    job = make_job(attempts=0)
+    renewed = datetime.now() + timedelta(days=60)
+    pushed = []
+
+    async def create_user(username, expire=0, data_limit=0):
+        pushed.append(expire)
+        if len(pushed) == 1:
+            # The purchase path commits a renewal while Marzban is being called
+            async with AsyncSessionLocal() as db:
+                await db.execute(update(Subscription).where(Subscription.id == job.subscription_id)
+                                 .values(expiry_date=renewed))
+                await db.commit()
+        return LINKS
+
+    monkeypatch.setattr(provisioning.marzban, "create_user", create_user)
+
+    run(queue._process, run(queue._claim))
+    stored, subscription = fetch(job.id)
+    assert (stored.status, stored.attempts) == ("pending", 0)
+    assert subscription.config_link is None
+
+    run(queue._process, run(queue._claim))
+    stored, subscription = fetch(job.id)
+    assert stored.status == "done"
+    assert pushed[-1] == int(renewed.timestamp())
+    assert (subscription.config_link, subscription.proxy_links) == (LINKS.subscription_url, LINKS.links[0])
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from conftest import BOT_SECRET_HEADERS
+
+
+def buy(client, tg_id, plan_id, key=None):
+    headers = {**BOT_SECRET_HEADERS, **({"Idempotency-Key": key} if key else {})}
+    return client.post("/shop/buy", params={"tg_id": tg_id, "plan_id": plan_id}, headers=headers)
+
+
+def subscriptions_of(run, tg_id):
+    from database import AsyncSessionLocal
+    from models import Subscription, Transaction
+    from sqlalchemy import func, select
+
+    async def fetch():
+        async with AsyncSessionLocal() as db:
+            subscriptions = (await db.execute(select(Subscription).where(Subscription.user_id == tg_id))).scalars().all()
+            transactions = await db.scalar(select(func.count(Transaction.id)).where(Transaction.user_id == tg_id))
+            return subscriptions, transactions
+
+    return run(fetch)
+
+
+def plan_ids(client):
+    return [plan["id"] for plan in client.get("/shop/plans").json()]
+
+
+def test_retry_with_the_same_key_replays_the_first_response(client, run, new_id):
+    tg_id, plan_id = new_id(), plan_ids(client)[0]
+    first = buy(client, tg_id, plan_id, key="order-1")
+    assert first.status_code == 200
+    assert "Idempotent-Replayed" not in first.headers
+
+    retry = buy(client, tg_id, plan_id, key="order-1")
+    assert retry.status_code == 200
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert retry.json() == first.json()
+
+    subscriptions, transactions = subscriptions_of(run, tg_id)
+    assert (len(subscriptions), transactions) == (1, 1)
+
+
+def test_key_reused_for_another_plan_is_rejected(client, new_id):
+    tg_id = new_id()
+    first, second = plan_ids(client)[:2]
+    assert buy(client, tg_id, first, key="order-1").status_code == 200
+    response = buy(client, tg_id, second, key="order-1")
+    assert response.status_code == 422
+    assert "different request" in response.json()["detail"]
+
+
+def test_concurrent_twins_buy_once(client, run, new_id):
+    from database import AsyncSessionLocal
+    from services.purchases import purchase_plan
+
+    tg_id, plan_id = new_id(), plan_ids(client)[0]
+
+    async def twins():
+        async def attempt():
+            async with AsyncSessionLocal() as db:
+                return await purchase_plan(db, tg_id, plan_id, "order-1")
+        return await asyncio.gather(attempt(), attempt())
+
+    results = run(twins)
+    assert sorted(r.replayed for r in results) == [False, True]
+    assert results[0].response == results[1].response
+    subscriptions, transactions = subscriptions_of(run, tg_id)
+    assert (len(subscriptions), transactions) == (1, 1)
+
+
+def test_second_purchase_renews_the_active_subscription(client, run, new_id):
+    tg_id, plan_id = new_id(), plan_ids(client)[0]
+    first = buy(client, tg_id, plan_id).json()
+    second = buy(client, tg_id, plan_id).json()
+
+    assert second["subscription_id"] == first["subscription_id"]
+    assert datetime.fromisoformat(second["expires_at"]) > datetime.fromisoformat(first["expires_at"])
+    subscriptions, transactions = subscriptions_of(run, tg_id)
+    assert (len(subscriptions), transactions) == (1, 2)
+
+
+def test_bot_purchase_needs_the_secret(client, new_id):
+    plan_id = plan_ids(client)[0]
+    response = client.post("/shop/buy", params={"tg_id": new_id(), "plan_id": plan_id})
+    assert response.status_code == 401
+    wrong = client.post("/shop/buy", params={"tg_id": new_id(), "plan_id": plan_id}, headers={"X-Bot-Secret": "nope"})
+    assert wrong.status_code == 401
+
+
+def test_expired_idempotency_keys_are_purged(run, make_user, add):
+    from database import AsyncSessionLocal
+    from models import IdempotencyKey
+    from services.purchases import IDEMPOTENCY_KEY_TTL_HOURS, purge_idempotency_keys
+
+    tg_id = make_user()
+    old = datetime.utcnow() - timedelta(hours=IDEMPOTENCY_KEY_TTL_HOURS + 1)
+    add(IdempotencyKey(user_id=tg_id, key="old", request_fingerprint="buy:x", created_at=old),
+        IdempotencyKey(user_id=tg_id, key="fresh", request_fingerprint="buy:x"))
+
+    async def purge():
+        async with AsyncSessionLocal() as db:
+            purged = await purge_idempotency_keys(db)
+            return purged, await db.get(IdempotencyKey, (tg_id, "fresh")), await db.get(IdempotencyKey, (tg_id, "old"))
+
+    purged, fresh, old = run(purge)
+    assert purged >= 1
+    assert (fresh is not None, old) == (True, None)
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import telegram_login_body
+from services.refresh_tokens import RefreshTokenInvalid, _hash, rotate_refresh_token
+
+
+def register(client, name):
+    response = client.post("/auth/register", json={"username": name, "password": "pw123456"})
+    assert response.status_code == 200
+    return response.json()
+
+
+def refresh(client, token):
+    return client.post("/auth/refresh", json={"refresh_token": token})
+
+
+def test_refresh_rotates_the_token(client):
+    tokens = register(client, "refresh_rotate")
+    response = refresh(client, tokens["refresh_token"])
+    assert response.status_code == 200
+    rotated = response.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+
+    me = client.get("/users/me", headers={"Authorization": f"Bearer {rotated['access_token']}"})
+    assert me.json()["username"] == "refresh_rotate"
+    assert refresh(client, rotated["refresh_token"]).status_code == 200
+
+
+def test_reused_token_revokes_its_family_only(client):
+    first_login = register(client, "refresh_reuse")
+    other_login = client.post("/auth/login", json={"username": "refresh_reuse", "password": "pw123456"}).json()
+    successor = refresh(client, first_login["refresh_token"]).json()["refresh_token"]
+
+    # The old token comes back: someone holds a copy
+    assert refresh(client, first_login["refresh_token"]).status_code == 401
+    assert refresh(client, successor).status_code == 401
+    # Another login (another family) is untouched
+    assert refresh(client, other_login["refresh_token"]).status_code == 200
+
+
+def test_telegram_login_gets_a_refresh_token(client, new_id):
+    tg_id = new_id()
+    body = telegram_login_body(tg_id, username=f"tg{tg_id}")
+    login = client.post("/auth/telegram/callback", content=body,
+                        headers={"Content-Type": "application/x-www-form-urlencoded"}).json()
+    access = refresh(client, login["refresh_token"]).json()["access_token"]
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {access}"}).json()["id"] == tg_id
+
+
+def test_expired_and_unknown_tokens_are_refused(client, run):
+    from database import AsyncSessionLocal
+    from models import RefreshToken
+    from sqlalchemy import update
+
+    token = register(client, "refresh_expired")["refresh_token"]
+
+    async def expire():
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(RefreshToken).where(RefreshToken.token_hash == _hash(token))
+                             .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+            await db.commit()
+
+    run(expire)
+    assert refresh(client, token).status_code == 401
+    assert refresh(client, "not-a-token").status_code == 401
+
+
+def test_banned_user_cannot_refresh(client, make_user, auth):
+    tokens = register(client, "refresh_banned")
+    me = client.get("/users/me", headers={"Authorization": f"Bearer {tokens['access_token']}"}).json()
+    admin = auth(make_user(is_admin=True))
+    assert client.patch(f"/admin/users/{me['id']}", json={"is_banned": True}, headers=admin).status_code == 200
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+
+
+def test_concurrent_exchanges_of_one_token_issue_one_successor(client, run):
+    from database import AsyncSessionLocal
+
+    token = register(client, "refresh_race")["refresh_token"]
+
+    async def exchange():
+        async with AsyncSessionLocal() as db:
+            try:
+                return await rotate_refresh_token(db, token)
+            except RefreshTokenInvalid as e:
+                return str(e)
+
+    async def race():
+        return await asyncio.gather(exchange(), exchange())
+
+    results = run(race)
+    granted = [r for r in results if not isinstance(r, str)]
+    assert len(granted) == 1
+    assert [r for r in results if isinstance(r, str)] == ["reused"]
+
+    async def use_successor():
+        async with AsyncSessionLocal() as db:
+            await rotate_refresh_token(db, granted[0].refresh_token)
+
+    # The loser revoked the family, the winner's successor included
+    with pytest.raises(RefreshTokenInvalid):
+        run(use_successor)
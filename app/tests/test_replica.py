@@ -0,0 +1,72 @@
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+import migrations
+from conftest import BOT_SECRET_HEADERS
+from database import ReplicaMonitor, get_read_db
+
+
+@pytest.fixture
+def lagging_replica(run, tmp_path, monkeypatch):
+    """Route reads to a replica that has the schema but none of the primary's rows."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/replica.db")
+    run(migrations.migrate, engine)
+    monkeypatch.setattr(database, "ReadSessionLocal",
+                        sessionmaker(engine, expire_on_commit=False, class_=AsyncSession))
+    monkeypatch.setattr(database.replica_monitor, "usable", True)
+    yield engine
+    run(engine.dispose)
+
+
+def read_session_bind(run):
+    async def bind():
+        sessions = get_read_db()
+        session = await sessions.__anext__()
+        await sessions.aclose()
+        return session.bind
+
+    return run(bind)
+
+
+def test_reads_use_the_replica_only_while_it_is_usable(run, lagging_replica, monkeypatch):
+    assert read_session_bind(run) is lagging_replica
+    monkeypatch.setattr(database.replica_monitor, "usable", False)
+    assert read_session_bind(run) is database.engine
+
+
+def test_monitor_falls_back_when_the_replica_is_unreachable(run, tmp_path):
+    reachable = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/replica.db")
+    unreachable = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/missing/replica.db")
+
+    async def check(engine):
+        monitor = ReplicaMonitor(engine)
+        await monitor.check()
+        await engine.dispose()
+        return monitor.usable, monitor.lag
+
+    assert run(check, reachable) == (True, 0.0)
+    assert run(check, unreachable) == (False, None)
+
+
+def test_lagging_replica_does_not_poison_the_principal_cache(client, new_id, auth, lagging_replica):
+    from services.principals import principal_cache
+
+    plan_id = client.get("/shop/plans").json()[0]["id"]
+    tg_id = new_id()
+    # First seen by the bot: the user row exists on the primary only
+    assert client.post("/shop/buy", params={"tg_id": tg_id, "plan_id": plan_id},
+                       headers=BOT_SECRET_HEADERS).status_code == 200
+    principal_cache.invalidate(tg_id=tg_id)
+
+    headers = auth(tg_id)
+    keys = client.get("/users/keys", headers=headers)
+    assert keys.status_code == 200
+    # The listing itself is read from the replica, which has not caught up
+    assert keys.json() == []
+    assert client.get("/users/subscription", headers=headers).status_code == 200
+
+    # Nothing negative was cached: site purchases keep working
+    response = client.post("/shop/buy", json={"plan_id": plan_id}, headers=headers)
+    assert response.status_code == 200
@@ -0,0 +1,50 @@
+from conftest import BOT_SECRET_HEADERS
+
+
+def test_bot_secret_reads_config_with_conditional_get(client):
+    response = client.get("/admin/config", headers=BOT_SECRET_HEADERS)
+    assert response.status_code == 200
+    assert "bot_welcome_message" in response.json()
+    etag = response.headers["ETag"]
+
+    cached = client.get("/admin/config", headers={**BOT_SECRET_HEADERS, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag
+
+
+def test_config_read_requires_bot_secret_or_admin(client, make_user, auth):
+    assert client.get("/admin/config").status_code == 401
+    assert client.get("/admin/config", headers={"X-Bot-Secret": "wrong"}).status_code == 401
+    assert client.get("/admin/config", headers=auth(make_user())).status_code == 403
+    assert client.get("/admin/config", headers=auth(make_user(is_admin=True))).status_code == 200
+
+
+def test_update_changes_etag(client, make_user, auth):
+    admin = auth(make_user(is_admin=True))
+    before = client.get("/admin/config", headers=BOT_SECRET_HEADERS).headers["ETag"]
+
+    response = client.post("/admin/config", json={"site_announcement": f"notice {before}"}, headers=admin)
+    assert response.status_code == 200
+
+    after = client.get("/admin/config", headers={**BOT_SECRET_HEADERS, "If-None-Match": before})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before
+    assert after.json()["site_announcement"] == f"notice {before}"
+
+
+def test_load_racing_an_invalidation_is_not_stored(run):
+    from database import AsyncSessionLocal
+    from services.site_config import SiteConfigCache
+
+    cache = SiteConfigCache()
+
+    async def scenario():
+        async with AsyncSessionLocal() as db:
+            first = await cache.get(db)
+            cache.invalidate()
+            second = await cache.get(db)
+        return first, second
+
+    first, second = run(scenario)
+    assert second.version == first.version + 1
+    assert second.etag == first.etag
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import BOT_SECRET_HEADERS
+from services import stats as stats_module
+from services.stats import StatsRollup
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Freeze services.stats' notion of now; move it by assigning clock.now."""
+
+    class Clock(datetime):
+        now_value = datetime(2030, 1, 1, 12, 0)
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.now_value
+
+    monkeypatch.setattr(stats_module, "datetime", Clock)
+    return Clock
+
+
+def test_active_subscriptions_drop_out_as_they_expire(clock):
+    rollup = StatsRollup()
+    now = clock.now_value
+    rollup.record_subscription(now + timedelta(minutes=5))
+    rollup.record_subscription(now + timedelta(days=1))
+    # Already expired: not counted
+    rollup.record_subscription(now - timedelta(minutes=1))
+    assert rollup.active_subscriptions == 2
+
+    clock.now_value = now + timedelta(minutes=10)
+    assert rollup.active_subscriptions == 1
+
+
+def test_renewal_moves_the_subscription_to_its_new_bucket(clock):
+    rollup = StatsRollup()
+    now = clock.now_value
+    rollup.record_subscription(now + timedelta(minutes=5))
+    rollup.record_subscription(now + timedelta(days=30), previous_expiry=now + timedelta(minutes=5))
+    assert rollup.active_subscriptions == 1
+
+    clock.now_value = now + timedelta(minutes=10)
+    assert rollup.active_subscriptions == 1
+
+
+def test_purchase_updates_counters_and_matches_reconciliation(client, run, new_id, make_user, auth):
+    from database import AsyncSessionLocal
+    from services.stats import stats_rollup
+
+    async def reconcile():
+        async with AsyncSessionLocal() as db:
+            await stats_rollup.reconcile(db)
+        return stats_rollup.total_users, stats_rollup.active_subscriptions, stats_rollup.total_revenue
+
+    admin = auth(make_user(is_admin=True))
+    users, active, revenue = run(reconcile)
+    plan = client.get("/shop/plans").json()[0]
+
+    response = client.post("/shop/buy", params={"tg_id": new_id(), "plan_id": plan["id"]}, headers=BOT_SECRET_HEADERS)
+    assert response.status_code == 200
+
+    stats = client.get("/admin/stats", headers=admin).json()
+    assert stats == {
+        "total_users": users + 1,
+        "active_subscriptions": active + 1,
+        "total_revenue": pytest.approx(revenue + plan["price"]),
+    }
+    # The incremental counters agree with a full recount
+    assert run(reconcile) == (stats["total_users"], stats["active_subscriptions"], pytest.approx(stats["total_revenue"]))
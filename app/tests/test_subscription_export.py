@@ -0,0 +1,89 @@
+import base64
+import json
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+from services.subscription_export import (
+    SUBSCRIPTION_BASE_URL, parse_subscription_token, parse_vless, render_base64, render_clash, render_singbox,
+    subscription_token,
+)
+
+REALITY = ("vless://0a1b-uuid@edge.example.com:8443?security=reality&sni=google.com&fp=chrome"
+           "&pbk=public-key&sid=ab12&type=grpc&serviceName=grpc#Edge%201")
+WS = "vless://ws-uuid@ws.example.com?security=tls&type=ws&path=%2Fray&host=cdn.example.com"
+
+
+def test_tokens_are_signed():
+    token = subscription_token(42)
+    assert parse_subscription_token(token) == 42
+    assert parse_subscription_token(token.replace("42.", "43.", 1)) is None
+    assert parse_subscription_token("42") is None
+    assert parse_subscription_token("abc.def") is None
+
+
+def test_parse_vless():
+    proxy = parse_vless(REALITY, "fallback")
+    assert (proxy.name, proxy.uuid, proxy.server, proxy.port) == ("Edge 1", "0a1b-uuid", "edge.example.com", 8443)
+    assert proxy.params["pbk"] == "public-key"
+    assert parse_vless(WS, "fallback")[0::3] == ("fallback", 443)
+    assert parse_vless("https://panel/sub/x", "fallback") is None
+
+
+def test_renderers_describe_the_same_proxies():
+    links = [REALITY, WS]
+    proxies = [parse_vless(link, "fallback") for link in links]
+
+    assert base64.b64decode(render_base64(links, proxies)).decode().splitlines() == links
+
+    clash = render_clash(links, proxies).decode()
+    assert '  - name: "Edge 1"' in clash
+    assert '      public-key: "public-key"' in clash
+    assert '      grpc-service-name: "grpc"' in clash
+    assert '      headers: {Host: "cdn.example.com"}' in clash
+    assert '    proxies: ["Edge 1", "fallback"]' in clash
+
+    outbounds = json.loads(render_singbox(links, proxies))["outbounds"]
+    assert [o["type"] for o in outbounds] == ["selector", "vless", "vless", "direct"]
+    assert outbounds[1]["tls"]["reality"] == {"enabled": True, "public_key": "public-key", "short_id": "ab12"}
+    assert outbounds[2]["transport"] == {"type": "ws", "path": "/ray", "headers": {"Host": "cdn.example.com"}}
+
+
+def test_empty_feed_still_renders():
+    assert "proxies: []" in render_clash([], []).decode()
+    assert json.loads(render_singbox([], []))["outbounds"][0]["outbounds"] == ["direct"]
+
+
+def feed_path(url):
+    # Handed out under the public prefix; the app itself serves /sub/...
+    parts = urlsplit(url.removeprefix(SUBSCRIPTION_BASE_URL))
+    return parts.path, dict(p.split("=") for p in parts.query.split("&"))
+
+
+def test_feed_is_revalidated_and_dropped_on_ban(client, make_user, add, auth):
+    from models import Subscription
+
+    tg_id = make_user()
+    add(Subscription(user_id=tg_id, tariff_name="month", expiry_date=datetime.now() + timedelta(days=30),
+                     proxy_links=REALITY + "\nnot-a-link"))
+    urls = client.get("/users/subscription", headers=auth(tg_id)).json()
+    assert set(urls) == {"base64", "clash", "singbox"}
+
+    path, params = feed_path(urls["singbox"])
+    response = client.get(path, params=params)
+    assert response.status_code == 200
+    assert [o["tag"] for o in response.json()["outbounds"]] == ["TssVPN", "Edge 1", "direct"]
+    etag = response.headers["ETag"]
+
+    assert client.get(path, params=params, headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(path, params=params, headers={"If-Modified-Since": response.headers["Last-Modified"]}).status_code == 304
+
+    admin = auth(make_user(is_admin=True))
+    assert client.patch(f"/admin/users/{tg_id}", json={"is_banned": True}, headers=admin).status_code == 200
+    banned = client.get(path, params=params, headers={"If-None-Match": etag})
+    assert banned.status_code == 200
+    assert [o["tag"] for o in banned.json()["outbounds"]] == ["TssVPN", "direct"]
+
+
+def test_forged_feed_token_is_not_found(client):
+    assert client.get("/sub/42.forged").status_code == 404
+    assert client.get(f"/sub/{subscription_token(42)}", params={"format": "xml"}).status_code == 422
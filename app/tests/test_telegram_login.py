@@ -0,0 +1,50 @@
+from conftest import telegram_login_body
+from services.telegram_login import upsert_telegram_user
+
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+
+
+def test_upsert_writes_only_when_the_profile_changes(run, new_id):
+    from database import AsyncSessionLocal
+
+    tg_id = new_id()
+    profile = {"username": f"tg{tg_id}", "first_name": "Ann", "last_name": "", "avatar_url": ""}
+
+    async def login(changes=None):
+        async with AsyncSessionLocal() as db:
+            result = await upsert_telegram_user(db, tg_id, {**profile, **(changes or {})})
+            await db.commit()
+            return result
+
+    first = run(login)
+    assert (first.created, first.written) == (True, True)
+    assert first.user.username == f"tg{tg_id}"
+
+    repeat = run(login)
+    assert (repeat.created, repeat.written) == (False, False)
+    assert repeat.user.created_at == first.user.created_at
+
+    renamed = run(login, {"first_name": "Anna"})
+    assert (renamed.created, renamed.written) == (False, True)
+    assert renamed.user.first_name == "Anna"
+    assert renamed.user.created_at == first.user.created_at
+
+
+def test_callback_returns_the_stored_profile(client, new_id):
+    tg_id = new_id()
+    body = telegram_login_body(tg_id, username=f"tg{tg_id}", photo_url="")
+    user = client.post("/auth/telegram/callback", content=body, headers=FORM).json()["user"]
+    assert (user["id"], user["username"], user["first_name"], user["avatar_url"]) == (tg_id, f"tg{tg_id}", "Test", "")
+    assert user["created_at"] is not None
+
+
+def test_profile_change_on_login_is_visible_at_once(client, new_id):
+    tg_id = new_id()
+    first = client.post("/auth/telegram/callback", content=telegram_login_body(tg_id, username=f"tg{tg_id}"),
+                        headers=FORM).json()
+    headers = {"Authorization": f"Bearer {first['access_token']}"}
+    assert client.get("/users/me", headers=headers).json()["username"] == f"tg{tg_id}"
+
+    body = telegram_login_body(tg_id, username=f"renamed{tg_id}")
+    assert client.post("/auth/telegram/callback", content=body, headers=FORM).status_code == 200
+    assert client.get("/users/me", headers=headers).json()["username"] == f"renamed{tg_id}"
@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+
+from services.token_cache import TokenCache
+
+
+def test_entry_expires_with_its_token(monkeypatch):
+    cache = TokenCache(capacity=10)
+    now = time.time()
+    cache.put("token", "42", now + 60)
+    assert cache.get("token") == "42"
+
+    monkeypatch.setattr(time, "time", lambda: now + 61)
+    assert cache.get("token") is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = TokenCache(capacity=2)
+    exp = time.time() + 60
+    cache.put("a", "1", exp)
+    cache.put("b", "2", exp)
+    cache.get("a")
+    cache.put("c", "3", exp)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ("1", None, "3")
+
+
+def test_tokens_without_expiry_are_not_cached():
+    cache = TokenCache(capacity=10)
+    cache.put("token", "42", None)
+    assert cache.get("token") is None
+
+
+def test_raw_token_is_not_kept():
+    cache = TokenCache(capacity=10)
+    cache.put("secret-token", "42", time.time() + 60)
+    assert all(b"secret-token" not in key for key in cache._entries)
+
+
+def test_cached_token_still_authenticates_and_forged_one_does_not(client, make_user, auth):
+    from services.token_cache import token_cache
+    headers = auth(make_user())
+
+    assert client.get("/users/me", headers=headers).status_code == 200
+    token = headers["Authorization"].split()[1]
+    assert token_cache.get(token) is not None
+    assert client.get("/users/me", headers=headers).status_code == 200
+
+    forged = token[:-2] + ("aa" if not token.endswith("aa") else "bb")
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {forged}"}).status_code == 401
+
+
+def test_expired_token_is_rejected(client, make_user):
+    import main
+    token = main.create_access_token({"sub": str(make_user())}, timedelta(seconds=-1))
+    assert client.get("/users/me", headers={"Authorization": f"Bearer {token}"}).status_code == 401
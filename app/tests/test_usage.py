@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+from services import usage as usage_module
+from services.provisioning import marzban_username
+from services.usage import UsageSync, _to_row
+
+
+class FakeMarzban:
+    def __init__(self, users):
+        self.users = users
+        self.pages = []
+
+    async def list_users(self, offset, limit):
+        self.pages.append((offset, limit))
+        return self.users[offset:offset + limit], len(self.users)
+
+
+def test_rows_are_parsed_from_marzban_users():
+    row = _to_row({"username": "tss7_42", "status": "active", "used_traffic": None,
+                   "expire": 1700000000, "online_at": "2025-01-01T10:00:00"})
+    assert row["subscription_id"] == 42
+    assert row["used_traffic"] == 0
+    assert row["expire_at"] == datetime.fromtimestamp(1700000000)
+    assert row["online_at"] == datetime(2025, 1, 1, 10)
+    assert _to_row({"username": "someone-else", "online_at": "garbage"})["subscription_id"] is None
+
+
+def test_sync_reads_pages_and_writes_only_changes(run, client, make_user, add, auth, monkeypatch):
+    from models import Subscription
+
+    tg_id = make_user()
+    subscriptions = [Subscription(user_id=tg_id, tariff_name=name, expiry_date=datetime.now() + timedelta(days=d))
+                     for name, d in (("month", 30), ("week", 7))]
+    add(*subscriptions)
+    month, week = (marzban_username(tg_id, s.id) for s in subscriptions)
+    users = [
+        {"username": month, "status": "active", "used_traffic": 1000, "data_limit": None,
+         "online_at": datetime.utcnow().isoformat()},
+        {"username": week, "status": "active", "used_traffic": 5, "data_limit": 10},
+        {"username": f"foreign-{tg_id}", "status": "disabled", "used_traffic": 0},
+    ]
+    panel = FakeMarzban(users)
+    monkeypatch.setattr(usage_module, "marzban", panel)
+    sync = UsageSync(page_size=2)
+
+    assert run(sync.sync_once) == 3
+    assert panel.pages == [(0, 2), (2, 2)]
+    assert run(sync.sync_once) == 0
+
+    users[1]["used_traffic"] = 7
+    assert run(sync.sync_once) == 1
+
+    keys = {k["name"]: k for k in client.get("/users/usage", headers=auth(tg_id)).json()}
+    assert (keys["month"]["used_traffic"], keys["month"]["online"]) == (1000, True)
+    assert (keys["week"]["used_traffic"], keys["week"]["data_limit"], keys["week"]["online"]) == (7, 10, False)
+
+
+def test_key_without_synced_usage_is_pending(client, make_user, add, auth):
+    from models import Subscription
+
+    tg_id = make_user()
+    add(Subscription(user_id=tg_id, tariff_name="new", expiry_date=datetime.now() + timedelta(days=30)))
+    [key] = client.get("/users/usage", headers=auth(f"u{tg_id}")).json()
+    assert (key["status"], key["used_traffic"], key["updated_at"]) == ("pending", 0, None)
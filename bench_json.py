@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for list endpoint serialization.
+
+Compares the previous path (a Pydantic UserProfile per row, then FastAPI's
+response_model validation and encoding) with fast_json.json_list_response
+(dicts built from row tuples, encoded once). It times both through a real
+FastAPI app over an in-process ASGI transport, including streamed bodies.
+
+    python bench_json.py                    # 10k and 100k rows
+    python bench_json.py --rows 1000 50000 --repeat 10
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+from typing import List
+
+import httpx
+from fastapi import FastAPI
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+sys.path.insert(0, APP_DIR)
+# main.py builds the engine at import; nothing is queried here
+os.environ.setdefault("DATABASE_URL", "sqlite+aiosqlite:///:memory:")
+
+from fast_json import json_list_response, orjson  # noqa: E402
+from main import UserProfile  # noqa: E402
+
+# Same columns as services.admin_users.fetch_users_page rows
+UserRow = namedtuple("UserRow", "tg_id username balance is_admin first_name last_name avatar_url created_at active_keys")
+
+
+def make_rows(count: int) -> List[UserRow]:
+    start = datetime(2024, 1, 1)
+    return [
+        UserRow(
+            tg_id=100000 + i,
+            username=f"user_{i}",
+            balance=float(i % 500),
+            is_admin=i % 1000 == 0,
+            first_name="Ivan",
+            last_name=None if i % 3 else "Petrov",
+            avatar_url=None,
+            created_at=start + timedelta(minutes=i),
+            active_keys=i % 4,
+        )
+        for i in range(count)
+    ]
+
+
+def build_app(rows: List[UserRow]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/old", response_model=List[UserProfile])
+    async def old_path():
+        profiles = []
+        for row in rows:
+            profiles.append(UserProfile(
+                id=row.tg_id or 0,
+                username=row.username or f"user_{row.tg_id}",
+                balance=row.balance,
+                status="Active" if row.active_keys else "Inactive",
+                keys_count=row.active_keys,
+                is_admin=row.is_admin,
+                first_name=row.first_name,
+                last_name=row.last_name,
+                avatar_url=row.avatar_url,
+                created_at=row.created_at.isoformat() if row.created_at else None
+            ))
+        return profiles
+
+    @app.get("/new", response_model=List[UserProfile])
+    async def new_path():
+        return json_list_response((
+            {
+                "id": row.tg_id or 0,
+                "username": row.username or f"user_{row.tg_id}",
+                "balance": row.balance or 0.0,
+                "status": "Active" if row.active_keys else "Inactive",
+                "keys_count": row.active_keys or 0,
+                "is_admin": bool(row.is_admin),
+                "first_name": row.first_name,
+                "last_name": row.last_name,
+                "avatar_url": row.avatar_url,
+                "created_at": row.created_at.isoformat() if row.created_at else None,
+            }
+            for row in rows
+        ))
+
+    return app
+
+
+async def time_path(client: httpx.AsyncClient, path: str, repeat: int):
+    timings = []
+    body = b""
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get(path)
+        body = response.content
+        timings.append(time.perf_counter() - start)
+    return timings, body
+
+
+async def run(row_counts: List[int], repeat: int):
+    print(f"encoder: {'orjson' if orjson is not None else 'json (orjson not installed)'}")
+    print(f"{'rows':>8} {'path':>5} {'median ms':>10} {'min ms':>8} {'body KB':>8}")
+    for count in row_counts:
+        app = build_app(make_rows(count))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+            results = {}
+            for path in ("old", "new"):
+                timings, body = await time_path(client, f"/{path}", repeat)
+                results[path] = (statistics.median(timings), body)
+                print(f"{count:>8} {path:>5} {statistics.median(timings) * 1000:>10.1f} "
+                      f"{min(timings) * 1000:>8.1f} {len(body) / 1024:>8.0f}")
+            # Same document either way (key order and float formatting may differ)
+            assert json.loads(results["old"][1]) == json.loads(results["new"][1])
+            print(f"{count:>8} speedup {results['old'][0] / results['new'][0]:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark list endpoint JSON serialization")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.repeat))
+
+
+if __name__ == "__main__":
+    main()
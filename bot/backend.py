@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import os
+import random
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://tss_site_backend:8000")
+# Same value as the backend's BOT_API_SECRET, sent as X-Bot-Secret; without it
+# the backend refuses /admin/config and purchases on behalf of a tg_id
+BOT_API_SECRET = os.getenv("BOT_API_SECRET", "")
+
+# Connection pool and retry settings, tunable per deployment
+BACKEND_POOL_LIMIT = int(os.getenv("BACKEND_POOL_LIMIT", "100"))
+BACKEND_POOL_LIMIT_PER_HOST = int(os.getenv("BACKEND_POOL_LIMIT_PER_HOST", "50"))
+BACKEND_KEEPALIVE_TIMEOUT = float(os.getenv("BACKEND_KEEPALIVE_TIMEOUT", "30"))
+BACKEND_TIMEOUT = float(os.getenv("BACKEND_TIMEOUT", "5"))
+BACKEND_CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "2"))
+BACKEND_RETRIES = int(os.getenv("BACKEND_RETRIES", "2"))
+BACKEND_RETRY_BACKOFF = float(os.getenv("BACKEND_RETRY_BACKOFF", "0.1"))
+
+RETRYABLE_STATUSES = {502, 503, 504}
+
+
+class BackendClient:
+    """
+    Long-lived HTTP client for the TssVPN backend.
+    One aiohttp session (and so one keep-alive connection pool) is shared by
+    every handler; it is opened in main() and closed on shutdown.
+    """
+
+    def __init__(self, base_url: str = BACKEND_URL):
+        self.base_url = base_url.rstrip("/") if base_url else base_url
+        self.session: Optional[aiohttp.ClientSession] = None
+        # path -> (etag, payload) for conditional GETs
+        self._etags: Dict[str, Tuple[str, Any]] = {}
+
+    async def start(self):
+        if self.session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=BACKEND_POOL_LIMIT,
+            limit_per_host=BACKEND_POOL_LIMIT_PER_HOST,
+            keepalive_timeout=BACKEND_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(total=BACKEND_TIMEOUT, connect=BACKEND_CONNECT_TIMEOUT)
+        if not BOT_API_SECRET:
+            logging.warning("BOT_API_SECRET is not set, the backend will refuse the site config and purchases")
+        headers = {"X-Bot-Secret": BOT_API_SECRET} if BOT_API_SECRET else None
+        self.session = aiohttp.ClientSession(base_url=self.base_url or None, connector=connector, timeout=timeout,
+                                             headers=headers)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def request(self, method: str, path: str, retries: Optional[int] = None, **kwargs) -> Tuple[int, Any, Any]:
+        """
+        Send a request and return (status, parsed JSON body or None, headers).
+        Connection errors, timeouts and 502/503/504 are retried with jittered
+        exponential backoff, at most `retries` times.
+        """
+        if self.session is None:
+            raise RuntimeError("BackendClient is not started")
+        if retries is None:
+            retries = BACKEND_RETRIES
+
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(method, path, **kwargs) as response:
+                    if response.status in RETRYABLE_STATUSES and attempt < retries:
+                        raise aiohttp.ClientResponseError(
+                            response.request_info, response.history, status=response.status
+                        )
+                    data = None
+                    if response.content_type == "application/json":
+                        data = await response.json()
+                    return response.status, data, response.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= retries:
+                    raise
+                delay = BACKEND_RETRY_BACKOFF * (2 ** attempt)
+                delay = random.uniform(0, delay)  # full jitter
+                logging.warning(f"Backend {method} {path} failed ({e}), retrying in {delay:.2f}s")
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def get_json(self, path: str) -> Optional[Any]:
+        """GET a JSON resource, returning None for any non-200 answer."""
+        status, data, _ = await self.request("GET", path)
+        if status == 200:
+            return data
+        return None
+
+    async def get_cached_json(self, path: str) -> Optional[Any]:
+        """
+        GET a JSON resource with If-None-Match, reusing the last payload when
+        the backend answers 304. The path must accept X-Bot-Secret.
+        """
+        headers = {}
+        cached = self._etags.get(path)
+        if cached:
+            headers["If-None-Match"] = cached[0]
+
+        status, data, response_headers = await self.request("GET", path, headers=headers)
+        if status == 304 and cached:
+            return cached[1]
+        if status in (401, 403):
+            logging.warning(f"Backend refused GET {path} with {status}, check BOT_API_SECRET")
+            return None
+        if status != 200:
+            return None
+        etag = response_headers.get("ETag")
+        if etag:
+            self._etags[path] = (etag, data)
+        return data
+
+
+backend = BackendClient()
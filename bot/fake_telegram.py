@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for Telegram, to exercise the bot's webhook mode.
+
+Starts a fake Bot API (and the one backend route the bot reads, with the
+real backend's X-Bot-Secret check and ETag), spawns
+`main.py` with BOT_MODE=webhook pointed at it, then POSTs /start updates
+to the webhook the way Telegram would and waits for every reply. Reports
+latency from update to sendMessage, throughput, per-chat ordering, and
+checks that a wrong secret is refused and that updates accepted right
+before SIGTERM are still answered.
+
+    python fake_telegram.py                                # 2000 updates, 200 chats
+    python fake_telegram.py --updates 20000 --chats 5000 --concurrency 100 \\
+        --api-delay 0.05 --workers 32
+"""
+import argparse
+import asyncio
+import os
+import secrets
+import signal
+import socket
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import aiohttp
+from aiohttp import web
+
+BOT_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_TOKEN = "123456:fake-telegram"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class FakeTelegram:
+    """Bot API methods the bot calls, recording every reply."""
+
+    def __init__(self, api_delay: float, bot_secret: str):
+        self.api_delay = api_delay
+        self.bot_secret = bot_secret
+        self.config_refused = 0
+        self.webhook = asyncio.get_running_loop().create_future()
+        self.sent_at = {}  # (chat_id, seq) -> time the update was posted
+        self.latencies = []
+        self.replies = defaultdict(list)  # chat_id -> seqs in reply order
+        self.all_replied = asyncio.Event()
+        self.expected = 0
+        self.message_id = 0
+
+    async def bot_api(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        data = dict(await request.post()) if request.can_read_body else {}
+        if method == "setwebhook":
+            if not self.webhook.done():
+                self.webhook.set_result(data)
+            return web.json_response({"ok": True, "result": True})
+        if method != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+
+        if self.api_delay:
+            await asyncio.sleep(self.api_delay)
+        chat_id = int(data["chat_id"])
+        # Reply text is "Hi n<seq>", see admin_config()
+        seq = int(data["text"].rsplit("n", 1)[1])
+        sent_at = self.sent_at.pop((chat_id, seq), None)
+        if sent_at is not None:
+            self.latencies.append(time.perf_counter() - sent_at)
+        self.replies[chat_id].append(seq)
+        self.message_id += 1
+        if sum(len(seqs) for seqs in self.replies.values()) >= self.expected:
+            self.all_replied.set()
+        return web.json_response({"ok": True, "result": {
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": data["text"],
+        }})
+
+    async def admin_config(self, request: web.Request) -> web.Response:
+        # Same rules as the backend's GET /admin/config for a caller without a token
+        if request.headers.get("X-Bot-Secret") != self.bot_secret:
+            self.config_refused += 1
+            return web.json_response({"detail": "Not authenticated"}, status=401)
+        etag = '"fake-config-1"'
+        if request.headers.get("If-None-Match") == etag:
+            return web.Response(status=304, headers={"ETag": etag})
+        return web.json_response({"bot_welcome_message": "Hi {name}"}, headers={"ETag": etag})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.bot_api)
+        app.router.add_get("/admin/config", self.admin_config)
+        return app
+
+
+def start_update(update_id: int, chat_id: int, seq: int) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"n{seq}"},
+            "text": "/start",
+        },
+    }
+
+
+async def post_updates(session, url, secret, fake, updates, concurrency):
+    """POST (chat_id, seq) updates in order per chat; returns status counts."""
+    statuses = defaultdict(int)
+    by_chat = defaultdict(list)
+    for update_id, (chat_id, seq) in enumerate(updates, start=1):
+        by_chat[chat_id].append((update_id, seq))
+    chats = list(by_chat.items())
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send_chat(chat_id, items):
+        # Like Telegram, one chat's updates are delivered one after another
+        for update_id, seq in items:
+            async with semaphore:
+                fake.sent_at[(chat_id, seq)] = time.perf_counter()
+                async with session.post(url, json=start_update(update_id, chat_id, seq),
+                                        headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as response:
+                    statuses[response.status] += 1
+                    if response.status != 200:
+                        fake.sent_at.pop((chat_id, seq), None)
+
+    await asyncio.gather(*(send_chat(chat_id, items) for chat_id, items in chats))
+    return statuses
+
+
+async def wait_ready(session, health_url, process):
+    for _ in range(100):
+        if process.returncode is not None:
+            raise SystemExit("Bot exited during startup")
+        try:
+            async with session.get(health_url) as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.1)
+    raise SystemExit("Bot webhook server did not become ready in time")
+
+
+async def run(args):
+    bot_secret = secrets.token_urlsafe(24)
+    fake = FakeTelegram(args.api_delay, bot_secret)
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    api_port, webhook_port = free_port(), free_port()
+    await web.TCPSite(runner, "127.0.0.1", api_port).start()
+    api_url = f"http://127.0.0.1:{api_port}"
+
+    secret = secrets.token_urlsafe(24)
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, "main.py", cwd=BOT_DIR,
+        env={
+            **os.environ,
+            "BOT_TOKEN": BOT_TOKEN,
+            "BOT_MODE": "webhook",
+            "TELEGRAM_API_URL": api_url,
+            "BACKEND_URL": api_url,
+            "WEBHOOK_BASE_URL": f"http://127.0.0.1:{webhook_port}",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(webhook_port),
+            "WEBHOOK_SECRET": secret,
+            "BOT_API_SECRET": bot_secret,
+            "BOT_UPDATE_WORKERS": str(args.workers),
+            "BOT_UPDATE_QUEUE_SIZE": str(args.queue_size),
+        },
+    )
+    ok = True
+    try:
+        connector = aiohttp.TCPConnector(limit=args.concurrency)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            await wait_ready(session, f"http://127.0.0.1:{webhook_port}/health", process)
+            webhook = await asyncio.wait_for(fake.webhook, 10)
+            url = webhook["url"]
+            print(f"🚀 Webhook registered: {url} (workers={args.workers}, api delay={args.api_delay * 1000:.0f} ms)")
+
+            async with session.post(url, json=start_update(0, 1, 0),
+                                    headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+                print(f"wrong secret -> {response.status}")
+                ok &= response.status == 401
+
+            updates = [(1000 + i % args.chats, i) for i in range(args.updates)]
+            fake.expected = args.updates
+            start = time.perf_counter()
+            statuses = await post_updates(session, url, secret, fake, updates, args.concurrency)
+            accepted = statuses.get(200, 0)
+            fake.expected = accepted
+            if sum(len(seqs) for seqs in fake.replies.values()) >= accepted:
+                fake.all_replied.set()
+            try:
+                await asyncio.wait_for(fake.all_replied.wait(), args.timeout)
+            except asyncio.TimeoutError:
+                ok = False
+            elapsed = time.perf_counter() - start
+
+            replied = sum(len(seqs) for seqs in fake.replies.values())
+            out_of_order = sum(1 for seqs in fake.replies.values() if seqs != sorted(seqs))
+            latencies = sorted(fake.latencies)
+            print(f"\n📊 {args.updates} updates to {args.chats} chats in {elapsed:.2f}s "
+                  f"({replied / elapsed:.0f} replies/s)")
+            print(f"responses: {dict(statuses)}  replies: {replied}/{accepted}  chats out of order: {out_of_order}")
+            print(f"update -> reply ms: p50 {percentile(latencies, 50) * 1000:.1f}  "
+                  f"p95 {percentile(latencies, 95) * 1000:.1f}  p99 {percentile(latencies, 99) * 1000:.1f}  "
+                  f"mean {statistics.mean(latencies) * 1000 if latencies else 0:.1f}")
+            ok &= replied == accepted and out_of_order == 0
+
+            # Graceful drain: a burst accepted just before SIGTERM is still answered
+            fake.replies.clear()
+            burst = [(5000 + i % args.chats, i) for i in range(args.drain_burst)]
+            fake.all_replied.clear()
+            fake.expected = args.drain_burst
+            statuses = await post_updates(session, url, secret, fake, burst, args.concurrency)
+            process.send_signal(signal.SIGTERM)
+            await asyncio.wait_for(process.wait(), args.timeout)
+            replied = sum(len(seqs) for seqs in fake.replies.values())
+            print(f"\n🛑 SIGTERM after {statuses.get(200, 0)} accepted updates: {replied} answered, "
+                  f"exit code {process.returncode}")
+            ok &= replied == statuses.get(200, 0) and process.returncode == 0
+
+            print(f"config reads refused by the backend: {fake.config_refused}")
+            ok &= fake.config_refused == 0
+    finally:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        await runner.cleanup()
+
+    print("\n✅ OK" if ok else "\n❌ FAILED")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive the bot's webhook mode with a fake Telegram")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=40, help="parallel webhook requests, like max_connections")
+    parser.add_argument("--workers", type=int, default=16, help="BOT_UPDATE_WORKERS for the bot")
+    parser.add_argument("--queue-size", type=int, default=2000, help="BOT_UPDATE_QUEUE_SIZE for the bot")
+    parser.add_argument("--api-delay", type=float, default=0.02, help="seconds the fake sendMessage takes")
+    parser.add_argument("--drain-burst", type=int, default=200)
+    parser.add_argument("--timeout", type=float, default=60)
+    args = parser.parse_args()
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
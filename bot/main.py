@@ -7,15 +7,21 @@ from aiogram.enums import ParseMode
 from aiogram.filters import CommandStart
 from aiogram.types import Message
 from aiogram.client.default import DefaultBotProperties
-import aiohttp
-import json
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from backend import backend
+from webhook import run_webhook
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 
 # Initialize Bot
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-BACKEND_URL = os.getenv("BACKEND_URL", "http://tss_site_backend:8000")
+BACKEND_URL = backend.base_url
+# "polling" for development, "webhook" to receive updates over HTTPS (see webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Bot API server; set for a local Bot API server or fake_telegram.py
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
 
 dp = Dispatcher()
 bot = None
@@ -29,15 +35,9 @@ async def ensure_user_exists(user_id: int, first_name: str = "", last_name: str
         return None
 
     try:
-        async with aiohttp.ClientSession() as session:
-            # Make request to backend to check if user exists
-            async with session.get(f"{BACKEND_URL}/users/check/{user_id}") as response:
-                if response.status == 200:
-                    data = await response.json()
-                    return data
-                else:
-                    # User doesn't exist, return None to indicate this
-                    return None
+        # Make request to backend to check if user exists
+        # None indicates the user doesn't exist
+        return await backend.get_json(f"/users/check/{user_id}")
     except Exception as e:
         logging.error(f"Error checking user existence: {e}")
         return None
@@ -52,21 +52,20 @@ async def create_or_update_user_in_backend(user_info):
         return None
 
     try:
-        async with aiohttp.ClientSession() as session:
-            # Prepare data for Telegram auth callback (this will create/update the user)
-            auth_data = {
-                'id': str(user_info.id),
-                'first_name': user_info.first_name or '',
-                'last_name': user_info.last_name or '',
-                'username': user_info.username or '',
-                'photo_url': getattr(user_info, 'photo_url', ''),
-                # We'll generate a temporary auth_date and hash for internal processing
-                # The actual validation happens when users come from the web
-            }
-            
-            # We'll store the user data temporarily and return a special login URL
-            # The real authentication will happen when the user visits the web page
-            return f"{BACKEND_URL}/auth/telegram/callback"
+        # Prepare data for Telegram auth callback (this will create/update the user)
+        auth_data = {
+            'id': str(user_info.id),
+            'first_name': user_info.first_name or '',
+            'last_name': user_info.last_name or '',
+            'username': user_info.username or '',
+            'photo_url': getattr(user_info, 'photo_url', ''),
+            # We'll generate a temporary auth_date and hash for internal processing
+            # The actual validation happens when users come from the web
+        }
+        
+        # We'll store the user data temporarily and return a special login URL
+        # The real authentication will happen when the user visits the web page
+        return f"{BACKEND_URL}/auth/telegram/callback"
     except Exception as e:
         logging.error(f"Error preparing user data: {e}")
         return None
@@ -76,10 +75,8 @@ async def get_site_config():
     if not BACKEND_URL:
         return None
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{BACKEND_URL}/admin/config") as response:
-                if response.status == 200:
-                    return await response.json()
+        # Conditional GET: the backend answers 304 while the config is unchanged
+        return await backend.get_cached_json("/admin/config")
     except Exception as e:
         logging.error(f"Error fetching site config: {e}")
     return None
@@ -134,11 +131,21 @@ async def main() -> None:
         logging.error("BOT_TOKEN is not set")
         return
         
-    bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-    
-    # We don't need to fetch config here, we fetch it per request or could cache it
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=BOT_TOKEN, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
     
-    await dp.start_polling(bot)
+    # One pooled keep-alive session for every backend call
+    await backend.start()
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # getUpdates is refused while a webhook is set
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await backend.close()
+        await bot.session.close()
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.INFO, stream=sys.stdout)
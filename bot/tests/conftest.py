@@ -0,0 +1,11 @@
+"""
+Shared helpers. Tests drive the bot's modules against small aiohttp servers
+on localhost; nothing talks to Telegram or the real backend.
+
+    cd bot && python -m pytest
+"""
+import os
+import sys
+
+os.environ.setdefault("BOT_API_SECRET", "test-bot-secret")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
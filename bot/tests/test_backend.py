@@ -0,0 +1,78 @@
+import asyncio
+
+from aiohttp import web
+
+import backend as backend_module
+from backend import BackendClient
+
+ETAG = '"config-1"'
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def run_with_server(handler, scenario):
+    async def main():
+        runner, url = await serve(handler)
+        client = BackendClient(url)
+        await client.start()
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_cached_json_sends_bot_secret_and_reuses_payload_on_304():
+    seen = []
+
+    async def admin_config(request):
+        seen.append((request.headers.get("X-Bot-Secret"), request.headers.get("If-None-Match")))
+        if request.headers.get("X-Bot-Secret") != "test-bot-secret":
+            return web.json_response({"detail": "Not authenticated"}, status=401)
+        if request.headers.get("If-None-Match") == ETAG:
+            return web.Response(status=304, headers={"ETag": ETAG})
+        return web.json_response({"bot_welcome_message": "Hi"}, headers={"ETag": ETAG})
+
+    async def scenario(client):
+        return await client.get_cached_json("/admin/config"), await client.get_cached_json("/admin/config")
+
+    first, second = run_with_server(admin_config, scenario)
+    assert first == second == {"bot_welcome_message": "Hi"}
+    assert seen == [("test-bot-secret", None), ("test-bot-secret", ETAG)]
+
+
+def test_refused_read_returns_none():
+    async def refuse(request):
+        return web.json_response({"detail": "Not authenticated"}, status=401)
+
+    async def scenario(client):
+        return await client.get_cached_json("/admin/config")
+
+    assert run_with_server(refuse, scenario) is None
+
+
+def test_retries_gateway_errors(monkeypatch):
+    monkeypatch.setattr(backend_module, "BACKEND_RETRY_BACKOFF", 0)
+    calls = []
+
+    async def flaky(request):
+        calls.append(1)
+        if len(calls) < 3:
+            return web.Response(status=503)
+        return web.json_response({"ok": True})
+
+    async def scenario(client):
+        return await client.request("GET", "/users/check/1", retries=2)
+
+    status, data, _ = run_with_server(flaky, scenario)
+    assert (status, data, len(calls)) == (200, {"ok": True}, 3)
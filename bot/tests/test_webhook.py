@@ -0,0 +1,107 @@
+import asyncio
+
+from aiogram import Bot
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, UpdateQueue, _shard_key, build_app
+
+SECRET = "webhook-secret"
+
+
+def message(update_id, chat_id, text="hi"):
+    return {
+        "update_id": update_id,
+        "message": {"message_id": update_id, "date": 0, "text": text,
+                    "chat": {"id": chat_id, "type": "private"}},
+    }
+
+
+class RecordingDispatcher:
+    """Stands in for aiogram's Dispatcher; records the updates fed to it."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.handled = []
+
+    async def feed_update(self, bot, update):
+        await asyncio.sleep(self.delay)
+        self.handled.append((update.message.chat.id, update.message.text))
+
+
+def run_with_queue(scenario, workers=4, maxsize=100, delay=0.0):
+    async def main():
+        bot = Bot("123456:test-token")
+        dp = RecordingDispatcher(delay)
+        queue = UpdateQueue(dp, bot, workers=workers, maxsize=maxsize)
+        try:
+            return await scenario(queue, dp)
+        finally:
+            await bot.session.close()
+    return asyncio.run(main())
+
+
+def test_updates_are_sharded_by_chat_or_sender():
+    assert _shard_key(message(1, 42)) == 42
+    callback = {"update_id": 2, "callback_query": {"id": "x", "from": {"id": 7},
+                                                   "message": {"chat": {"id": -100}}}}
+    assert _shard_key(callback) == -100
+    assert _shard_key({"update_id": 3, "inline_query": {"id": "q", "from": {"id": 9}}}) == 9
+    assert _shard_key({"update_id": 4, "poll": {"id": "p"}}) == 4
+
+
+def test_each_chat_is_handled_in_order():
+    async def scenario(queue, dp):
+        queue.start()
+        for i in range(20):
+            assert queue.put(message(i, chat_id=i % 3, text=str(i)))
+        await queue.drain(timeout=5)
+        return dp.handled
+
+    handled = run_with_queue(scenario, delay=0.001)
+    assert len(handled) == 20
+    for chat in range(3):
+        texts = [int(text) for chat_id, text in handled if chat_id == chat]
+        assert texts == sorted(texts)
+
+
+def test_full_or_draining_queue_refuses_updates():
+    async def scenario(queue, dp):
+        refused_before_start = queue.put(message(1, 5))
+        queue.accepting = True  # accept without workers, so the shard fills up
+        accepted = [queue.put(message(i, 5)) for i in range(3)]
+        return refused_before_start, accepted
+
+    refused_before_start, accepted = run_with_queue(scenario, workers=2, maxsize=4)
+    assert refused_before_start is False
+    # Shards hold ceil(4 / 2) updates each
+    assert accepted == [True, True, False]
+
+
+def test_webhook_checks_the_secret_and_pushes_back_when_full():
+    async def scenario(queue, dp):
+        queue.accepting = True
+        client = TestClient(TestServer(build_app(queue, secret=SECRET, path="/hook")))
+        await client.start_server()
+        try:
+            statuses = []
+            for headers, body in [
+                ({}, message(1, 5)),
+                ({SECRET_HEADER: "wrong"}, message(2, 5)),
+                ({SECRET_HEADER: SECRET}, message(3, 5)),
+                ({SECRET_HEADER: SECRET}, message(4, 5)),
+            ]:
+                response = await client.post("/hook", json=body, headers=headers)
+                statuses.append((response.status, response.headers.get("Retry-After")))
+            bad_json = await client.post("/hook", data="{", headers={SECRET_HEADER: SECRET})
+            health = await (await client.get("/health")).json()
+            queue.accepting = False
+            draining = await client.get("/health")
+            return statuses, bad_json.status, health, draining.status
+        finally:
+            await client.close()
+
+    statuses, bad_json, health, draining = run_with_queue(scenario, workers=1, maxsize=1)
+    assert statuses == [(401, None), (401, None), (200, None), (503, "1")]
+    assert bad_json == 400
+    assert health == {"status": "ok", "queued": 1}
+    assert draining == 503
@@ -0,0 +1,172 @@
+import asyncio
+import hmac
+import logging
+import os
+import signal
+from typing import List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+# Public HTTPS base Telegram posts to, e.g. https://bot.tssvpn.com
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/bot/webhook")
+# Sent back by Telegram in X-Telegram-Bot-Api-Secret-Token (1-256 of A-Z a-z 0-9 _ -)
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Parallel HTTPS connections Telegram may open to us (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+BOT_UPDATE_WORKERS = int(os.getenv("BOT_UPDATE_WORKERS", "16"))
+BOT_UPDATE_QUEUE_SIZE = int(os.getenv("BOT_UPDATE_QUEUE_SIZE", "2000"))
+# Seconds to finish queued updates on shutdown before dropping them
+BOT_DRAIN_TIMEOUT = float(os.getenv("BOT_DRAIN_TIMEOUT", "20"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def _shard_key(update: dict) -> int:
+    """Chat (or sender) id of a raw update, so one chat's updates stay in order."""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+        sender = event.get("from") or event.get("user")
+        if sender and "id" in sender:
+            return sender["id"]
+    return update.get("update_id", 0)
+
+
+class UpdateQueue:
+    """
+    Bounded in-process queue of raw updates, handled by `workers` tasks.
+    The queue is split into one shard per worker, keyed by chat, so a chat's
+    updates are handled one at a time and in arrival order while different
+    chats run concurrently.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int = BOT_UPDATE_WORKERS,
+                 maxsize: int = BOT_UPDATE_QUEUE_SIZE):
+        self.dp = dp
+        self.bot = bot
+        shard_size = max(1, -(-maxsize // workers))
+        self.shards: List[asyncio.Queue] = [asyncio.Queue(maxsize=shard_size) for _ in range(workers)]
+        self.accepting = False
+        self._tasks: List[asyncio.Task] = []
+
+    def put(self, update: dict) -> bool:
+        """Queue an update; False when its shard is full or the queue is draining."""
+        if not self.accepting:
+            return False
+        try:
+            self.shards[_shard_key(update) % len(self.shards)].put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    def qsize(self) -> int:
+        return sum(shard.qsize() for shard in self.shards)
+
+    def start(self):
+        self.accepting = True
+        self._tasks = [asyncio.create_task(self._worker(shard)) for shard in self.shards]
+
+    async def _worker(self, shard: asyncio.Queue):
+        while True:
+            raw = await shard.get()
+            try:
+                update = Update.model_validate(raw, context={"bot": self.bot})
+                await self.dp.feed_update(self.bot, update)
+            except Exception:
+                logging.exception(f"Failed to handle update {raw.get('update_id')}")
+            finally:
+                shard.task_done()
+
+    async def drain(self, timeout: float = BOT_DRAIN_TIMEOUT):
+        """Stop accepting, finish what is queued (up to `timeout` seconds), stop the workers."""
+        self.accepting = False
+        pending = self.qsize()
+        try:
+            await asyncio.wait_for(asyncio.gather(*(shard.join() for shard in self.shards)), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Drain timed out, dropping {self.qsize()} queued updates")
+        else:
+            if pending:
+                logging.info(f"Drained {pending} queued updates")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def build_app(queue: UpdateQueue, secret: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH) -> web.Application:
+    expected = secret.encode()
+
+    async def receive_update(request: web.Request) -> web.Response:
+        received = request.headers.get(SECRET_HEADER, "").encode()
+        if not hmac.compare_digest(received, expected):
+            return web.Response(status=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        # Any non-2xx makes Telegram redeliver later, possibly to another instance
+        if not isinstance(update, dict) or not queue.put(update):
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        if not queue.accepting:
+            return web.json_response({"status": "draining"}, status=503)
+        return web.json_response({"status": "ok", "queued": queue.qsize()})
+
+    app = web.Application()
+    app.router.add_post(path, receive_update)
+    app.router.add_get("/health", health)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Serve updates until SIGTERM/SIGINT, then stop listening and drain the queue.
+    The webhook is (re)registered at start and left in place on exit, so other
+    instances behind the same URL keep receiving updates.
+    """
+    if not WEBHOOK_SECRET:
+        logging.error("WEBHOOK_SECRET is not set")
+        return
+
+    queue = UpdateQueue(dp, bot)
+    queue.start()
+    # No access log: one line per update is pure overhead at broadcast rates
+    runner = web.AppRunner(build_app(queue), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logging.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    if WEBHOOK_BASE_URL:
+        await bot.set_webhook(
+            f"{WEBHOOK_BASE_URL.rstrip('/')}{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    else:
+        logging.warning("WEBHOOK_BASE_URL is not set, not registering the webhook")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        logging.info("Shutting down webhook server")
+        # Refuse new updates first (Telegram retries them), then finish the queued ones
+        queue.accepting = False
+        await runner.cleanup()
+        await queue.drain()
@@ -30,8 +30,9 @@ export default function AuthPage() {
           // Отправляем токен в родительское окно
           window.opener.postMessage({
             type: 'TELEGRAM_AUTH_SUCCESS',
-            token: data.access_token
-          }, '*');
+            token: data.access_token,
+            refresh_token: data.refresh_token
+          }, window.location.origin); // только своему сайту: в сообщении токены
           
           // Закрываем всплывающее окно
           window.close();
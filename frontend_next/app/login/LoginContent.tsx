@@ -25,8 +25,10 @@ export default function LoginContent() {
     // Listen for messages from the auth popup window
     useEffect(() => {
         const handleMessage = (event: any) => {
+            // Tokens only come from our own auth popup
+            if (event.origin !== window.location.origin) return;
             if (event.data.type === 'TELEGRAM_AUTH_SUCCESS') {
-                setToken(event.data.token);
+                setToken(event.data.token, event.data.refresh_token);
                 // Construct the final redirect URL with preserved params
                 let finalUrl = redirectPath;
                 if (plan || loc) {
@@ -47,12 +47,14 @@ export default function NewTelegramAuth() {
   // Listen for messages from the auth popup window
   useEffect(() => {
     const handleMessage = (event: MessageEvent) => {
+      // Tokens only come from our own auth popup
+      if (event.origin !== window.location.origin) return;
       if (event.data.type === 'TELEGRAM_AUTH_SUCCESS') {
         // Stop loading state
         setLoading(false);
         // We set the token here just in case, but the parent component (LoginContent)
         // should also be listening to this event to handle the redirect.
-        setToken(event.data.token);
+        setToken(event.data.token, event.data.refresh_token);
       }
     };
 
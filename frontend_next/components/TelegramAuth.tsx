@@ -10,8 +10,10 @@ export default function TelegramAuth() {
   // Listen for messages from the auth popup window
   useEffect(() => {
     const handleMessage = (event: MessageEvent) => {
+      // Tokens only come from our own auth popup
+      if (event.origin !== window.location.origin) return;
       if (event.data.type === 'TELEGRAM_AUTH_SUCCESS') {
-        setToken(event.data.token);
+        setToken(event.data.token, event.data.refresh_token);
         router.push('/dashboard');
       }
     };
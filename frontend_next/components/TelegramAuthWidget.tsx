@@ -22,8 +22,10 @@ export default function TelegramAuthWidget() {
 
     // Handle message events from popup windows
     const handleMessage = (event: MessageEvent) => {
+      // Tokens only come from our own auth popup
+      if (event.origin !== window.location.origin) return;
       if (event.data.type === 'TELEGRAM_AUTH_SUCCESS') {
-        setToken(event.data.token);
+        setToken(event.data.token, event.data.refresh_token);
         router.push('/dashboard');
       }
     };
@@ -61,7 +61,7 @@ export default function TelegramLoginButton() {
 
                 // Store the token and redirect to dashboard
                 if (data.access_token) {
-                  setToken(data.access_token);
+                  setToken(data.access_token, data.refresh_token);
                   router.push('/dashboard');
                 }
               } else {
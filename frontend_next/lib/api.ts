@@ -5,6 +5,7 @@ const API_BASE = "/api";
 export interface AuthResponse {
     access_token: string;
     token_type: string;
+    refresh_token?: string;
 }
 
 export interface UserProfile {
@@ -46,12 +47,45 @@ export function getToken(): string | null {
     return localStorage.getItem("token");
 }
 
-export function setToken(token: string): void {
+export function setToken(token: string, refreshToken?: string): void {
     localStorage.setItem("token", token);
+    if (refreshToken) {
+        localStorage.setItem("refresh_token", refreshToken);
+    }
 }
 
 export function clearToken(): void {
     localStorage.removeItem("token");
+    localStorage.removeItem("refresh_token");
+}
+
+// Concurrent 401s share one refresh; each refresh token works only once
+let refreshing: Promise<boolean> | null = null;
+
+async function refreshAccessToken(): Promise<boolean> {
+    const refreshToken = localStorage.getItem("refresh_token");
+    if (!refreshToken) return false;
+    if (!refreshing) {
+        refreshing = fetch(`${API_BASE}/auth/refresh`, {
+            method: "POST",
+            headers: { "Content-Type": "application/json" },
+            body: JSON.stringify({ refresh_token: refreshToken }),
+        })
+            .then(async (response) => {
+                if (!response.ok) {
+                    clearToken();
+                    return false;
+                }
+                const data: AuthResponse = await response.json();
+                setToken(data.access_token, data.refresh_token);
+                return true;
+            })
+            .catch(() => false)
+            .finally(() => {
+                refreshing = null;
+            });
+    }
+    return refreshing;
 }
 
 export function isLoggedIn(): boolean {
@@ -61,7 +95,8 @@ export function isLoggedIn(): boolean {
 // API helper
 async function apiRequest<T>(
     endpoint: string,
-    options: RequestInit = {}
+    options: RequestInit = {},
+    retried = false
 ): Promise<T> {
     const token = getToken();
 
@@ -76,6 +111,11 @@ async function apiRequest<T>(
         headers,
     });
 
+    // Expired access token: renew it once instead of sending the user to log in again
+    if (response.status === 401 && token && !retried && (await refreshAccessToken())) {
+        return apiRequest<T>(endpoint, options, true);
+    }
+
     if (!response.ok) {
         const error = await response.json().catch(() => ({}));
         throw new Error(error.detail || `Request failed: ${response.status}`);
@@ -90,7 +130,7 @@ export async function login(username: string, password: string): Promise<AuthRes
         method: "POST",
         body: JSON.stringify({ username, password }),
     });
-    setToken(data.access_token);
+    setToken(data.access_token, data.refresh_token);
     return data;
 }
 
@@ -0,0 +1,502 @@
+#!/usr/bin/env python3
+"""
+Concurrent load test for the TssVPN backend.
+
+Runs weighted request scenarios from many asyncio workers, optionally paced to a
+fixed request rate, and reports p50/p95/p99 latency, throughput and an error
+breakdown per endpoint. Results are written as JSON so runs can be compared
+between commits (see --compare).
+
+Against an already running backend:
+    python load_test.py --base-url http://localhost:8000 --bot-token $BOT_TOKEN
+
+Self-contained run (spawns the backend on SQLite plus a mocked Marzban):
+    python load_test.py --spawn --concurrency 50 --rate 200 --duration 30
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+import httpx
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app")
+
+# Telegram ids used by the load test; the first one is promoted to admin
+ADMIN_TG_ID = 990000000
+USER_TG_IDS = range(990000001, 990000201)
+WEB_USERS = [(f"loadtest_user_{i}", f"loadtest_password_{i}") for i in range(20)]
+
+
+# --- Telegram signatures ---
+
+def sign_telegram_auth(auth_data: dict, bot_token: str) -> dict:
+    """Return a copy of auth_data with a valid Login Widget `hash`."""
+    data = {k: str(v) for k, v in auth_data.items() if k != "hash"}
+    check_items = {k: v for k, v in data.items() if not (k == "photo_url" and not v)}
+    data_check_string = "\n".join(f"{k}={v}" for k, v in sorted(check_items.items()))
+    secret_key = hashlib.sha256(bot_token.encode()).digest()
+    data["hash"] = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    return data
+
+
+def telegram_payload(tg_id: int, bot_token: str) -> dict:
+    # The nonce is signed with the rest, so repeated logins of one id are not replays
+    return sign_telegram_auth({
+        "id": tg_id,
+        "first_name": "Load",
+        "last_name": "Test",
+        "username": f"lt_{tg_id}",
+        "photo_url": "",
+        "auth_date": int(time.time()),
+        "nonce": os.urandom(8).hex(),
+    }, bot_token)
+
+
+# --- Statistics ---
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.errors = defaultdict(Counter)
+
+    def record(self, endpoint: str, latency: float, status=None, error=None):
+        self.latencies[endpoint].append(latency)
+        if status is not None:
+            self.statuses[endpoint][str(status)] += 1
+            if status >= 400:
+                self.errors[endpoint][f"HTTP {status}"] += 1
+        if error is not None:
+            self.errors[endpoint][error] += 1
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        total_requests = 0
+        total_errors = 0
+        all_latencies = []
+        for endpoint in sorted(self.latencies):
+            values = sorted(self.latencies[endpoint])
+            errors = sum(self.errors[endpoint].values())
+            total_requests += len(values)
+            total_errors += errors
+            all_latencies.extend(values)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "errors": errors,
+                "error_rate": errors / len(values) if values else 0.0,
+                "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+                "latency_ms": {
+                    "min": values[0] * 1000,
+                    "mean": sum(values) / len(values) * 1000,
+                    "p50": percentile(values, 50) * 1000,
+                    "p95": percentile(values, 95) * 1000,
+                    "p99": percentile(values, 99) * 1000,
+                    "max": values[-1] * 1000,
+                },
+                "status_codes": dict(self.statuses[endpoint]),
+                "error_breakdown": dict(self.errors[endpoint]),
+            }
+        all_latencies.sort()
+        return {
+            "elapsed_s": elapsed,
+            "requests": total_requests,
+            "errors": total_errors,
+            "throughput_rps": total_requests / elapsed if elapsed else 0.0,
+            "latency_ms": {
+                "p50": percentile(all_latencies, 50) * 1000,
+                "p95": percentile(all_latencies, 95) * 1000,
+                "p99": percentile(all_latencies, 99) * 1000,
+            },
+            "endpoints": endpoints,
+        }
+
+
+# --- Scenarios ---
+
+class Context:
+    """Shared state prepared before the run: tokens for users and the admin."""
+
+    def __init__(self, bot_token: str):
+        self.bot_token = bot_token
+        self.user_tokens = {}
+        self.admin_token = None
+
+    def random_user(self):
+        tg_id = random.choice(list(self.user_tokens))
+        return tg_id, {"Authorization": f"Bearer {self.user_tokens[tg_id]}"}
+
+    def admin_headers(self):
+        return {"Authorization": f"Bearer {self.admin_token}"}
+
+
+async def scenario_login(client, ctx):
+    username, password = random.choice(WEB_USERS)
+    return await client.post("/auth/login", json={"username": username, "password": password})
+
+
+async def scenario_telegram_callback(client, ctx):
+    payload = telegram_payload(random.choice(USER_TG_IDS), ctx.bot_token)
+    return await client.post("/auth/telegram/callback", data=payload)
+
+
+async def scenario_users_me(client, ctx):
+    _, headers = ctx.random_user()
+    return await client.get("/users/me", headers=headers)
+
+
+async def scenario_users_keys(client, ctx):
+    _, headers = ctx.random_user()
+    return await client.get("/users/keys", headers=headers)
+
+
+async def scenario_shop_buy(client, ctx):
+    tg_id, headers = ctx.random_user()
+    plan_id = random.choice(["plan_1m", "plan_3m", "plan_1y"])
+    # Both the JSON body and the query string, so either handler shape is exercised
+    return await client.post(
+        "/shop/buy",
+        params={"tg_id": tg_id, "plan_id": plan_id},
+        json={"plan_id": plan_id},
+        headers=headers,
+    )
+
+
+async def scenario_admin_stats(client, ctx):
+    return await client.get("/admin/stats", headers=ctx.admin_headers())
+
+
+async def scenario_admin_users(client, ctx):
+    return await client.get("/admin/users", headers=ctx.admin_headers())
+
+
+async def scenario_admin_config(client, ctx):
+    return await client.get("/admin/config", headers=ctx.admin_headers())
+
+
+# name -> (endpoint label, coroutine, default weight)
+SCENARIOS = {
+    "login": ("POST /auth/login", scenario_login, 2),
+    "telegram_callback": ("POST /auth/telegram/callback", scenario_telegram_callback, 2),
+    "users_me": ("GET /users/me", scenario_users_me, 10),
+    "users_keys": ("GET /users/keys", scenario_users_keys, 6),
+    "shop_buy": ("POST /shop/buy", scenario_shop_buy, 1),
+    "admin_stats": ("GET /admin/stats", scenario_admin_stats, 1),
+    "admin_users": ("GET /admin/users", scenario_admin_users, 1),
+    "admin_config": ("GET /admin/config", scenario_admin_config, 2),
+}
+
+
+def parse_scenarios(spec: str):
+    """Parse "users_me=10,login=2" (or "all") into a list of (name, weight)."""
+    if spec == "all":
+        return [(name, weight) for name, (_, _, weight) in SCENARIOS.items()]
+    selected = []
+    for item in spec.split(","):
+        name, _, weight = item.strip().partition("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario: {name} (choose from {', '.join(SCENARIOS)})")
+        selected.append((name, int(weight) if weight else SCENARIOS[name][2]))
+    return selected
+
+
+# --- Runner ---
+
+class Pacer:
+    """Hands out send slots at a fixed rate shared by all workers (open loop)."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate else 0.0
+        self.next_slot = time.perf_counter()
+        self.lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        async with self.lock:
+            slot = max(self.next_slot, time.perf_counter())
+            self.next_slot = slot + self.interval
+        delay = slot - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def worker(client, ctx, stats, scenarios, pacer, deadline, remaining):
+    names = [name for name, _ in scenarios]
+    weights = [weight for _, weight in scenarios]
+    while time.perf_counter() < deadline:
+        if remaining is not None:
+            if remaining[0] <= 0:
+                return
+            remaining[0] -= 1
+        await pacer.wait()
+        name = random.choices(names, weights)[0]
+        endpoint, func, _ = SCENARIOS[name]
+        start = time.perf_counter()
+        try:
+            response = await func(client, ctx)
+            stats.record(endpoint, time.perf_counter() - start, status=response.status_code)
+        except httpx.HTTPError as e:
+            stats.record(endpoint, time.perf_counter() - start, error=type(e).__name__)
+
+
+async def prepare(client, ctx, args):
+    """Create the users the scenarios need and collect their tokens."""
+    # Registration answers 400 for users left over from a previous run, which is fine
+    for username, password in WEB_USERS:
+        try:
+            await client.post("/auth/register", json={"username": username, "password": password})
+        except httpx.HTTPError:
+            pass
+
+    for tg_id in list(USER_TG_IDS) + [ADMIN_TG_ID]:
+        try:
+            response = await client.post("/auth/telegram/callback", data=telegram_payload(tg_id, ctx.bot_token))
+        except httpx.HTTPError:
+            continue
+        if response.status_code == 200:
+            ctx.user_tokens[tg_id] = response.json()["access_token"]
+    admin_token = ctx.user_tokens.pop(ADMIN_TG_ID, None)
+
+    if args.admin_token:
+        ctx.admin_token = args.admin_token
+    elif admin_token and args.sqlite_path:
+        promote_admin(args.sqlite_path, ADMIN_TG_ID)
+        ctx.admin_token = admin_token
+
+    if not ctx.user_tokens:
+        raise SystemExit("Could not obtain any user token via /auth/telegram/callback (check --bot-token)")
+    if not ctx.admin_token:
+        print("⚠️  No admin token (pass --admin-token); admin scenarios will report 401/403")
+
+
+def promote_admin(sqlite_path: str, tg_id: int):
+    conn = sqlite3.connect(sqlite_path)
+    try:
+        conn.execute("UPDATE users SET is_admin = 1 WHERE tg_id = ?", (tg_id,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+async def run_load(args):
+    ctx = Context(args.bot_token)
+    stats = Stats()
+    scenarios = parse_scenarios(args.scenarios)
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        await prepare(client, ctx, args)
+
+        pacer = Pacer(args.rate)
+        remaining = [args.requests] if args.requests else None
+        start = time.perf_counter()
+        deadline = start + args.duration
+        await asyncio.gather(*[
+            worker(client, ctx, stats, scenarios, pacer, deadline, remaining)
+            for _ in range(args.concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    return stats.summary(elapsed)
+
+
+# --- Local environment (--spawn) ---
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_mock_marzban(port: int):
+    """Serve the subset of the Marzban API the backend calls, in a daemon thread."""
+    import uvicorn
+    from fastapi import FastAPI
+
+    mock = FastAPI()
+
+    @mock.post("/api/admin/token")
+    async def token():
+        return {"access_token": "mock-marzban-token", "token_type": "bearer"}
+
+    @mock.post("/api/user")
+    async def create_user(payload: dict):
+        username = payload.get("username", "user")
+        return {"username": username, "subscription_url": f"vless://mock-{username}@127.0.0.1:443#TssVPN_{username}"}
+
+    @mock.get("/api/users")
+    async def list_users():
+        return {"users": [], "total": 0}
+
+    server = uvicorn.Server(uvicorn.Config(mock, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    return server
+
+
+def start_backend(port: int, env: dict):
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=APP_DIR,
+        env={**os.environ, **env},
+        stdout=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        if process.poll() is not None:
+            raise SystemExit("Backend exited during startup")
+        try:
+            if httpx.get(f"{base_url}/", timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise SystemExit("Backend did not become ready in time")
+
+
+# --- Reporting ---
+
+def print_report(summary: dict):
+    print(f"\n📊 {summary['requests']} requests in {summary['elapsed_s']:.1f}s "
+          f"({summary['throughput_rps']:.1f} req/s), {summary['errors']} errors")
+    header = f"{'endpoint':<30} {'reqs':>7} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}"
+    print(header)
+    print("-" * len(header))
+    for endpoint, data in summary["endpoints"].items():
+        latency = data["latency_ms"]
+        print(f"{endpoint:<30} {data['requests']:>7} {data['throughput_rps']:>8.1f} "
+              f"{latency['p50']:>9.2f} {latency['p95']:>9.2f} {latency['p99']:>9.2f} {data['errors']:>7}")
+        for error, count in sorted(data["error_breakdown"].items()):
+            print(f"    {error}: {count}")
+
+
+def print_comparison(summary: dict, baseline: dict, baseline_path: str):
+    print(f"\n🔁 Compared with {baseline_path}")
+    print(f"{'endpoint':<30} {'p50 Δ%':>9} {'p95 Δ%':>9} {'p99 Δ%':>9} {'rps Δ%':>9}")
+
+    def delta(new, old):
+        return (new - old) / old * 100 if old else 0.0
+
+    for endpoint, data in summary["endpoints"].items():
+        old = baseline["endpoints"].get(endpoint)
+        if not old:
+            continue
+        print(f"{endpoint:<30} "
+              f"{delta(data['latency_ms']['p50'], old['latency_ms']['p50']):>+9.1f} "
+              f"{delta(data['latency_ms']['p95'], old['latency_ms']['p95']):>+9.1f} "
+              f"{delta(data['latency_ms']['p99'], old['latency_ms']['p99']):>+9.1f} "
+              f"{delta(data['throughput_rps'], old['throughput_rps']):>+9.1f}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Concurrent load test for the TssVPN backend")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--bot-token", default=os.getenv("BOT_TOKEN", "123456:loadtest"))
+    parser.add_argument("--admin-token", default=None, help="JWT of an admin user for the admin scenarios")
+    parser.add_argument("--concurrency", type=int, default=20, help="number of concurrent workers")
+    parser.add_argument("--rate", type=float, default=0, help="target requests per second (0 = unpaced)")
+    parser.add_argument("--duration", type=float, default=15, help="run length in seconds")
+    parser.add_argument("--requests", type=int, default=0, help="stop after this many requests (0 = no limit)")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--scenarios", default="all", help='"all" or e.g. "users_me=10,login=2"')
+    parser.add_argument("--output", default="load_test_results.json")
+    parser.add_argument("--compare", default=None, help="previous results file to diff against")
+    parser.add_argument("--spawn", action="store_true", help="start a local backend and a mocked Marzban")
+    parser.add_argument("--database-url", default=None,
+                        help="DATABASE_URL for --spawn (default: a fresh SQLite file)")
+    parser.add_argument("--sqlite-path", default=None,
+                        help="SQLite file of the backend, used to promote the admin user")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    backend = None
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["summary"]
+
+    if args.spawn:
+        if not args.database_url:
+            args.sqlite_path = os.path.join(tempfile.mkdtemp(prefix="tssvpn-load-"), "loadtest.db")
+            args.database_url = f"sqlite+aiosqlite:///{args.sqlite_path}"
+        marzban_port = free_port()
+        start_mock_marzban(marzban_port)
+        backend, args.base_url = start_backend(free_port(), {
+            "DATABASE_URL": args.database_url,
+            "MARZBAN_URL": f"http://127.0.0.1:{marzban_port}",
+            "MARZBAN_USERNAME": "admin",
+            "MARZBAN_PASSWORD": "admin",
+            "BOT_TOKEN": args.bot_token,
+            "SECRET_KEY": "loadtest-secret",
+            # All load comes from one IP and a few hundred identities
+            "ADMISSION_ENABLED": "false",
+        })
+
+    print(f"🚀 Load testing {args.base_url}: concurrency={args.concurrency} "
+          f"rate={args.rate or 'unpaced'} duration={args.duration}s scenarios={args.scenarios}")
+    try:
+        summary = asyncio.run(run_load(args))
+    finally:
+        if backend:
+            backend.terminate()
+            backend.wait(timeout=10)
+
+    print_report(summary)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "git_revision": git_revision(),
+            "base_url": args.base_url,
+            "database_url": args.database_url,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "duration": args.duration,
+            "scenarios": args.scenarios,
+        },
+        "summary": summary,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+
+    if baseline:
+        print_comparison(summary, baseline, args.compare)
+
+
+if __name__ == "__main__":
+    main()